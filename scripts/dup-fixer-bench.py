@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+
+#this script is a benchmark for dup-fixer.py
+#it generates a synthetic directory tree with a known number of files, sizes, depth and duplicates in a temporary directory
+#and then times the scan (stat), hash (checksum) and resolve phases of dup-fixer.py on it for each requested hash algorithm
+#the results are written as json so that they can be compared between versions of dup-fixer.py
+#NOTE: files are generated from a seeded random number generator, so the same options always give the same tree
+
+import argparse
+import contextlib
+import hashlib
+import importlib.util
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+#the path of the dup-fixer script which is benchmarked by default
+DUP_FIXER_PATH=os.path.join(os.path.dirname(os.path.abspath(__file__)),'dup-fixer.py')
+
+#the ways that generated file sizes can be distributed between --min-size and --max-size
+#	loguniform: every order of magnitude is equally likely, so most files are small but some are large (like a home directory)
+#	uniform: every size is equally likely
+#	fixed: every file is --max-size bytes
+SIZE_DISTS=['loguniform','uniform','fixed']
+
+#this loads dup-fixer.py as a module
+#NOTE: the script's name isn't a valid module name so it can't just be imported
+#args:
+#	script_path: the path of the dup-fixer.py script to load
+#return:
+#	returns the loaded module
+#side-effects:
+#	runs the module-level code of the script (but not its __main__ block)
+def load_dup_fixer(script_path:str):
+	spec=importlib.util.spec_from_file_location('dup_fixer',script_path)
+	dup_fixer=importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(dup_fixer)
+	return dup_fixer
+
+#this picks a random file size from the requested distribution
+#args:
+#	rng: the random.Random instance to use
+#	size_dist: one of SIZE_DISTS
+#	min_size: the smallest size to pick
+#	max_size: the largest size to pick
+#return:
+#	returns a size in bytes
+#side-effects:
+#	advances the state of rng
+def random_size(rng:random.Random,size_dist:str,min_size:int,max_size:int) -> int:
+	if(size_dist=='fixed'):
+		return max_size
+	if(size_dist=='uniform'):
+		return rng.randint(min_size,max_size)
+	if(size_dist=='loguniform'):
+		return min(max_size,int(math.exp(rng.uniform(math.log(max(min_size,1)),math.log(max_size+1)))))
+	raise Exception('Err: Unsupported size distribution '+str(size_dist))
+
+#this generates a synthetic directory tree for benchmarking
+#args:
+#	root: the directory to generate the tree in; it must already exist
+#	file_cnt: the number of files to generate
+#	depth: the number of levels of subdirectories
+#	fanout: the number of subdirectories in each directory
+#	size_dist: how file sizes are distributed; one of SIZE_DISTS
+#	min_size: the smallest file size in bytes
+#	max_size: the largest file size in bytes
+#	dup_ratio: the fraction of files which are copies of an earlier file
+#	collide_ratio: the fraction of files which are not copies but have the same size, head and tail as an earlier file
+#		(they differ by one byte between the sampled head and tail) so they can only be told apart by a full checksum
+#		and exercise every stage of duplicate detection; files too small to have such a byte differ anywhere instead
+#	seed: the random seed
+#	sample_bytes: the size of the head and tail which dup-fixer samples (its SAMPLE_BYTES)
+#return:
+#	returns a dict describing the generated tree with files, dirs, bytes, dup_files and dup_bytes fields
+#	NOTE: dup_files and dup_bytes include files which came out identical to an earlier file by chance (e.g. tiny files)
+#side-effects:
+#	creates directories and files under root
+def make_tree(root:str,file_cnt:int,depth:int,fanout:int,size_dist:str,min_size:int,max_size:int,dup_ratio:float,collide_ratio:float,seed:int,sample_bytes:int=4096) -> dict:
+	rng=random.Random(seed)
+	
+	#every directory in the tree, including root
+	dir_paths=[root]
+	level_paths=[root]
+	for level in range(0,depth):
+		next_level_paths=[]
+		for parent_path in level_paths:
+			for dir_idx in range(0,fanout):
+				dir_path=os.path.join(parent_path,'d'+str(level)+'_'+str(dir_idx))
+				os.mkdir(dir_path)
+				next_level_paths.append(dir_path)
+		dir_paths.extend(next_level_paths)
+		level_paths=next_level_paths
+	
+	tree_info={'files':0,'dirs':len(dir_paths),'bytes':0,'dup_files':0,'dup_bytes':0}
+	unique_paths=[]
+	#the checksums of the contents of unique_paths, so that a file which is identical to an earlier one by chance is counted as a duplicate
+	unique_digests=set()
+	for file_idx in range(0,file_cnt):
+		fpath=os.path.join(rng.choice(dir_paths),'f'+str(file_idx))
+		kind_roll=rng.random()
+		if(len(unique_paths)>0 and kind_roll<dup_ratio):
+			src_path=rng.choice(unique_paths)
+			shutil.copyfile(src_path,fpath)
+			fsize=os.path.getsize(fpath)
+			tree_info['dup_files']+=1
+			tree_info['dup_bytes']+=fsize
+		else:
+			if(len(unique_paths)>0 and kind_roll<(dup_ratio+collide_ratio)):
+				#same size, head and tail as an earlier file, but one byte in between is different
+				#NOTE: a file no larger than two samples is hashed whole at the sample stage, so any byte will do
+				with open(rng.choice(unique_paths),'rb') as fp:
+					content=bytearray(fp.read())
+				#other variants of the same file may already have used a given byte, so a few are tried
+				for attempt in range(0,8):
+					if(len(content)==0):
+						break
+					if(len(content)>(2*sample_bytes)):
+						byte_idx=rng.randrange(sample_bytes,len(content)-sample_bytes)
+					else:
+						byte_idx=rng.randrange(0,len(content))
+					content[byte_idx]=(content[byte_idx]+1+rng.randrange(0,255))%256
+					if(not (hashlib.sha1(content).digest() in unique_digests)):
+						break
+			else:
+				content=rng.randbytes(random_size(rng,size_dist,min_size,max_size))
+			
+			with open(fpath,'wb') as fp:
+				fp.write(content)
+			fsize=len(content)
+			content_digest=hashlib.sha1(content).digest()
+			if(content_digest in unique_digests):
+				tree_info['dup_files']+=1
+				tree_info['dup_bytes']+=fsize
+			else:
+				unique_digests.add(content_digest)
+				unique_paths.append(fpath)
+		tree_info['files']+=1
+		tree_info['bytes']+=fsize
+	
+	return tree_info
+
+#this tries to drop the kernel's page cache so that the next run reads from storage rather than memory
+#args:
+#	none
+#return:
+#	returns True if the cache was dropped, False if it couldn't be (e.g. when not running as root)
+#side-effects:
+#	drops the page cache for the whole system
+def drop_caches() -> bool:
+	try:
+		os.sync()
+		with open('/proc/sys/vm/drop_caches','w') as fp:
+			fp.write('3\n')
+		return True
+	except OSError as e:
+		return False
+
+#this times each phase of duplicate detection and resolution on a tree
+#args:
+#	dup_fixer: the module returned by load_dup_fixer
+#	tree_path: the tree to run on; it is not modified
+#	work_path: a path under which a copy of the tree is made for the resolve phase
+#	hash_algo: the hashing algorithm to use
+#	jobs: the number of files to read at once from each non-rotational device
+#	read_mode: the read mode to use for full checksums
+#	resolve_action: the batch action to resolve duplicates with, or 'skip' to not time the resolve phase
+#	cold: whether or not to drop the page cache before reading files
+#return:
+#	returns a dict of the phase times in seconds and the results that were found
+#side-effects:
+#	creates and deletes a copy of the tree under work_path
+def bench_run(dup_fixer,tree_path:str,work_path:str,hash_algo:str,jobs:int,read_mode:str,resolve_action:str,cold:bool) -> dict:
+	result={'hash_algo':hash_algo,'jobs':jobs,'read_mode':read_mode,'cold':cold}
+	
+	if(cold):
+		result['cold']=drop_caches()
+	
+	#scan phase: walk the tree and group files by size
+	start_time=time.perf_counter()
+	dir_paths,dir_devs,size_acc=dup_fixer.dup_walk(tree_path)
+	result['scan_secs']=time.perf_counter()-start_time
+	
+	hash_files=sum([len(size_acc[fsize]) for fsize in size_acc if isinstance(size_acc[fsize],list)])
+	hash_bytes=sum([fsize*len(size_acc[fsize]) for fsize in size_acc if isinstance(size_acc[fsize],list)])
+	
+	if(cold):
+		drop_caches()
+	
+	#hash phase: sample and full checksums of every file which shares its size with another file
+	start_time=time.perf_counter()
+	groups=list(dup_fixer.dup_size_groups(dir_paths,dir_devs,size_acc,hash_algo,jobs=jobs,read_mode=read_mode))
+	result['hash_secs']=time.perf_counter()-start_time
+	result['hash_files']=hash_files
+	result['hash_mb_per_sec']=(hash_bytes/(1024*1024))/max(result['hash_secs'],0.000001)
+	result['dup_sets']=len(groups)
+	result['dup_files']=sum([len(fpaths) for fhash,fsize,fpaths in groups])
+	result['reclaimable_bytes']=sum([fsize*(len(fpaths)-1) for fhash,fsize,fpaths in groups])
+	
+	#resolve phase: apply the batch action to a copy of the tree so that the tree can be reused
+	result['resolve_secs']=None
+	if(resolve_action!='skip'):
+		copy_path=os.path.join(work_path,'resolve')
+		journal_path=os.path.join(work_path,'journal.jsonl')
+		shutil.copytree(tree_path,copy_path,symlinks=True)
+		hash_list=dup_fixer.dup_find(copy_path,hash_algo,jobs=jobs,read_mode=read_mode)
+		try:
+			with open(os.devnull,'w') as devnull:
+				with contextlib.redirect_stdout(devnull):
+					start_time=time.perf_counter()
+					dup_fixer.dup_fix_batch(hash_list,resolve_action,journal_path=journal_path)
+					result['resolve_secs']=time.perf_counter()-start_time
+		finally:
+			shutil.rmtree(copy_path)
+			if(os.path.exists(journal_path)):
+				os.unlink(journal_path)
+	
+	return result
+
+if(__name__=='__main__'):
+	parser=argparse.ArgumentParser(description='This is a benchmark for dup-fixer.py.  It generates a synthetic tree and times duplicate detection and resolution on it.  ')
+	parser.add_argument('--files',dest='files',type=int,default=2000,help='The number of files to generate; default 2000')
+	parser.add_argument('--depth',dest='depth',type=int,default=3,help='The number of levels of subdirectories; default 3')
+	parser.add_argument('--fanout',dest='fanout',type=int,default=4,help='The number of subdirectories in each directory; default 4')
+	parser.add_argument('--size-dist',dest='size_dist',type=str,default='loguniform',choices=SIZE_DISTS,help='How file sizes are distributed between --min-size and --max-size; default loguniform')
+	parser.add_argument('--min-size',dest='min_size',type=int,default=0,help='The smallest file size in bytes; default 0')
+	parser.add_argument('--max-size',dest='max_size',type=int,default=4*1024*1024,help='The largest file size in bytes; default 4 MiB')
+	parser.add_argument('--dup-ratio',dest='dup_ratio',type=float,default=0.3,help='The fraction of files which are copies of another file; default 0.3')
+	parser.add_argument('--collide-ratio',dest='collide_ratio',type=float,default=0.05,help='The fraction of files which have the same size, start and end as another file but are not copies; default 0.05')
+	parser.add_argument('--seed',dest='seed',type=int,default=1,help='The random seed for the generated tree; default 1')
+	parser.add_argument('--hash-algo',dest='hash_algos',type=str,action='append',default=[],help='A hash algorithm to benchmark; may be given more than once; default every algorithm dup-fixer.py supports')
+	parser.add_argument('--jobs',dest='jobs',type=int,default=1,help='The --jobs value to benchmark with; default 1')
+	parser.add_argument('--read-mode',dest='read_mode',type=str,default='auto',help='The --read-mode value to benchmark with; default auto')
+	parser.add_argument('--resolve-action',dest='resolve_action',type=str,default='link',help='The batch action to time the resolve phase with, or skip; default link')
+	parser.add_argument('--repeat',dest='repeat',type=int,default=3,help='The number of times to run each benchmark; default 3')
+	parser.add_argument('--cold',dest='cold',action='store_const',const=True,default=False,help='Pass the --cold switch in order to drop the page cache before each phase (requires root)')
+	parser.add_argument('--work-dir',dest='work_dir',type=str,default=None,help='The directory to generate the tree in; default a new temporary directory (set TMPDIR to choose the device)')
+	parser.add_argument('--keep',dest='keep',action='store_const',const=True,default=False,help='Pass the --keep switch in order to not delete the generated tree afterward')
+	parser.add_argument('--dup-fixer',dest='dup_fixer',type=str,default=DUP_FIXER_PATH,help='The dup-fixer.py script to benchmark; default the one next to this script')
+	parser.add_argument('--output',dest='output',type=str,default='-',help='The file to write json results to; default - (stdout)')
+	
+	args=parser.parse_args()
+	
+	dup_fixer=load_dup_fixer(args.dup_fixer)
+	hash_algos=args.hash_algos
+	if(len(hash_algos)==0):
+		hash_algos=list(dup_fixer.HASH_ALGOS.keys())
+	for hash_algo in hash_algos:
+		if(not (hash_algo in dup_fixer.HASH_ALGOS)):
+			parser.error('Unsupported hash algorithm '+hash_algo+'; supported algorithms are '+', '.join(dup_fixer.HASH_ALGOS.keys()))
+	if(not (args.resolve_action in (dup_fixer.BATCH_ACTIONS))):
+		parser.error('Unsupported resolve action '+args.resolve_action+'; supported actions are '+', '.join(dup_fixer.BATCH_ACTIONS))
+	
+	work_path=args.work_dir
+	if(work_path is None):
+		work_path=tempfile.mkdtemp(prefix='dup-fixer-bench-')
+	tree_path=os.path.join(work_path,'tree')
+	os.makedirs(tree_path)
+	
+	try:
+		print('Generating '+str(args.files)+' files in "'+tree_path+'" ...',file=sys.stderr)
+		start_time=time.perf_counter()
+		tree_info=make_tree(tree_path,args.files,args.depth,args.fanout,args.size_dist,args.min_size,args.max_size,args.dup_ratio,args.collide_ratio,args.seed,sample_bytes=dup_fixer.SAMPLE_BYTES)
+		tree_info['generate_secs']=time.perf_counter()-start_time
+		
+		#the script's checksum identifies exactly which version was benchmarked
+		with open(args.dup_fixer,'rb') as fp:
+			script_sha1=hashlib.sha1(fp.read()).hexdigest()
+		
+		results=[]
+		for hash_algo in hash_algos:
+			for run_idx in range(0,args.repeat):
+				print('Running '+hash_algo+' ('+str(run_idx+1)+'/'+str(args.repeat)+') ...',file=sys.stderr)
+				result=bench_run(dup_fixer,tree_path,work_path,hash_algo,args.jobs,args.read_mode,args.resolve_action,args.cold)
+				result['run']=run_idx
+				results.append(result)
+		
+		report={
+			'script':os.path.basename(args.dup_fixer),
+			'script_sha1':script_sha1,
+			'python':platform.python_version(),
+			'platform':platform.platform(),
+			'cpu_count':os.cpu_count(),
+			'time':time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+			'params':{
+				'files':args.files,
+				'depth':args.depth,
+				'fanout':args.fanout,
+				'size_dist':args.size_dist,
+				'min_size':args.min_size,
+				'max_size':args.max_size,
+				'dup_ratio':args.dup_ratio,
+				'collide_ratio':args.collide_ratio,
+				'seed':args.seed,
+				'resolve_action':args.resolve_action,
+			},
+			'tree':tree_info,
+			'results':results,
+		}
+		
+		if(args.output=='-'):
+			print(json.dumps(report,indent='\t'))
+		else:
+			with open(args.output,'w') as fp:
+				fp.write(json.dumps(report,indent='\t')+"\n")
+	finally:
+		if(not args.keep):
+			shutil.rmtree(tree_path)
+			if(args.work_dir is None):
+				os.rmdir(work_path)
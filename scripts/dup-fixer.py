@@ -10,123 +10,1899 @@
 #	manually choose what to do with each copy
 
 import argparse
+import base64
+import collections
+import concurrent.futures
+import csv
+import ctypes
+import ctypes.util
+import errno
+import fcntl
 import hashlib
+import json
+import mmap
 import os
+import re
+import shutil
+import sqlite3
+import stat
+import struct
+import sys
+import threading
 import time
 
+#optional hash implementations which are much faster than the hashlib ones
+#these are only offered as --hash-algo choices if the corresponding module is installed
+try:
+	import xxhash
+except ImportError as e:
+	xxhash=None
+
+try:
+	import blake3
+except ImportError as e:
+	blake3=None
+
+#the hashing algorithms which can be used for duplicate detection
+#each is mapped to a function which returns a new hash object that has not yet been given any data
+#NOTE: md5 and sha1 are kept for compatibility with existing caches and habits
+#but blake2b-128 (and xxh3-128 or blake3 if installed) are considerably faster on fast storage
+HASH_ALGOS={
+	'sha1':hashlib.sha1,
+	'md5':hashlib.md5,
+	'sha256':hashlib.sha256,
+	'blake2b-128':(lambda: hashlib.blake2b(digest_size=16)),
+}
+if(not (xxhash is None)):
+	HASH_ALGOS['xxh3-128']=xxhash.xxh3_128
+	HASH_ALGOS['xxh64']=xxhash.xxh64
+if(not (blake3 is None)):
+	HASH_ALGOS['blake3']=blake3.blake3
+
+#this initializes a new hash object for the requested hash algorithm
+#args:
+#	hash_algo: the hashing algorithm to use for duplicate detection; one of HASH_ALGOS
+#return:
+#	returns a hash object which has not yet been given any data
+#side-effects:
+#	none
+def new_hash_obj(hash_algo:str):
+	if(not (hash_algo in HASH_ALGOS)):
+		raise Exception('Err: Unsupported hash algorithm '+str(hash_algo))
+	return HASH_ALGOS[hash_algo]()
+
+#the default number of bytes read from a file per hash update
+#this is large so that hashing isn't limited by per-read interpreter overhead
+HASH_BUF_BYTES=1024*1024
+
+#the minimum file size for which the mmap read mode actually maps the file
+#smaller files are read into a buffer since the mapping setup isn't worth it for them
+MMAP_MIN_BYTES=16*1024*1024
+
+#the ways that checksum_file can read a file
+#	auto: use hashlib.file_digest if this version of python has it, otherwise readinto
+#	readinto: read into a reused buffer of the requested size
+#	mmap: map large files into memory and hash the mapping in a single update
+READ_MODES=['auto','readinto','mmap']
+
+#read buffers are reused between files, but each thread needs its own
+read_bufs=threading.local()
+
+#the minimum number of seconds between progress updates
+#progress is redrawn in place on a terminal, and is logged less often otherwise so that logs stay readable
+PROGRESS_SECS=0.5
+PROGRESS_LOG_SECS=10
+
+#the counters and timers for the current scan, used for the progress display and the --stats summary
+#NOTE: worker threads add to these, so they're only modified through stats_add
+scan_stats:dict={}
+scan_stats_lock=threading.Lock()
+
+#this resets the scan counters and timers at the start of a scan
+#args:
+#	progress: whether or not to show progress on stderr during the scan
+#return:
+#	none
+#side-effects:
+#	replaces the contents of scan_stats
+def stats_reset(progress:bool) -> None:
+	with scan_stats_lock:
+		scan_stats.clear()
+		scan_stats.update({
+			'progress':progress,
+			'tty':sys.stderr.isatty(),
+			'start_time':time.monotonic(),
+			'last_print':0.0,
+			'phase':'',
+			'phase_start':time.monotonic(),
+			'phase_files':0,
+			'phase_bytes':0,
+			'dirs':0,
+			'files':0,
+			'done_files':0,
+			'done_bytes':0,
+			'read_bytes':0,
+			'stat_secs':0.0,
+			'read_secs':0.0,
+			'hash_secs':0.0,
+			'digest_secs':0.0,
+		})
+
+#this adds to the scan counters and timers
+#args:
+#	counts: the amounts to add to each named counter
+#return:
+#	none
+#side-effects:
+#	modifies scan_stats
+def stats_add(**counts) -> None:
+	if(len(scan_stats)==0):
+		return
+	with scan_stats_lock:
+		for key in counts:
+			scan_stats[key]+=counts[key]
+
+#this starts a new phase of the scan, for which rates and an ETA are shown
+#args:
+#	phase: the name of the phase, as shown in the progress display
+#	phase_files: the number of files which will be read during this phase
+#	phase_bytes: the (maximum) number of bytes which will be read during this phase
+#return:
+#	none
+#side-effects:
+#	modifies scan_stats and may write to stderr
+def stats_phase(phase:str,phase_files:int=0,phase_bytes:int=0) -> None:
+	if(len(scan_stats)==0):
+		return
+	stats_progress(force=True)
+	with scan_stats_lock:
+		scan_stats.update({
+			'phase':phase,
+			'phase_start':time.monotonic(),
+			'phase_files':phase_files,
+			'phase_bytes':phase_bytes,
+			'done_files':0,
+			'done_bytes':0,
+			'read_bytes':0,
+		})
+
+#this writes the current scan progress to stderr, if enough time has passed since it was last written
+#args:
+#	force: write the progress regardless of when it was last written
+#return:
+#	none
+#side-effects:
+#	writes to stderr
+def stats_progress(force:bool=False) -> None:
+	if(len(scan_stats)==0 or (not scan_stats['progress'])):
+		return
+	now=time.monotonic()
+	if((not force) and (now-scan_stats['last_print'])<(PROGRESS_SECS if scan_stats['tty'] else PROGRESS_LOG_SECS)):
+		return
+	scan_stats['last_print']=now
+	
+	phase=scan_stats['phase']
+	if(phase==''):
+		return
+	elapsed=max(now-scan_stats['phase_start'],0.001)
+	if(phase=='walk'):
+		progress_line='Scanning: '+str(scan_stats['dirs'])+' directories, '+str(scan_stats['files'])+' files, '+str(round(scan_stats['files']/elapsed))+' files/s'
+	else:
+		#NOTE: bytes which came from the checksum cache count as done but not as read
+		#so MB/s is the actual read rate while the ETA accounts for cache hits
+		remaining_bytes=max(scan_stats['phase_bytes']-scan_stats['done_bytes'],0)
+		progress_line=phase+': '+str(scan_stats['done_files'])+'/'+str(scan_stats['phase_files'])+' files, '
+		progress_line+=str(round(scan_stats['done_files']/elapsed))+' files/s, '
+		progress_line+=('%.1f' % (scan_stats['read_bytes']/elapsed/(1024*1024)))+' MB/s, '
+		progress_line+=('%.1f' % (remaining_bytes/(1024*1024)))+' MB remaining'
+		if(scan_stats['done_bytes']>0):
+			eta_secs=int(remaining_bytes*elapsed/scan_stats['done_bytes'])
+			progress_line+=', ETA '+('%d:%02d:%02d' % (eta_secs//3600,(eta_secs//60)%60,eta_secs%60))
+	
+	if(scan_stats['tty']):
+		#NOTE: the line is padded so that a shorter line fully overwrites a longer one
+		print('\r'+progress_line.ljust(79),end='',file=sys.stderr,flush=True)
+	else:
+		print(progress_line,file=sys.stderr)
+
+#this finishes the progress display and writes a summary of where the time went
+#args:
+#	show_stats: whether or not to write the time breakdown
+#	fp: the file to write the summary to
+#return:
+#	none
+#side-effects:
+#	writes to stderr and fp
+def stats_summary(show_stats:bool,fp=sys.stderr) -> None:
+	if(len(scan_stats)==0):
+		return
+	stats_progress(force=True)
+	if(scan_stats['progress'] and scan_stats['tty']):
+		print('',file=sys.stderr)
+	if(not show_stats):
+		return
+	#NOTE: read and hash times are summed over all worker threads, so they can add up to more than the elapsed time
+	print('Elapsed: %.3fs' % (time.monotonic()-scan_stats['start_time']),file=fp)
+	print('  stat: %.3fs (%d directories, %d files)' % (scan_stats['stat_secs'],scan_stats['dirs'],scan_stats['files']),file=fp)
+	print('  read: %.3fs' % (scan_stats['read_secs']),file=fp)
+	print('  hash: %.3fs' % (scan_stats['hash_secs']),file=fp)
+	if(scan_stats['digest_secs']>0):
+		print('  read+hash (not separable with file_digest or mmap reads): %.3fs' % (scan_stats['digest_secs']),file=fp)
+
 #this gets the checksum for a given file
 #args:
 #	fpath: the full path of the file to get a checksum for
 #	hash_algo: the hashing algorithm to use for duplicate detection
+#	read_mode: how to read the file; one of READ_MODES
+#	buf_bytes: the number of bytes to read per hash update with the readinto read mode
+#		(and with the mmap read mode for files smaller than MMAP_MIN_BYTES, which are read the same way;
+#		larger files are mapped and hashed in a single update so this doesn't apply to them)
+#return:
+#	returns the checksum of the given file as (binary) bytes
+#side-effects:
+#	none
+def checksum_file(fpath:str,hash_algo:str,read_mode:str='auto',buf_bytes:int=HASH_BUF_BYTES) -> bytes:
+	if(not os.path.isfile(fpath)):
+		raise Exception('Err: Checksum requested for non-existent file '+str(fpath))
+	
+	if(read_mode=='auto'):
+		read_mode='readinto'
+		if(hasattr(hashlib,'file_digest')):
+			read_mode='file_digest'
+	
+	#read the file in as binary blocks
+	with open(fpath,'rb',buffering=0) as fp:
+		if(read_mode=='file_digest'):
+			#NOTE: hashlib.file_digest does its own buffering and releases the GIL while it reads
+			start_time=time.perf_counter()
+			digest=hashlib.file_digest(fp,lambda: new_hash_obj(hash_algo)).digest()
+			stats_add(digest_secs=time.perf_counter()-start_time,read_bytes=os.fstat(fp.fileno()).st_size)
+			return digest
+		
+		#initialize hash object based on requested hash algorithm
+		hash_obj=new_hash_obj(hash_algo)
+		
+		if(read_mode=='mmap'):
+			fsize=os.fstat(fp.fileno()).st_size
+			if(fsize>=MMAP_MIN_BYTES):
+				start_time=time.perf_counter()
+				with mmap.mmap(fp.fileno(),0,access=mmap.ACCESS_READ) as fmap:
+					if(hasattr(fmap,'madvise')):
+						fmap.madvise(mmap.MADV_SEQUENTIAL)
+					hash_obj.update(fmap)
+				stats_add(digest_secs=time.perf_counter()-start_time,read_bytes=fsize)
+				return hash_obj.digest()
+		
+		#get this thread's read buffer, resizing it if a different size was requested
+		buf=getattr(read_bufs,'buf',None)
+		if((buf is None) or len(buf)!=buf_bytes):
+			buf=bytearray(buf_bytes)
+			read_bufs.buf=buf
+		buf_view=memoryview(buf)
+		
+		#NOTE: reading and hashing are timed separately here so that slow storage can be told apart from a slow hash
+		#the times are only added to the shared totals once per file to keep lock contention down
+		read_secs=0.0
+		hash_secs=0.0
+		total_bytes=0
+		while True:
+			start_time=time.perf_counter()
+			read_bytes=fp.readinto(buf)
+			read_time=time.perf_counter()
+			read_secs+=read_time-start_time
+			if(not read_bytes):
+				break
+			#update the hash with each block
+			hash_obj.update(buf_view[:read_bytes])
+			hash_secs+=time.perf_counter()-read_time
+			total_bytes+=read_bytes
+		stats_add(read_secs=read_secs,hash_secs=hash_secs,read_bytes=total_bytes)
+	
+	#return the hash that resulted once the file has been thoroughly read
+	#NOTE: this is kept binary rather than formatted as a hex string since it's half the size
+	#and there can be a lot of these held in memory at once
+	return hash_obj.digest()
+
+#the number of bytes read from each of the start and end of a file for a sample checksum
+SAMPLE_BYTES=4096
+
+#this gets a checksum of only a small sample (the head and tail) of a given file
+#this is used to cheaply rule out files which are the same size but clearly not duplicates
+#args:
+#	fpath: the full path of the file to get a sample checksum for
+#	hash_algo: the hashing algorithm to use for duplicate detection
+#	sample_bytes: the number of bytes to read from each of the start and end of the file
+#return:
+#	returns the checksum of the head and tail of the given file as (binary) bytes
+#side-effects:
+#	none
+def sample_checksum_file(fpath:str,hash_algo:str,sample_bytes:int=SAMPLE_BYTES) -> bytes:
+	if(not os.path.isfile(fpath)):
+		raise Exception('Err: Sample checksum requested for non-existent file '+str(fpath))
+	
+	hash_obj=new_hash_obj(hash_algo)
+	
+	start_time=time.perf_counter()
+	with open(fpath,'rb') as fp:
+		#the head and tail of the file
+		#NOTE: this is only ever called for files larger than 2*sample_bytes
+		#so the head and tail never overlap
+		head=fp.read(sample_bytes)
+		fp.seek(-sample_bytes,os.SEEK_END)
+		tail=fp.read(sample_bytes)
+	read_time=time.perf_counter()
+	
+	hash_obj.update(head)
+	hash_obj.update(tail)
+	stats_add(read_secs=read_time-start_time,hash_secs=time.perf_counter()-read_time,read_bytes=len(head)+len(tail))
+	
+	return hash_obj.digest()
+
+#the number of seconds after which a cache entry which is still in use has its last_seen time refreshed
+#this avoids writing to the cache for every single file on every run
+CACHE_TOUCH_SECS=86400
+
+#the number of cache rows which are written between commits
+#so that an interrupted scan doesn't lose all of the checksums it has computed
+CACHE_COMMIT_ROWS=1000
+
+#this opens (and creates if needed) the persistent on-disk checksum cache
+#args:
+#	cache_path: the path of the sqlite database file to use as a cache
+#return:
+#	returns an sqlite3 connection to the cache database
+#side-effects:
+#	creates the cache database file and its table if they don't already exist
+def cache_open(cache_path:str) -> sqlite3.Connection:
+	cache_dir=os.path.dirname(cache_path)
+	if(cache_dir!='' and (not os.path.isdir(cache_dir))):
+		os.makedirs(cache_dir)
+	
+	cache=sqlite3.connect(cache_path)
+	cache.execute('PRAGMA journal_mode=WAL')
+	cache.execute('PRAGMA synchronous=NORMAL')
+	
+	#NOTE: a file is identified by device and inode
+	#and a cached checksum is only considered valid if the size and modification time still match
+	#kind is either "full" or "sample:<bytes>" depending on how much of the file was checksummed
+	cache.execute(
+		'CREATE TABLE IF NOT EXISTS checksums ('+
+			'dev INTEGER NOT NULL,'+
+			'ino INTEGER NOT NULL,'+
+			'hash_algo TEXT NOT NULL,'+
+			'kind TEXT NOT NULL,'+
+			'size INTEGER NOT NULL,'+
+			'mtime_ns INTEGER NOT NULL,'+
+			'digest BLOB NOT NULL,'+
+			'last_seen INTEGER NOT NULL,'+
+			'PRIMARY KEY (dev,ino,hash_algo,kind)'+
+		')'
+	)
+	cache.commit()
+	return cache
+
+#this removes cache entries for files which haven't been seen in a given amount of time
+#(typically because they were deleted)
+#args:
+#	cache: the sqlite3 connection returned by cache_open
+#	prune_days: the number of days after which an entry which hasn't been seen is removed
+#return:
+#	returns the number of entries which were removed
+#side-effects:
+#	deletes stale rows from the cache database
+def cache_prune(cache:sqlite3.Connection,prune_days:int) -> int:
+	cutoff=int(time.time())-(prune_days*86400)
+	cursor=cache.execute('DELETE FROM checksums WHERE last_seen<?',(cutoff,))
+	cache.commit()
+	return cursor.rowcount
+
+#this looks up the cached checksum for a given file
+#args:
+#	cache: the sqlite3 connection returned by cache_open
+#	fpath: the full path of the file to look up
+#	hash_algo: the hashing algorithm to use for duplicate detection
+#	kind: "full" for a checksum of the whole file, or "sample:<bytes>" for a sample checksum
+#	fkey: the (st_dev,st_ino,st_size,st_mtime_ns) of the file if they're already known (e.g. from dup_walk), or None to stat the file
+#return:
+#	returns a tuple of (fkey,digest) where fkey is the (st_dev,st_ino,st_size,st_mtime_ns) of the file
+#	and digest is the cached checksum, or None if there is no valid cache entry
+#side-effects:
+#	may refresh the last_seen time of the cache entry
+def cache_lookup(cache:sqlite3.Connection,fpath:str,hash_algo:str,kind:str,fkey:tuple=None) -> tuple:
+	if(fkey is None):
+		fstat=os.stat(fpath)
+		fkey=(fstat.st_dev,fstat.st_ino,fstat.st_size,fstat.st_mtime_ns)
+	st_dev,st_ino,st_size,st_mtime_ns=fkey
+	row=cache.execute(
+		'SELECT size,mtime_ns,digest,last_seen FROM checksums WHERE dev=? AND ino=? AND hash_algo=? AND kind=?',
+		(st_dev,st_ino,hash_algo,kind)
+	).fetchone()
+	
+	#if there's no cache entry or the file has changed since it was made then it can't be used
+	#NOTE: older versions of this script stored hex string digests; those are treated as stale
+	if((row is None) or row[0]!=st_size or row[1]!=st_mtime_ns or (not isinstance(row[2],bytes))):
+		return (fkey,None)
+	
+	now=int(time.time())
+	if((now-row[3])>CACHE_TOUCH_SECS):
+		cache.execute(
+			'UPDATE checksums SET last_seen=? WHERE dev=? AND ino=? AND hash_algo=? AND kind=?',
+			(now,st_dev,st_ino,hash_algo,kind)
+		)
+	return (fkey,row[2])
+
+#this stores a checksum in the cache, replacing whatever (stale) entry was there
+#args:
+#	cache: the sqlite3 connection returned by cache_open
+#	fkey: the (st_dev,st_ino,st_size,st_mtime_ns) of the file, as returned by cache_lookup
+#	hash_algo: the hashing algorithm used to compute the digest
+#	kind: "full" for a checksum of the whole file, or "sample:<bytes>" for a sample checksum
+#	digest: the checksum to store
+#	pending_rows: the number of rows stored since the last commit, as returned by the previous call
+#return:
+#	returns the number of rows stored since the last commit, including this one (0 if this committed)
+#side-effects:
+#	inserts or updates a row in the cache database
+#	commits once CACHE_COMMIT_ROWS rows are pending
+#NOTE: rows are counted here rather than taken from cache.total_changes
+#since that also counts the last_seen updates from cache_lookup, which would make commits land at random
+def cache_store(cache:sqlite3.Connection,fkey:tuple,hash_algo:str,kind:str,digest:bytes,pending_rows:int=0) -> int:
+	st_dev,st_ino,st_size,st_mtime_ns=fkey
+	cache.execute(
+		'INSERT OR REPLACE INTO checksums (dev,ino,hash_algo,kind,size,mtime_ns,digest,last_seen) VALUES (?,?,?,?,?,?,?,?)',
+		(st_dev,st_ino,hash_algo,kind,st_size,st_mtime_ns,digest,int(time.time()))
+	)
+	pending_rows+=1
+	if(pending_rows>=CACHE_COMMIT_ROWS):
+		cache.commit()
+		pending_rows=0
+	return pending_rows
+
+#this checks whether a device is a spinning disk, which should only be read from one file at a time
+#args:
+#	st_dev: the device number of a file (from os.stat)
+#return:
+#	returns True if the device is known to be rotational, False if it isn't or if it can't be determined
+#	(e.g. for network filesystems, or btrfs which reports a virtual device number)
+#side-effects:
+#	none
+def device_rotational(st_dev:int) -> bool:
+	sys_path=os.path.join('/sys/dev/block',str(os.major(st_dev))+':'+str(os.minor(st_dev)))
+	#NOTE: partitions don't have a queue directory of their own but their parent disk does
+	for queue_path in [os.path.join(sys_path,'queue','rotational'),os.path.join(sys_path,'..','queue','rotational')]:
+		try:
+			with open(queue_path,'r') as fp:
+				return (fp.read().strip()=='1')
+		except OSError as e:
+			continue
+	return False
+
+#this gets the worker pool which reads files from a given device, creating it if needed
+#each device gets its own pool so that reads on different disks overlap,
+#spinning disks are read one file at a time (so they aren't made to seek back and forth between files),
+#and other devices are read with the requested number of jobs
+#args:
+#	pools: the dict of device number to executor, shared between calls
+#	pool_workers: the dict of device number to the number of workers in its pool, shared between calls
+#	st_dev: the device number of the file to read, or None if it isn't known
+#	jobs: the number of files to read at once from a non-rotational device
+#return:
+#	returns the concurrent.futures executor for the device
+#side-effects:
+#	may start a new thread pool and add it to pools (and its worker count to pool_workers)
+def device_pool(pools:dict,pool_workers:dict,st_dev:int,jobs:int) -> concurrent.futures.Executor:
+	if(not (st_dev in pools)):
+		dev_jobs=jobs
+		if((not (st_dev is None)) and device_rotational(st_dev)):
+			dev_jobs=1
+		pool_workers[st_dev]=dev_jobs
+		pools[st_dev]=concurrent.futures.ThreadPoolExecutor(max_workers=dev_jobs)
+	return pools[st_dev]
+
+#this gets the checksums for a list of files, consulting the on-disk cache first
+#files which have no valid cache entry are read (in parallel if pools are given) and the results are stored in the cache
+#args:
+#	fentries: an iterable of (file_path,st_dev,fkey) tuples to get checksums for; st_dev may be None if it isn't known
+#		and fkey is the (st_dev,st_ino,st_size,st_mtime_ns) of the file from an earlier stat (see dup_walk),
+#		or None if the file should be stat-ed again for the cache lookup
+#	hash_algo: the hashing algorithm to use for duplicate detection
+#	kind: "full" for a checksum of the whole file, or "sample:<bytes>" for a sample checksum
+#	cache: the sqlite3 connection returned by cache_open, or None to always read the files
+#	pools: a dict of device number to executor (see device_pool) to read files with, or None to read them sequentially in this thread
+#	pool_workers: a dict of device number to the number of workers in its pool (see device_pool); required if pools is given
+#	jobs: the number of files to read at once from each non-rotational device
+#	read_mode: how to read files for full checksums; one of READ_MODES
+#	buf_bytes: the number of bytes to read per hash update for full checksums
+#return:
+#	yields the checksum of each file as bytes, in the same order as fentries
+#	as soon as it (and the checksums of all files before it) are known
+#side-effects:
+#	may insert or update rows in the cache database
+def checksum_paths(fentries,hash_algo:str,kind:str,cache:sqlite3.Connection=None,pools:dict=None,pool_workers:dict=None,jobs:int=1,read_mode:str='auto',buf_bytes:int=HASH_BUF_BYTES):
+	if(kind=='full'):
+		checksum_func=lambda fpath: checksum_file(fpath=fpath,hash_algo=hash_algo,read_mode=read_mode,buf_bytes=buf_bytes)
+	else:
+		sample_bytes=int(kind.split(':')[1])
+		checksum_func=lambda fpath: sample_checksum_file(fpath=fpath,hash_algo=hash_algo,sample_bytes=sample_bytes)
+	
+	#the files whose checksums haven't been yielded yet, in order
+	#each entry is [fkey,digest] where digest is either the checksum or a future which will produce it
+	#NOTE: a few files are kept queued per worker so that no worker sits idle
+	#without creating a future for every file in a very large tree at once
+	#NOTE: the cache is only ever accessed from this thread
+	#since sqlite connections can't be shared between threads
+	in_flight=collections.deque()
+	
+	#the number of checksums stored in the cache since it was last committed (see cache_store)
+	pending_rows=0
+	
+	for fpath,st_dev,fkey in fentries:
+		digest=None
+		if(not (cache is None)):
+			#NOTE: when the walk's stat is passed in the file isn't stat-ed again here, which halves the metadata calls with a warm cache
+			fkey,digest=cache_lookup(cache,fpath,hash_algo,kind,fkey=fkey)
+		
+		if(digest is None):
+			if(pools is None):
+				digest=checksum_func(fpath)
+				if(not (cache is None)):
+					pending_rows=cache_store(cache,fkey,hash_algo,kind,digest,pending_rows)
+			else:
+				digest=device_pool(pools,pool_workers,st_dev,jobs).submit(checksum_func,fpath)
+		in_flight.append([fkey,digest])
+		
+		max_in_flight=4
+		if(not (pools is None)):
+			#NOTE: no pools may have been started yet (e.g. when every file so far was in the cache)
+			max_in_flight=max(4,4*sum(pool_workers.values()))
+		while((len(in_flight)>=max_in_flight) or ((len(in_flight)>0) and isinstance(in_flight[0][1],bytes))):
+			fkey,digest=in_flight.popleft()
+			if(not isinstance(digest,bytes)):
+				digest=digest.result()
+				if(not (cache is None)):
+					pending_rows=cache_store(cache,fkey,hash_algo,kind,digest,pending_rows)
+			yield digest
+	
+	while(len(in_flight)>0):
+		fkey,digest=in_flight.popleft()
+		if(not isinstance(digest,bytes)):
+			digest=digest.result()
+			if(not (cache is None)):
+				pending_rows=cache_store(cache,fkey,hash_algo,kind,digest,pending_rows)
+		yield digest
+
+#find all regular files in a directory and all subdirectories thereof
+#NOTE: this walks the tree iteratively (rather than recursively) so that very deep trees can't hit the recursion limit
+#and uses os.scandir so that file types come from the directory listing rather than from extra stat calls
+#args:
+#	directory: the directory to search for files, or a list of directories
+#	ignore_git: whether or not to ignore git repositories
+#return:
+#	yields a tuple of (directory,entry) for each regular file that was found
+#	where entry is an os.DirEntry and directory is the path of the directory that contains it
+#	(the same string object for every file in a directory)
+#side-effects:
+#	no side-effects persist after return
+def walk_files(directory:str|list,ignore_git:bool=False):
+	roots=[directory] if isinstance(directory,str) else list(directory)
+	for root in roots:
+		if(not os.path.isdir(root)):
+			raise Exception('Err: Given directory '+root+' does not exist')
+	
+	#a directory which is given twice, or is inside another given directory, would otherwise be scanned twice
+	real_roots=[os.path.join(os.path.realpath(root),'') for root in roots]
+	for root_idx in range(len(roots)-1,-1,-1):
+		for other_idx in range(0,len(roots)):
+			if(other_idx==root_idx):
+				continue
+			#NOTE: of two identical directories the one given first is kept
+			if((real_roots[root_idx]==real_roots[other_idx] and other_idx<root_idx) or (real_roots[root_idx]!=real_roots[other_idx] and real_roots[root_idx].startswith(real_roots[other_idx]))):
+				print('Skipping directory '+roots[root_idx]+' because it is within '+roots[other_idx]+'...',file=sys.stderr) #debug
+				del roots[root_idx]
+				del real_roots[root_idx]
+				break
+	
+	#the directories which are still to be scanned
+	#NOTE: this is reversed so that the given directories are scanned in the order they were given
+	dir_stack=list(reversed(roots))
+	while(len(dir_stack)>0):
+		directory=dir_stack.pop()
+		
+		#for each file or directory within this directory
+		start_time=time.perf_counter()
+		with os.scandir(directory) as dir_it:
+			dir_contents=list(dir_it)
+		stats_add(stat_secs=time.perf_counter()-start_time)
+		
+		#if we're ignoring git repositories
+		if(ignore_git):
+			#if this is a git repository
+			if(any(entry.name=='.git' for entry in dir_contents)):
+				print('Skipping directory '+directory+' because it is a git repository...',file=sys.stderr) #debug
+				#then skip it and all of its contents
+				continue
+		
+		#NOTE: this used to print every directory, which was measurable overhead on trees with many small directories
+		#the number of directories scanned is shown in the (rate-limited) progress display instead
+		stats_add(dirs=1)
+		stats_progress()
+		
+		subdirs=[]
+		for entry in dir_contents:
+			#if this file is a symbolic or hard link then skip it
+			#as those aren't really duplicates so much as pointers
+			#NOTE: since symlinks can be directories as well as simple files
+			#this check needs to be done first, before the is_dir and is_file checks
+			#in order to account for all cases
+			if(entry.is_symlink()):
+				continue
+			#if it is itself a directory, then scan it after this directory
+			elif(entry.is_dir(follow_symlinks=False)):
+				subdirs.append(entry.path)
+			#if this is a normal file, then it's a candidate for duplicate detection
+			elif(entry.is_file(follow_symlinks=False)):
+				yield (directory,entry)
+		
+		#subdirectories are pushed in reverse so that they're scanned in listing order
+		subdirs.reverse()
+		dir_stack.extend(subdirs)
+
+#find all regular files in a directory and all subdirectories thereof and group them by size
+#NOTE: this holds an entry for every file in the tree, so it is kept as compact as possible:
+#directory paths are stored once and files refer to them by index,
+#and a size with only one file is stored as a bare entry rather than as a list
+#args:
+#	directory: the directory to search for files, or a list of directories
+#	ignore_git: whether or not to ignore git repositories
+#	keep_stat: whether or not to keep each file's device, inode and modification time in its entry
+#		so that checksum cache lookups don't need to stat every file again; this makes each entry larger
+#return:
+#	returns a tuple of (dir_paths,dir_devs,size_acc) where dir_paths is the list of directories that were scanned,
+#	dir_devs is the device number that each of those directories' files are on,
+#	and size_acc is the accumulator of file sizes in the following data format
+#	{
+#		file_size_0:[
+#			(dir_idx_0,"file_name_0"),
+#			(dir_idx_1,"file_name_1")
+#		],
+#		file_size_1:(dir_idx_0,"file_name_2")
+#	}
+#	where dir_idx is an index into dir_paths and dir_devs
+#	and with keep_stat each entry is (dir_idx,"file_name",st_dev,st_ino,st_mtime_ns) instead
+#side-effects:
+#	no side-effects persist after return
+def dup_walk(directory:str|list,ignore_git:bool=False,keep_stat:bool=False) -> tuple:
+	dir_paths=[]
+	dir_devs=[]
+	size_acc:dict={}
+	
+	#the (device,inode) pairs of files with multiple hard links which have already been found
+	#other paths to the same inode are the same file, not duplicates, so they're skipped
+	linked_inodes=set()
+	
+	stats_phase('walk')
+	
+	last_dir=None
+	dir_idx=-1
+	for fdir,entry in walk_files(directory=directory,ignore_git=ignore_git):
+		#this is only a stat call and does not read any file content
+		start_time=time.perf_counter()
+		fstat=entry.stat(follow_symlinks=False)
+		stats_add(stat_secs=time.perf_counter()-start_time,files=1)
+		
+		#NOTE: the device of the first file in a directory is used for the whole directory
+		#since a directory can only have files on another device if a single file is bind-mounted
+		if(not (fdir is last_dir)):
+			dir_paths.append(fdir)
+			dir_devs.append(fstat.st_dev)
+			dir_idx=len(dir_paths)-1
+			last_dir=fdir
+		
+		if(fstat.st_nlink>1):
+			if((fstat.st_dev,fstat.st_ino) in linked_inodes):
+				continue
+			linked_inodes.add((fstat.st_dev,fstat.st_ino))
+		
+		fsize=fstat.st_size
+		fentry=(dir_idx,entry.name)
+		if(keep_stat):
+			fentry=(dir_idx,entry.name,fstat.st_dev,fstat.st_ino,fstat.st_mtime_ns)
+		size_entries=size_acc.get(fsize)
+		if(size_entries is None):
+			size_acc[fsize]=fentry
+		elif(isinstance(size_entries,tuple)):
+			size_acc[fsize]=[size_entries,fentry]
+		else:
+			size_entries.append(fentry)
+	
+	return (dir_paths,dir_devs,size_acc)
+
+#find groups of identical files in a directory and all subdirectories thereof
+#this is done in stages so that as little file content as possible is read:
+#	files are first grouped by size, and files with a unique size cannot have duplicates
+#	files which share a size are checksummed by a small head/tail sample
+#	only files which still share a sample checksum are fully checksummed
+#files which are found to be unique at any stage are dropped right away
+#so that memory use after the initial walk scales with the number of possible duplicates rather than the number of files
+#args:
+#	directory: the directory to search for duplicates, or a list of directories to search together
+#	hash_algo: the hashing algorithm to use for duplicate detection
+#	ignore_git: whether or not to ignore git repositories during duplicate checking
+#	cache: the sqlite3 connection returned by cache_open, or None to not use a checksum cache
+#	jobs: the number of files to read and checksum in parallel from each non-rotational device
+#	read_mode: how to read files for full checksums; one of READ_MODES
+#	buf_bytes: the number of bytes to read per hash update for full checksums
+#return:
+#	yields a tuple of (file_hash,file_size,file_paths) for every group of two or more identical files
+#	where file_hash is the binary checksum of the files
+#	groups are yielded one size at a time, as soon as they're known
+#side-effects:
+#	if a cache is given, checksums which were computed are stored in it
+def dup_groups(directory:str|list,hash_algo:str,ignore_git:bool=False,cache:sqlite3.Connection=None,jobs:int=1,read_mode:str='auto',buf_bytes:int=HASH_BUF_BYTES):
+	dir_paths,dir_devs,size_acc=dup_walk(directory=directory,ignore_git=ignore_git,keep_stat=(not (cache is None)))
+	yield from dup_size_groups(dir_paths,dir_devs,size_acc,hash_algo,cache=cache,jobs=jobs,read_mode=read_mode,buf_bytes=buf_bytes)
+
+#find groups of identical files out of files which have already been grouped by size
+#this is the checksumming part of dup_groups
+#args:
+#	dir_paths: the list of directories returned by dup_walk
+#	dir_devs: the list of directory device numbers returned by dup_walk
+#	size_acc: the accumulator of file sizes returned by dup_walk; this is not modified
+#	hash_algo: the hashing algorithm to use for duplicate detection
+#	cache: the sqlite3 connection returned by cache_open, or None to not use a checksum cache
+#	jobs: the number of files to read and checksum in parallel from each non-rotational device
+#	read_mode: how to read files for full checksums; one of READ_MODES
+#	buf_bytes: the number of bytes to read per hash update for full checksums
+#return:
+#	yields a tuple of (file_hash,file_size,file_paths) for every group of two or more identical files
+#side-effects:
+#	if a cache is given, checksums which were computed are stored in it
+def dup_size_groups(dir_paths:list,dir_devs:list,size_acc:dict,hash_algo:str,cache:sqlite3.Connection=None,jobs:int=1,read_mode:str='auto',buf_bytes:int=HASH_BUF_BYTES):
+	#if there is only one file of a given size then it can't be a duplicate
+	#NOTE: sizes are sorted so that results don't depend on directory listing order
+	dup_sizes=sorted([fsize for fsize in size_acc if isinstance(size_acc[fsize],list)])
+	size_acc={fsize:size_acc[fsize] for fsize in dup_sizes}
+	
+	entry_path=lambda fentry: os.path.join(dir_paths[fentry[0]],fentry[1])
+	#NOTE: entries from dup_walk with keep_stat carry the stat needed for cache lookups; other entries are stat-ed again if needed
+	entry_io=lambda fsize,fentry: (entry_path(fentry),dir_devs[fentry[0]],((fentry[2],fentry[3],fsize,fentry[4]) if len(fentry)>2 else None))
+	
+	#NOTE: each stage checksums all of its files in one batch (rather than one size group at a time)
+	#so that there is enough work to keep every worker busy
+	#results are always merged in the order files were found so output doesn't depend on the number of jobs
+	#NOTE: every device gets its own worker pool (see device_pool) so that reads on different disks overlap
+	#even when only one job is requested
+	pools:dict={}
+	pool_workers:dict={}
+	
+	try:
+		#sample stage
+		#if the file is small enough then the sample would be the whole file
+		#so it goes straight to a full checksum
+		sample_kind='sample:'+str(SAMPLE_BYTES)
+		sample_sizes=[fsize for fsize in dup_sizes if fsize>(2*SAMPLE_BYTES)]
+		sample_files=sum([len(size_acc[fsize]) for fsize in sample_sizes])
+		stats_phase('Sampling',sample_files,sample_files*2*SAMPLE_BYTES)
+		sample_entries=((fsize,fentry) for fsize in sample_sizes for fentry in size_acc[fsize])
+		sample_digests=checksum_paths((entry_io(fsize,fentry) for fsize,fentry in sample_entries),hash_algo,sample_kind,cache=cache,pools=pools,pool_workers=pool_workers,jobs=jobs)
+		
+		#the files which need a full checksum, grouped by size
+		full_groups=[]
+		for fsize in dup_sizes:
+			size_entries=size_acc[fsize]
+			
+			sample_acc:dict={}
+			for fentry in size_entries:
+				sample_hash=b''
+				if(fsize>(2*SAMPLE_BYTES)):
+					sample_hash=next(sample_digests)
+					stats_add(done_files=1,done_bytes=2*SAMPLE_BYTES)
+					stats_progress()
+				if(not (sample_hash in sample_acc)):
+					sample_acc[sample_hash]=[]
+				sample_acc[sample_hash].append(fentry)
+			
+			#if this is the only file with this sample then it can't be a duplicate
+			full_entries=[]
+			for sample_hash in sample_acc:
+				if(len(sample_acc[sample_hash])>1):
+					full_entries.extend(sample_acc[sample_hash])
+			
+			if(len(full_entries)>0):
+				full_groups.append((fsize,full_entries))
+		
+		#the entries which are still possible duplicates are all in full_groups now
+		del size_acc
+		
+		#full stage
+		#NOTE: this yields each size group as soon as its last file has been checksummed
+		#so that results can be streamed while files of other sizes are still being read
+		stats_phase('Hashing',sum([len(full_entries) for fsize,full_entries in full_groups]),sum([fsize*len(full_entries) for fsize,full_entries in full_groups]))
+		full_paths=(entry_io(fsize,fentry) for fsize,full_entries in full_groups for fentry in full_entries)
+		full_digests=checksum_paths(full_paths,hash_algo,'full',cache=cache,pools=pools,pool_workers=pool_workers,jobs=jobs,read_mode=read_mode,buf_bytes=buf_bytes)
+		for fsize,full_entries in full_groups:
+			group_acc:dict={}
+			for fentry in full_entries:
+				fhash=next(full_digests)
+				stats_add(done_files=1,done_bytes=fsize)
+				stats_progress()
+				if(not (fhash in group_acc)):
+					group_acc[fhash]=[]
+				group_acc[fhash].append(fentry)
+			
+			for fhash in group_acc:
+				if(len(group_acc[fhash])>1):
+					yield (fhash,fsize,[entry_path(fentry) for fentry in group_acc[fhash]])
+	finally:
+		for pool in pools.values():
+			pool.shutdown()
+		if(not (cache is None)):
+			cache.commit()
+
+#fix duplicates in a directory and all subdirectories thereof
+#args:
+#	directory: the directory to search for duplicates, or a list of directories to search together
+#	hash_algo: the hashing algorithm to use for duplicate detection
+#	ignore_git: whether or not to ignore git repositories during duplicate checking
+#	cache: the sqlite3 connection returned by cache_open, or None to not use a checksum cache
+#	jobs: the number of files to read and checksum in parallel from each non-rotational device
+#	read_mode: how to read files for full checksums; one of READ_MODES
+#	buf_bytes: the number of bytes to read per hash update for full checksums
+#return:
+#	returns the hash_acc value that was detected
+#	NOTE: only files which have at least one duplicate are included
+#side-effects:
+#	if a cache is given, checksums which were computed are stored in it
+def dup_find(directory:str|list,hash_algo:str,ignore_git:bool=False,cache:sqlite3.Connection=None,jobs:int=1,read_mode:str='auto',buf_bytes:int=HASH_BUF_BYTES) -> dict:
+	#hash_acc: the accumulator of hashes in the following data format
+	#	{
+	#		b"file_hash_0":[
+	#			"/path/to/file/0",
+	#			"/path/to/file/1"
+	#		],
+	#		b"file_hash_1":[
+	#			"/path/to/file/2",
+	#			"/path/to/file/3"
+	#		]
+	#	}
+	hash_acc:dict={}
+	
+	for fhash,fsize,fpaths in dup_groups(directory,hash_algo,ignore_git=ignore_git,cache=cache,jobs=jobs,read_mode=read_mode,buf_bytes=buf_bytes):
+		#if no files with this checksum have yet been found
+		if(not (fhash in hash_acc)):
+			#initialize a list now
+			hash_acc[fhash]=[]
+		
+		#append the current file paths to the list of files with the found checksum
+		#regardless of whether that list previously existed or was just initialized
+		#NOTE: all files with the same checksum here are already known to be the same size
+		hash_acc[fhash].extend(fpaths)
+	
+	return hash_acc
+
+#the formats that dup_report can write
+REPORT_FORMATS=['jsonl','csv']
+
+#this gets the form of a path which is written to a jsonl report
+#paths which aren't valid utf-8 (which python decodes to lone surrogates) can't be written to json as they are;
+#they're written as text with the invalid bytes replaced by U+FFFD, and separately as base64 of their original bytes
+#args:
+#	fpath: the path to report
+#return:
+#	returns a tuple of (path_text,path_b64) where path_b64 is None if the path is valid utf-8
+#side-effects:
+#	none
+def report_path(fpath:str) -> tuple:
+	try:
+		return (fpath.encode('utf-8').decode('utf-8'),None)
+	except UnicodeEncodeError as e:
+		fpath_bytes=os.fsencode(fpath)
+		return (fpath_bytes.decode('utf-8','replace'),base64.b64encode(fpath_bytes).decode('ascii'))
+
+#this writes a machine-readable report of duplicate files as they're found
+#nothing is kept in memory once it has been written
+#args:
+#	groups: an iterable of (group_key,file_size,file_paths) tuples, as yielded by dup_groups
+#	report_fp: the text file object to write the report to
+#	report_format: one of REPORT_FORMATS
+#		jsonl: one json object per duplicate set with hash, size, count, reclaimable_bytes and paths fields
+#			and if any path isn't valid utf-8, a paths_b64 field with base64 of the bytes of each such path (null for the others; see report_path)
+#		csv: a header and then one row per file with hash, size, count, reclaimable_bytes and path columns
+#return:
+#	returns a tuple of (dup_sets,dup_files,reclaimable_bytes) totals for the whole report
+#side-effects:
+#	writes to report_fp, flushing after every duplicate set so the report can be consumed while it's being written
+def dup_report(groups,report_fp,report_format:str='jsonl') -> tuple:
+	if(not (report_format in REPORT_FORMATS)):
+		raise Exception('Err: Unsupported report format '+str(report_format))
+	
+	csv_writer=None
+	if(report_format=='csv'):
+		csv_writer=csv.writer(report_fp)
+		csv_writer.writerow(['hash','size','count','reclaimable_bytes','path'])
+	
+	dup_sets=0
+	dup_files=0
+	total_reclaimable=0
+	for fhash,fsize,fpaths in groups:
+		#every copy except one could be removed
+		reclaimable_bytes=fsize*(len(fpaths)-1)
+		dup_sets+=1
+		dup_files+=len(fpaths)
+		total_reclaimable+=reclaimable_bytes
+		
+		if(report_format=='jsonl'):
+			report_paths=[report_path(fpath) for fpath in fpaths]
+			report_row={
+				'hash':fhash.hex(),
+				'size':fsize,
+				'count':len(fpaths),
+				'reclaimable_bytes':reclaimable_bytes,
+				'paths':[path_text for path_text,path_b64 in report_paths],
+			}
+			if(any([not (path_b64 is None) for path_text,path_b64 in report_paths])):
+				report_row['paths_b64']=[path_b64 for path_text,path_b64 in report_paths]
+			report_fp.write(json.dumps(report_row)+"\n")
+		elif(report_format=='csv'):
+			for fpath in fpaths:
+				csv_writer.writerow([fhash.hex(),fsize,len(fpaths),reclaimable_bytes,fpath])
+		report_fp.flush()
+	
+	return (dup_sets,dup_files,total_reclaimable)
+
+#the default average, minimum and maximum chunk sizes for near-duplicate detection
+#the average must be a power of two since chunk boundaries are found by masking bits of a rolling hash
+CHUNK_AVG_BYTES=64*1024
+
+#the default number of files a chunk can be shared by before it's considered too common to indicate similarity
+#(e.g. runs of zero bytes in disk images, or boilerplate headers) and is left out of file pairing
+#NOTE: this also bounds the number of pairs that any one chunk can contribute
+CHUNK_MAX_FILES=64
+
+#the number of chunk rows which are buffered before being written to the chunk index
+CHUNK_INSERT_ROWS=10000
+
+#the per-byte values of the gear rolling hash
+#these are derived from a fixed seed so that chunk boundaries (and so the chunk index) are the same between runs
+GEAR_TABLE=[int.from_bytes(hashlib.sha256(b'dup-fixer gear '+bytes([byte])).digest()[0:8],'little') for byte in range(0,256)]
+
+#this splits a file into content-defined chunks
+#chunk boundaries are placed where a gear rolling hash of the last 64 bytes matches a mask (as in FastCDC)
+#so an insertion or deletion only changes the chunks around it, rather than every chunk after it
+#args:
+#	fpath: the full path of the file to chunk
+#	hash_algo: the hashing algorithm to checksum each chunk with
+#	avg_bytes: the average chunk size; chunks are between a quarter and four times this size
+#	buf_bytes: the number of bytes to read from the file at once
+#return:
+#	yields a tuple of (chunk_digest,chunk_bytes) for each chunk of the file, in order
+#side-effects:
+#	none
+def chunk_file(fpath:str,hash_algo:str,avg_bytes:int=CHUNK_AVG_BYTES,buf_bytes:int=HASH_BUF_BYTES):
+	min_bytes=avg_bytes//4
+	max_bytes=avg_bytes*4
+	
+	#normalized chunking: a boundary is harder to match before the average size and easier after it
+	#which keeps chunk sizes closer to the average than a single mask would
+	#NOTE: the masks use the high bits of the hash since the low bits only depend on the last few bytes
+	avg_bits=avg_bytes.bit_length()-1
+	mask_small=((1<<(avg_bits+1))-1)<<(64-(avg_bits+1))
+	mask_large=((1<<(avg_bits-1))-1)<<(64-(avg_bits-1))
+	hash_max=(1<<64)-1
+	gear=GEAR_TABLE
+	
+	chunk_hash=new_hash_obj(hash_algo)
+	chunk_len=0
+	roll_hash=0
+	
+	#NOTE: everything other than reading (the rolling hash and chunk checksums) is counted as hashing time
+	#and the time spent by the caller between chunks isn't counted at all
+	read_secs=0.0
+	hash_secs=0.0
+	total_bytes=0
+	with open(fpath,'rb') as fp:
+		while True:
+			start_time=time.perf_counter()
+			data=fp.read(buf_bytes)
+			read_time=time.perf_counter()
+			read_secs+=read_time-start_time
+			if(not data):
+				break
+			total_bytes+=len(data)
+			
+			pos=0
+			data_len=len(data)
+			while(pos<data_len):
+				#a boundary can't be placed before the minimum size so those bytes are only checksummed
+				#NOTE: skipping the rolling hash for these bytes is most of what makes this fast enough in pure python
+				if(chunk_len<min_bytes):
+					take=min(min_bytes-chunk_len,data_len-pos)
+					chunk_hash.update(data[pos:pos+take])
+					chunk_len+=take
+					pos+=take
+					roll_hash=0
+					continue
+				
+				cut_idx=-1
+				scan_idx=pos
+				for mask,limit in [(mask_small,avg_bytes),(mask_large,max_bytes)]:
+					scan_end=min(data_len,pos+max(limit-chunk_len,0))
+					for scan_idx in range(scan_idx,scan_end):
+						roll_hash=((roll_hash<<1)+gear[data[scan_idx]])&hash_max
+						if(not (roll_hash&mask)):
+							cut_idx=scan_idx+1
+							break
+					else:
+						scan_idx=scan_end
+					if(cut_idx>=0 or scan_end==data_len):
+						break
+				
+				#if no boundary was found before the maximum size then the chunk ends there
+				if(cut_idx<0 and (chunk_len+(scan_idx-pos))>=max_bytes):
+					cut_idx=scan_idx
+				
+				if(cut_idx<0):
+					#the rest of this block is part of the current chunk
+					chunk_hash.update(data[pos:data_len])
+					chunk_len+=data_len-pos
+					pos=data_len
+				else:
+					chunk_hash.update(data[pos:cut_idx])
+					chunk_len+=cut_idx-pos
+					pos=cut_idx
+					hash_secs+=time.perf_counter()-read_time
+					yield (chunk_hash.digest(),chunk_len)
+					read_time=time.perf_counter()
+					chunk_hash=new_hash_obj(hash_algo)
+					chunk_len=0
+					roll_hash=0
+			hash_secs+=time.perf_counter()-read_time
+	stats_add(read_secs=read_secs,hash_secs=hash_secs,read_bytes=total_bytes)
+	
+	if(chunk_len>0):
+		yield (chunk_hash.digest(),chunk_len)
+
+#this chunks a whole file and counts how often each distinct chunk occurs in it
+#this is what near_dup_index runs in each worker process when files are chunked in parallel
+#args:
+#	fpath: the full path of the file to chunk
+#	hash_algo: the hashing algorithm to checksum each chunk with
+#	avg_bytes: the average chunk size
+#	buf_bytes: the number of bytes to read from the file at once
+#return:
+#	returns a tuple of (chunk_rows,err,read_secs,hash_secs,read_bytes)
+#	where chunk_rows is a list of (chunk_digest,chunk_bytes,count) for each distinct chunk (or None if the file couldn't be read)
+#	and err is the error message if it couldn't be read (or None)
+#	NOTE: the timers are returned since stats_add in a worker process only changes that process's counters
+#side-effects:
+#	resets this process's scan counters
+def chunk_file_counts(fpath:str,hash_algo:str,avg_bytes:int=CHUNK_AVG_BYTES,buf_bytes:int=HASH_BUF_BYTES) -> tuple:
+	stats_reset(False)
+	chunk_counts={}
+	err=None
+	try:
+		for chunk_digest,chunk_len in chunk_file(fpath,hash_algo,avg_bytes=avg_bytes,buf_bytes=buf_bytes):
+			if(chunk_digest in chunk_counts):
+				chunk_counts[chunk_digest][1]+=1
+			else:
+				chunk_counts[chunk_digest]=[chunk_len,1]
+	except OSError as e:
+		err=str(e)
+	
+	chunk_rows=None
+	if(err is None):
+		chunk_rows=[(chunk_digest,chunk_counts[chunk_digest][0],chunk_counts[chunk_digest][1]) for chunk_digest in chunk_counts]
+	return (chunk_rows,err,scan_stats['read_secs'],scan_stats['hash_secs'],scan_stats['read_bytes'])
+
+#this builds an index of the content-defined chunks of every file in a directory and all subdirectories thereof
+#the index is a temporary on-disk sqlite database, so memory use doesn't grow with the number of files or chunks
+#(set TMPDIR to choose where it's kept)
+#args:
+#	directory: the directory to search for near-duplicates, or a list of directories to search together
+#	hash_algo: the hashing algorithm to checksum each chunk with
+#	ignore_git: whether or not to ignore git repositories
+#	avg_bytes: the average chunk size; files smaller than this are skipped
+#	buf_bytes: the number of bytes to read from each file at once
+#	jobs: the number of files to chunk at once, each in its own process
+#return:
+#	returns an sqlite3 connection to the chunk index, with the following tables
+#		files(file_id,path,size) where path is the file path as bytes (see os.fsencode)
+#		chunks(digest,file_id,len,cnt) with one row per distinct chunk per file, and the number of times it occurs in that file
+#side-effects:
+#	creates a temporary database which is deleted when the returned connection is closed
+def near_dup_index(directory:str|list,hash_algo:str,ignore_git:bool=False,avg_bytes:int=CHUNK_AVG_BYTES,buf_bytes:int=HASH_BUF_BYTES,jobs:int=1) -> sqlite3.Connection:
+	dir_paths,dir_devs,size_acc=dup_walk(directory=directory,ignore_git=ignore_git)
+	
+	#NOTE: an empty filename makes sqlite create a private temporary database on disk
+	index=sqlite3.connect('')
+	index.execute('PRAGMA temp_store=FILE')
+	#NOTE: paths are stored as bytes since sqlite can't store the surrogates which paths that aren't valid utf-8 are decoded to
+	index.execute('CREATE TABLE files (file_id INTEGER PRIMARY KEY, path BLOB NOT NULL, size INTEGER NOT NULL)')
+	index.execute('CREATE TABLE chunks (digest BLOB NOT NULL, file_id INTEGER NOT NULL, len INTEGER NOT NULL, cnt INTEGER NOT NULL, PRIMARY KEY (digest,file_id)) WITHOUT ROWID')
+	chunk_insert='INSERT INTO chunks (digest,file_id,len,cnt) VALUES (?,?,?,?) ON CONFLICT (digest,file_id) DO UPDATE SET cnt=cnt+excluded.cnt'
+	
+	#files are chunked in size order so that results don't depend on directory listing order
+	chunk_sizes=sorted([fsize for fsize in size_acc if fsize>=avg_bytes])
+	chunk_entries=lambda fsize: (size_acc[fsize] if isinstance(size_acc[fsize],list) else [size_acc[fsize]])
+	stats_phase('Chunking',sum([len(chunk_entries(fsize)) for fsize in chunk_sizes]),sum([fsize*len(chunk_entries(fsize)) for fsize in chunk_sizes]))
+	
+	#NOTE: the rolling hash is bound by the interpreter, not by reads, so threads wouldn't help;
+	#with more than one job, files are chunked in worker processes and only written to the index from this process
+	#a worker returns all of a file's distinct chunks at once (roughly 100 bytes per chunk, so about 1.5MB per GB at the default chunk size)
+	#whereas with one job each file's chunks are written out in batches as they're found
+	executor=None
+	if(jobs>1):
+		executor=concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+	
+	#the files being chunked by workers, in order, as (fpath,fsize,file_id,future) tuples
+	#NOTE: results are written in submission order so that file ids (and so the report) don't depend on which worker finishes first
+	in_flight=collections.deque()
+	
+	#this writes the result of a worker to the index
+	def index_result(fpath:str,fsize:int,file_id:int,future:concurrent.futures.Future):
+		chunk_rows,err,read_secs,hash_secs,read_bytes=future.result()
+		stats_add(read_secs=read_secs,hash_secs=hash_secs,read_bytes=read_bytes)
+		if(err is None):
+			for row_idx in range(0,len(chunk_rows),CHUNK_INSERT_ROWS):
+				index.executemany(chunk_insert,[(chunk_digest,file_id,chunk_len,chunk_cnt) for chunk_digest,chunk_len,chunk_cnt in chunk_rows[row_idx:row_idx+CHUNK_INSERT_ROWS]])
+		else:
+			print('Err: Could not read "'+fpath+'"; skipping it: '+err,file=sys.stderr)
+		stats_add(done_files=1,done_bytes=fsize)
+		stats_progress()
+	
+	chunk_rows=[]
+	try:
+		for fsize in chunk_sizes:
+			for fentry in chunk_entries(fsize):
+				fpath=os.path.join(dir_paths[fentry[0]],fentry[1])
+				file_id=index.execute('INSERT INTO files (path,size) VALUES (?,?)',(os.fsencode(fpath),fsize)).lastrowid
+				
+				if(not (executor is None)):
+					#NOTE: a couple of files are queued per worker so that no worker sits idle
+					in_flight.append((fpath,fsize,file_id,executor.submit(chunk_file_counts,fpath,hash_algo,avg_bytes,buf_bytes)))
+					while(len(in_flight)>=(jobs*2)):
+						index_result(*in_flight.popleft())
+					continue
+				
+				try:
+					for chunk_digest,chunk_len in chunk_file(fpath,hash_algo,avg_bytes=avg_bytes,buf_bytes=buf_bytes):
+						#NOTE: a chunk which repeats within a file is only indexed once for that file, with a count
+						chunk_rows.append((chunk_digest,file_id,chunk_len,1))
+						if(len(chunk_rows)>=CHUNK_INSERT_ROWS):
+							index.executemany(chunk_insert,chunk_rows)
+							chunk_rows=[]
+				except OSError as e:
+					print('Err: Could not read "'+fpath+'"; skipping it: '+str(e),file=sys.stderr)
+				stats_add(done_files=1,done_bytes=fsize)
+				stats_progress()
+		
+		while(len(in_flight)>0):
+			index_result(*in_flight.popleft())
+	finally:
+		if(not (executor is None)):
+			executor.shutdown(cancel_futures=True)
+	
+	if(len(chunk_rows)>0):
+		index.executemany(chunk_insert,chunk_rows)
+	index.commit()
+	
+	return index
+
+#this finds pairs of files which share a large part of their content in a chunk index
+#args:
+#	index: the sqlite3 connection returned by near_dup_index
+#	min_ratio: the minimum fraction of the larger file's bytes that must be shared for a pair to be reported
+#	max_chunk_files: chunks which are shared by more than this many files are ignored
+#return:
+#	yields a tuple of (path_a,path_b,size_a,size_b,shared_bytes) for each pair, from most to least shared bytes
+#side-effects:
+#	none; sqlite keeps the intermediate pair totals on disk
+def near_dup_pairs(index:sqlite3.Connection,min_ratio:float,max_chunk_files:int=CHUNK_MAX_FILES):
+	pair_rows=index.execute(
+		'WITH common AS (SELECT digest FROM chunks GROUP BY digest HAVING COUNT(*) BETWEEN 2 AND ?), '+
+		'pairs AS ('+
+			'SELECT a.file_id AS file_a, b.file_id AS file_b, SUM(a.len*MIN(a.cnt,b.cnt)) AS shared FROM chunks a '+
+			'JOIN chunks b ON b.digest=a.digest AND b.file_id>a.file_id '+
+			'WHERE a.digest IN common '+
+			'GROUP BY a.file_id,b.file_id'+
+		') '+
+		'SELECT fa.path,fb.path,fa.size,fb.size,pairs.shared FROM pairs '+
+		'JOIN files fa ON fa.file_id=pairs.file_a JOIN files fb ON fb.file_id=pairs.file_b '+
+		'WHERE pairs.shared>=?*MAX(fa.size,fb.size) '+
+		'ORDER BY pairs.shared DESC,fa.path,fb.path',
+		(max_chunk_files,min_ratio)
+	)
+	for path_a,path_b,size_a,size_b,shared_bytes in pair_rows:
+		yield (os.fsdecode(path_a),os.fsdecode(path_b),size_a,size_b,shared_bytes)
+
+#this gets the totals for how much space chunk-level deduplication could save
+#args:
+#	index: the sqlite3 connection returned by near_dup_index
+#return:
+#	returns a tuple of (total_bytes,unique_bytes) where total_bytes is the size of every indexed file together
+#	and unique_bytes is the size of every distinct chunk together
+#side-effects:
+#	none
+def near_dup_savings(index:sqlite3.Connection) -> tuple:
+	total_bytes=index.execute('SELECT COALESCE(SUM(size),0) FROM files').fetchone()[0]
+	unique_bytes=index.execute('SELECT COALESCE(SUM(len),0) FROM (SELECT MAX(len) AS len FROM chunks GROUP BY digest)').fetchone()[0]
+	return (total_bytes,unique_bytes)
+
+#this writes a machine-readable report of near-duplicate file pairs as they're found
+#args:
+#	pairs: an iterable of (path_a,path_b,size_a,size_b,shared_bytes) tuples, as yielded by near_dup_pairs
+#	report_fp: the text file object to write the report to
+#	report_format: one of REPORT_FORMATS
+#		jsonl: one json object per pair with path_a, path_b, size_a, size_b, shared_bytes and shared_ratio fields
+#			and path_a_b64 or path_b_b64 fields with base64 of the bytes of a path which isn't valid utf-8 (see report_path)
+#		csv: a header and then one row per pair with the same columns
+#return:
+#	returns the number of pairs that were written
+#side-effects:
+#	writes to report_fp, flushing after every pair
+def near_dup_report(pairs,report_fp,report_format:str='jsonl') -> int:
+	if(not (report_format in REPORT_FORMATS)):
+		raise Exception('Err: Unsupported report format '+str(report_format))
+	
+	fields=['path_a','path_b','size_a','size_b','shared_bytes','shared_ratio']
+	csv_writer=None
+	if(report_format=='csv'):
+		csv_writer=csv.writer(report_fp)
+		csv_writer.writerow(fields)
+	
+	pair_cnt=0
+	for path_a,path_b,size_a,size_b,shared_bytes in pairs:
+		pair_cnt+=1
+		row=[path_a,path_b,size_a,size_b,shared_bytes,round(shared_bytes/max(size_a,size_b),4)]
+		if(report_format=='jsonl'):
+			report_row=dict(zip(fields,row))
+			for field in ['path_a','path_b']:
+				report_row[field],path_b64=report_path(report_row[field])
+				if(not (path_b64 is None)):
+					report_row[field+'_b64']=path_b64
+			report_fp.write(json.dumps(report_row)+"\n")
+		elif(report_format=='csv'):
+			csv_writer.writerow(row)
+		report_fp.flush()
+	
+	return pair_cnt
+
+#inotify flags and event masks from linux/inotify.h
+IN_CLOEXEC=0o2000000
+IN_CLOSE_WRITE=0x00000008
+IN_MOVED_FROM=0x00000040
+IN_MOVED_TO=0x00000080
+IN_CREATE=0x00000100
+IN_DELETE=0x00000200
+IN_DELETE_SELF=0x00000400
+IN_Q_OVERFLOW=0x00004000
+IN_IGNORED=0x00008000
+IN_ONLYDIR=0x01000000
+IN_DONTFOLLOW=0x02000000
+IN_ISDIR=0x40000000
+
+#the events which are watched for on every directory
+#NOTE: files are only considered once they've been closed after writing (or moved into place)
+#so that partially-written files are never checksummed
+WATCH_MASK=IN_CLOSE_WRITE|IN_MOVED_FROM|IN_MOVED_TO|IN_CREATE|IN_DELETE|IN_DELETE_SELF|IN_ONLYDIR|IN_DONTFOLLOW
+
+#the header of each inotify event: watch descriptor, mask, cookie, and name length
+INOTIFY_EVENT=struct.Struct('iIII')
+
+#this opens a new inotify instance
+#NOTE: python has no built-in inotify support so this calls into libc directly
+#args:
+#	none
+#return:
+#	returns a tuple of (libc,inotify_fd)
+#side-effects:
+#	opens a file descriptor which must be closed by the caller
+def inotify_open() -> tuple:
+	libc=ctypes.CDLL(ctypes.util.find_library('c'),use_errno=True)
+	inotify_fd=libc.inotify_init1(IN_CLOEXEC)
+	if(inotify_fd<0):
+		err=ctypes.get_errno()
+		raise OSError(err,'Err: Could not initialize inotify: '+os.strerror(err))
+	return (libc,inotify_fd)
+
+#this starts watching a directory for changes
+#args:
+#	libc: the libc returned by inotify_open
+#	inotify_fd: the inotify file descriptor returned by inotify_open
+#	directory: the path of the directory to watch
+#return:
+#	returns the watch descriptor for the directory
+#side-effects:
+#	adds an inotify watch
+def inotify_watch(libc,inotify_fd:int,directory:str) -> int:
+	wd=libc.inotify_add_watch(inotify_fd,os.fsencode(directory),WATCH_MASK)
+	if(wd<0):
+		err=ctypes.get_errno()
+		if(err==errno.ENOSPC):
+			raise OSError(err,'Err: Ran out of inotify watches at '+directory+'; try raising /proc/sys/fs/inotify/max_user_watches')
+		raise OSError(err,'Err: Could not watch '+directory+': '+os.strerror(err))
+	return wd
+
+#this reads pending events from an inotify instance, waiting for at least one if there are none
+#args:
+#	inotify_fd: the inotify file descriptor returned by inotify_open
+#return:
+#	yields a tuple of (wd,mask,cookie,name) for each event
+#side-effects:
+#	consumes events from the inotify instance
+def inotify_events(inotify_fd:int):
+	buf=os.read(inotify_fd,64*1024)
+	offset=0
+	while(offset<len(buf)):
+		wd,mask,cookie,name_len=INOTIFY_EVENT.unpack_from(buf,offset)
+		offset+=INOTIFY_EVENT.size
+		#the name is null-padded
+		name=os.fsdecode(buf[offset:offset+name_len].rstrip(b'\0'))
+		offset+=name_len
+		yield (wd,mask,cookie,name)
+
+#this continuously watches a directory and all subdirectories thereof and reports new duplicates as they appear
+#the whole tree is scanned once up front (and any existing duplicates are reported),
+#after which only files that are created, modified, or moved into the tree are checksummed
+#args:
+#	directory: the directory to watch for duplicates, or a list of directories to watch together
+#	hash_algo: the hashing algorithm to use for duplicate detection
+#	report_fp: the text file object to write duplicate sets to
+#	report_format: one of REPORT_FORMATS
+#	ignore_git: whether or not to ignore git repositories during duplicate checking
+#	cache: the sqlite3 connection returned by cache_open, or None to not use a checksum cache
+#	jobs: the number of files to read and checksum in parallel during the initial scan
+#	read_mode: how to read files for full checksums; one of READ_MODES
+#	buf_bytes: the number of bytes to read per hash update for full checksums
+#return:
+#	does not return; this runs until interrupted
+#side-effects:
+#	writes a duplicate set to report_fp each time a file is found to duplicate another file
+#	(the whole set of identical files is written again each time it grows, but not when a member is renamed or rewritten)
+#	if a cache is given, checksums which were computed are stored in it
+def dup_watch(directory:str|list,hash_algo:str,report_fp,report_format:str='jsonl',ignore_git:bool=False,cache:sqlite3.Connection=None,jobs:int=1,read_mode:str='auto',buf_bytes:int=HASH_BUF_BYTES):
+	libc,inotify_fd=inotify_open()
+	
+	#watch descriptors mapped to the directory they watch
+	wd_dirs:dict={}
+	
+	#NOTE: unlike dup_find, every file's path and size are kept since any of them could gain a duplicate later
+	#	size_index: {file_size:set of paths}
+	#	path_sizes: {path:file_size}
+	#	digests: {path:full checksum}, for files which have been checksummed since they last changed
+	#	path_inodes: {path:(st_dev,st_ino)}
+	#	reported: {full checksum:set of (st_dev,st_ino)}, the files in each duplicate set when it was last reported
+	#NOTE: reported sets are kept by inode rather than by path so that renaming or touching a member doesn't count as the set growing
+	size_index:dict={}
+	path_sizes:dict={}
+	path_inodes:dict={}
+	digests:dict={}
+	reported:dict={}
+	
+	def forget_file(fpath:str):
+		if(fpath in path_sizes):
+			fsize=path_sizes.pop(fpath)
+			size_index[fsize].discard(fpath)
+			if(len(size_index[fsize])==0):
+				del size_index[fsize]
+		path_inodes.pop(fpath,None)
+		digests.pop(fpath,None)
+	
+	#this drops a deleted file from its reported duplicate set
+	#so that a new copy which happens to reuse its inode number is still reported
+	#NOTE: this isn't done for files which are moved away, since that's also how a rename within the tree starts
+	def unreport_file(fpath:str):
+		if((fpath in digests) and (fpath in path_inodes) and (digests[fpath] in reported)):
+			reported[digests[fpath]].discard(path_inodes[fpath])
+	
+	def add_file(fpath:str,fstat:os.stat_result):
+		forget_file(fpath)
+		path_sizes[fpath]=fstat.st_size
+		path_inodes[fpath]=(fstat.st_dev,fstat.st_ino)
+		if(not (fstat.st_size in size_index)):
+			size_index[fstat.st_size]=set()
+		size_index[fstat.st_size].add(fpath)
+	
+	#this stops watching a directory tree which was moved away or deleted and forgets all files in it
+	def forget_tree(tree_dir:str):
+		tree_prefix=tree_dir+os.path.sep
+		for wd in [wd for wd in wd_dirs if (wd_dirs[wd]==tree_dir or wd_dirs[wd].startswith(tree_prefix))]:
+			libc.inotify_rm_watch(inotify_fd,wd)
+			del wd_dirs[wd]
+		for fpath in [fpath for fpath in path_sizes if fpath.startswith(tree_prefix)]:
+			forget_file(fpath)
+	
+	#this starts watching a directory tree and adds all files in it to the index
+	#returns the list of files which were found
+	def watch_tree(tree_dir:str) -> list:
+		fpaths=[]
+		#NOTE: symlinked directories are listed but not descended into, the same as in walk_files
+		for dirpath,dirnames,filenames in os.walk(tree_dir):
+			if(ignore_git and ('.git' in dirnames or '.git' in filenames)):
+				print('Skipping directory '+dirpath+' because it is a git repository...',file=sys.stderr) #debug
+				dirnames.clear()
+				continue
+			
+			wd_dirs[inotify_watch(libc,inotify_fd,dirpath)]=dirpath
+			for fname in filenames:
+				fpath=os.path.join(dirpath,fname)
+				try:
+					fstat=os.stat(fpath,follow_symlinks=False)
+				except FileNotFoundError as e:
+					continue
+				if(stat.S_ISREG(fstat.st_mode)):
+					add_file(fpath,fstat)
+					fpaths.append(fpath)
+		return fpaths
+	
+	#this gets the files in a list which are distinct files (not hard links to a file earlier in the list)
+	#files which no longer exist are forgotten and left out
+	#returns a tuple of (distinct file paths,set of (st_dev,st_ino) for those files)
+	def distinct_files(fpaths:list) -> tuple:
+		inodes=set()
+		distinct=[]
+		for fpath in fpaths:
+			try:
+				fstat=os.stat(fpath)
+			except FileNotFoundError as e:
+				forget_file(fpath)
+				continue
+			if(not ((fstat.st_dev,fstat.st_ino) in inodes)):
+				inodes.add((fstat.st_dev,fstat.st_ino))
+				distinct.append(fpath)
+		return (distinct,inodes)
+	
+	#this reports a duplicate set if it has any files which weren't in it when it was last reported
+	#NOTE: files which have since been moved out of the tree are dropped from the reported set here
+	def report_set(fhash:bytes,fsize:int,fpaths:list):
+		fpaths,inodes=distinct_files(fpaths)
+		if(len(fpaths)<2):
+			return
+		if(len(inodes-reported.get(fhash,set()))>0):
+			dup_report([(fhash,fsize,fpaths)],report_fp,report_format=report_format)
+		reported[fhash]=inodes
+	
+	#this checksums a new or changed file (and any files of the same size) and reports it if it has duplicates
+	def check_file(fpath:str):
+		try:
+			fstat=os.stat(fpath,follow_symlinks=False)
+		except FileNotFoundError as e:
+			forget_file(fpath)
+			return
+		if(not stat.S_ISREG(fstat.st_mode)):
+			return
+		
+		add_file(fpath,fstat)
+		if(len(size_index[fstat.st_size])<2):
+			return
+		
+		for spath in sorted(size_index[fstat.st_size]):
+			if(spath in digests):
+				continue
+			#files can disappear (e.g. with a directory that was moved away) between being indexed and being read
+			try:
+				digests[spath]=next(checksum_paths([(spath,None,None)],hash_algo,'full',cache=cache,read_mode=read_mode,buf_bytes=buf_bytes))
+			except OSError as e:
+				forget_file(spath)
+			except Exception as e:
+				#NOTE: checksum_file raises a plain Exception for a file which doesn't exist; anything else is a real error
+				if(os.path.isfile(spath)):
+					raise
+				forget_file(spath)
+		if(not (cache is None)):
+			cache.commit()
+		
+		if(not (fpath in digests)):
+			return
+		dup_paths=[spath for spath in sorted(size_index[fstat.st_size]) if digests.get(spath)==digests[fpath]]
+		report_set(digests[fpath],fstat.st_size,dup_paths)
+	
+	try:
+		#NOTE: watches are added before the initial checksumming so that nothing which changes during it is missed
+		roots=[directory] if isinstance(directory,str) else directory
+		for root in roots:
+			print('Watching "'+root+'" ...',file=sys.stderr) #debug
+			watch_tree(root)
+		
+		#the initial scan is done with the same staged checksumming as dup_find, from the index that was just built
+		#NOTE: dir_paths has a single empty directory so that each entry's name is its whole path
+		#and since the device of each file isn't kept they're all read through a single pool
+		size_acc={}
+		for fsize in size_index:
+			if(len(size_index[fsize])>1):
+				size_acc[fsize]=distinct_files(sorted(size_index[fsize]))[0]
+				size_acc[fsize]=[(0,fpath) for fpath in size_acc[fsize]]
+		for fhash,fsize,fpaths in dup_size_groups([''],[None],size_acc,hash_algo,cache=cache,jobs=jobs,read_mode=read_mode,buf_bytes=buf_bytes):
+			for fpath in fpaths:
+				digests[fpath]=fhash
+			report_set(fhash,fsize,fpaths)
+		del size_acc
+		print('Initial scan complete; waiting for changes...',file=sys.stderr) #debug
+		
+		while True:
+			for wd,mask,cookie,name in inotify_events(inotify_fd):
+				if(mask&IN_Q_OVERFLOW):
+					print('Err: inotify event queue overflowed; some changes may have been missed',file=sys.stderr)
+					continue
+				if(mask&(IN_IGNORED|IN_DELETE_SELF)):
+					wd_dirs.pop(wd,None)
+					continue
+				if(not (wd in wd_dirs)):
+					continue
+				
+				fpath=os.path.join(wd_dirs[wd],name)
+				if(mask&IN_ISDIR):
+					#a new directory may already have files in it by the time it's being watched
+					if(mask&(IN_CREATE|IN_MOVED_TO)):
+						if(ignore_git and name=='.git'):
+							forget_tree(wd_dirs[wd])
+							continue
+						for new_fpath in watch_tree(fpath):
+							check_file(new_fpath)
+					elif(mask&(IN_DELETE|IN_MOVED_FROM)):
+						forget_tree(fpath)
+				elif(mask&(IN_CLOSE_WRITE|IN_MOVED_TO)):
+					check_file(fpath)
+				elif(mask&(IN_DELETE|IN_MOVED_FROM)):
+					if(mask&IN_DELETE):
+						unreport_file(fpath)
+					forget_file(fpath)
+	finally:
+		os.close(inotify_fd)
+
+#this compares two files byte-for-byte
+#this is used before destructive actions so that a hash collision can never cause data loss
+#args:
+#	fpath: the path of the first file
+#	canonical_path: the path of the second file
+#	buf_bytes: the number of bytes to compare at a time
+#return:
+#	returns True if the files have identical content, False otherwise
+#side-effects:
+#	none
+def verify_identical(fpath:str,canonical_path:str,buf_bytes:int=HASH_BUF_BYTES) -> bool:
+	if(os.path.getsize(fpath)!=os.path.getsize(canonical_path)):
+		return False
+	
+	with open(fpath,'rb') as fp:
+		with open(canonical_path,'rb') as canonical_fp:
+			while True:
+				block=fp.read(buf_bytes)
+				canonical_block=canonical_fp.read(buf_bytes)
+				if(block!=canonical_block):
+					return False
+				if(block==b''):
+					return True
+
+#the directory in which journals are kept unless another path is given
+#NOTE: each run gets its own journal so that an old journal can still be resumed or rolled back later
+JOURNAL_DIR=os.path.join(os.path.expanduser('~'),'.cache','dup-fixer')
+JOURNAL_DEFAULT_PATH=os.path.join(JOURNAL_DIR,'journal-'+time.strftime('%Y%m%d-%H%M%S')+'-'+str(os.getpid())+'.jsonl')
+
+#the journal is a json lines file which is only ever appended to, with the following records
+#	{"plan":op_id,"op":"symlink" or "remove","dir":...,"name":...,"canonical":...,"target":...,"size":...,"mode":...,"uid":...,"gid":...,"atime_ns":...,"mtime_ns":...}
+#		an operation which is about to be applied; every planned operation is written (and synced) before any of them are applied
+#		dir and canonical are absolute paths so that the journal doesn't depend on the directory it's used from
+#	{"done":op_id}
+#		the operation was applied (or had already been applied)
+#	{"skipped":op_id}
+#		the operation was not applied because the file changed after it was planned, or because of an error
+#	{"undone":op_id}
+#		the operation was rolled back and the copy was restored from the canonical copy
+#where there is more than one record for an operation the last one is its current state
+#operations are applied such that repeating one which was interrupted is always safe
+#so an operation with no record after its plan (e.g. because of a crash) is simply applied again on resume
+
+#this plans a symlink or remove operation, recording everything needed to apply it later or to undo it
+#args:
+#	op_type: "symlink" to replace the copy with a symlink to the canonical copy, or "remove" to delete the copy
+#	fpath: the path of the copy
+#	canonical_path: the path of the canonical copy
+#	target: for symlinks, the destination of the symlink (relative to the copy's directory)
+#return:
+#	returns the planned operation as a dict in the journal's plan record format (without the op_id)
+#side-effects:
+#	none
+def journal_plan_op(op_type:str,fpath:str,canonical_path:str,target:str=None) -> dict:
+	fstat=os.stat(fpath,follow_symlinks=False)
+	fdir,fname=os.path.split(os.path.abspath(fpath))
+	op={
+		'op':op_type,
+		'dir':fdir,
+		'name':fname,
+		'canonical':os.path.abspath(canonical_path),
+		'size':fstat.st_size,
+		'mode':stat.S_IMODE(fstat.st_mode),
+		'uid':fstat.st_uid,
+		'gid':fstat.st_gid,
+		'atime_ns':fstat.st_atime_ns,
+		'mtime_ns':fstat.st_mtime_ns,
+	}
+	if(op_type=='symlink'):
+		op['target']=target
+	return op
+
+#this reads a journal
+#args:
+#	journal_path: the path of the journal to read
+#return:
+#	returns a tuple of (ops,op_states) where ops is a dict of op_id to planned operation
+#	and op_states is a dict of op_id to "done", "skipped" or "undone" for every operation which has a state
+#side-effects:
+#	none
+def journal_load(journal_path:str) -> tuple:
+	ops:dict={}
+	op_states:dict={}
+	with open(journal_path,'r') as fp:
+		for line in fp:
+			try:
+				record=json.loads(line)
+			except ValueError as e:
+				#NOTE: the last line can be incomplete if the script was killed while writing it
+				continue
+			if('plan' in record):
+				ops[record['plan']]={key:record[key] for key in record if key!='plan'}
+			for op_state in ['done','skipped','undone']:
+				if(op_state in record):
+					op_states[record[op_state]]=op_state
+	return (ops,op_states)
+
+#this opens a journal for appending records to it
+#args:
+#	journal_path: the path of the journal; it's created if it doesn't exist
+#return:
+#	returns the open file object
+#side-effects:
+#	if the journal's last line is incomplete (because the script was killed while writing it) it's terminated
+#	so that the next record isn't appended onto it
+def journal_open(journal_path:str):
+	journal_fp=open(journal_path,'a+b')
+	try:
+		if(journal_fp.seek(0,os.SEEK_END)>0):
+			journal_fp.seek(-1,os.SEEK_END)
+			if(journal_fp.read(1)!=b"\n"):
+				journal_fp.write(b"\n")
+	finally:
+		journal_fp.close()
+	return open(journal_path,'a')
+
+#this flushes a journal to disk
+#args:
+#	journal_fp: the journal's open file object
+#return:
+#	none
+#side-effects:
+#	flushes and fsyncs journal_fp
+def journal_sync(journal_fp) -> None:
+	journal_fp.flush()
+	os.fsync(journal_fp.fileno())
+
+#this checks whether a copy is still exactly as it was when its operation was planned
+#args:
+#	op: the planned operation
+#	fstat: the os.stat result (not following symlinks) of the copy
+#return:
+#	returns True if the copy is the same regular file it was when planned, False otherwise
+#side-effects:
+#	none
+def journal_unchanged(op:dict,fstat:os.stat_result) -> bool:
+	return (stat.S_ISREG(fstat.st_mode) and fstat.st_size==op['size'] and fstat.st_mtime_ns==op['mtime_ns'])
+
+#this applies a single planned operation
+#args:
+#	op: the planned operation
+#	dir_fd: an open file descriptor of op['dir']
 #return:
-#	returns the checksum of the given file as a string
+#	returns True if the operation is now applied (including if it already was), False if it was skipped
 #side-effects:
-#	none
-def checksum_file(fpath:str,hash_algo:str) -> str:
-	if(not os.path.isfile(fpath)):
-		raise Exception('Err: Checksum requested for non-existent file '+str(fpath))
-	
-	#declare buffer size
-	HASH_BUF_BYTES=1024
+#	replaces the copy with a symlink or deletes it
+def journal_do_op(op:dict,dir_fd:int) -> bool:
+	fname=op['name']
+	try:
+		fstat=os.stat(fname,dir_fd=dir_fd,follow_symlinks=False)
+	except FileNotFoundError as e:
+		fstat=None
 	
-	#initialize hash object based on requested hash algorithm
-	hash_obj=None
-	if(hash_algo=='sha1'):
-		hash_obj=hashlib.sha1()
-	elif(hash_algo=='sha256'):
-		hash_obj=hashlib.sha256()
-	elif(hash_algo=='md5'):
-		hash_obj=hashlib.md5()
+	#if this was already applied (e.g. before a crash) there's nothing to do
+	if(op['op']=='remove' and (fstat is None)):
+		return True
+	if(op['op']=='symlink' and (not (fstat is None)) and stat.S_ISLNK(fstat.st_mode) and os.readlink(fname,dir_fd=dir_fd)==op['target']):
+		return True
 	
-	#read the file in as binary blocks
-	with open(fpath,'rb') as fp:
-		block=0
-		while(block!=b''):
-			block=fp.read(HASH_BUF_BYTES)
-			#update the hash with each block
-			hash_obj.update(block)
+	if((fstat is None) or (not journal_unchanged(op,fstat))):
+		print('Err: "'+os.path.join(op['dir'],fname).encode('utf-8','ignore').decode('utf-8')+'" has changed since it was planned; skipping it')
+		return False
 	
-	#return the hash that resulted once the file has been thoroughly read
-	#and format it as a hex string
-	return hash_obj.hexdigest()
-
+	if(op['op']=='remove'):
+		os.unlink(fname,dir_fd=dir_fd)
+	elif(op['op']=='symlink'):
+		#NOTE: the symlink is made under a temporary name and renamed over the copy
+		#so that there is never a moment where neither the copy nor the symlink exist
+		tmp_name='.'+fname+'.dup-fixer-tmp'
+		try:
+			os.unlink(tmp_name,dir_fd=dir_fd)
+		except FileNotFoundError as e:
+			pass
+		os.symlink(op['target'],tmp_name,dir_fd=dir_fd)
+		os.replace(tmp_name,fname,src_dir_fd=dir_fd,dst_dir_fd=dir_fd)
+	else:
+		raise Exception('Err: Unsupported journal operation '+str(op['op']))
+	return True
 
-#fix duplicates in a directory and all subdirectories thereof
+#this undoes a single planned operation by restoring the copy from the canonical copy
 #args:
-#	directory: the directory to search for duplicates
-#	hash_algo: the hashing algorithm to use for duplicate detection
-#	ignore_git: whether or not to ignore git repositories during duplicate checking
+#	op: the planned operation
+#	dir_fd: an open file descriptor of op['dir']
 #return:
-#	returns the hash_acc value that was detected
+#	returns True if the copy is now restored (including if the operation was never applied), False if it was skipped
 #side-effects:
-#	no side-effects persist after return
-def dup_find(directory:str,hash_algo:str,ignore_git:bool=False) -> dict:
-	#hash_acc: the accumulator of hashes in the following data format
-	#	{
-	#		"file_hash_0":[
-	#			"/path/to/file/0",
-	#			"/path/to/file/1"
-	#		],
-	#		"file_hash_1":[
-	#			"/path/to/file/2"
-	#		]
-	#	}
-	hash_acc:dict={}
+#	replaces the symlink (or the deleted copy) with a copy of the canonical file with the original mode, owner and times
+def journal_undo_op(op:dict,dir_fd:int) -> bool:
+	fname=op['name']
+	decoded_fpath=os.path.join(op['dir'],fname).encode('utf-8','ignore').decode('utf-8')
+	try:
+		fstat=os.stat(fname,dir_fd=dir_fd,follow_symlinks=False)
+	except FileNotFoundError as e:
+		fstat=None
 	
-	if(not os.path.isdir(directory)):
-		raise Exception('Err: Given directory '+directory+' does not exist')
-		return hash_acc
+	#if this was never applied (or was already undone) there's nothing to do
+	if((not (fstat is None)) and journal_unchanged(op,fstat)):
+		return True
 	
-	#for each file or directory within this directory
-	dir_contents=os.listdir(directory)
+	#only undo exactly what was done, so that anything which was changed afterward isn't clobbered
+	if(op['op']=='remove'):
+		applied=(fstat is None)
+	else:
+		applied=((not (fstat is None)) and stat.S_ISLNK(fstat.st_mode) and os.readlink(fname,dir_fd=dir_fd)==op['target'])
+	if(not applied):
+		print('Err: "'+decoded_fpath+'" has changed since it was replaced; not restoring it')
+		return False
 	
-	#if we're ignoring git repositories
-	if(ignore_git):
-		#if this is a git repository
-		for fname in dir_contents:
-			basename=os.path.split(fname)[1]
-			if(basename=='.git'):
-				print('Skipping directory '+directory+' because it is a git repository...') #debug
-				#then skip it and all of its contents
-				return []
+	if(os.stat(op['canonical']).st_size!=op['size']):
+		print('Err: The canonical copy of "'+decoded_fpath+'" has changed since it was planned; not restoring it')
+		return False
 	
-	print('Scanning directory "'+directory+'" ...') #debug
+	tmp_name='.'+fname+'.dup-fixer-tmp'
+	try:
+		os.unlink(tmp_name,dir_fd=dir_fd)
+	except FileNotFoundError as e:
+		pass
+	try:
+		tmp_fd=os.open(tmp_name,os.O_WRONLY|os.O_CREAT|os.O_EXCL,0o600,dir_fd=dir_fd)
+		with open(tmp_fd,'wb') as tmp_fp:
+			with open(op['canonical'],'rb') as canonical_fp:
+				shutil.copyfileobj(canonical_fp,tmp_fp,HASH_BUF_BYTES)
+		
+		#NOTE: ownership is set before the mode since changing the owner can clear setuid and setgid bits
+		#and it can only be restored when running as root
+		try:
+			os.chown(tmp_name,op['uid'],op['gid'],dir_fd=dir_fd)
+		except PermissionError as e:
+			pass
+		os.chmod(tmp_name,op['mode'],dir_fd=dir_fd)
+		os.utime(tmp_name,ns=(op['atime_ns'],op['mtime_ns']),dir_fd=dir_fd)
+		os.replace(tmp_name,fname,src_dir_fd=dir_fd,dst_dir_fd=dir_fd)
+	except BaseException as e:
+		try:
+			os.unlink(tmp_name,dir_fd=dir_fd)
+		except FileNotFoundError as e:
+			pass
+		raise
+	return True
+
+#this applies (or undoes) planned operations one directory at a time, recording each result in the journal
+#args:
+#	id_ops: a list of (op_id,op) tuples for operations which have already been written to the journal
+#	journal_fp: the journal's open file object, for appending
+#	undo: True to undo the operations instead of applying them
+#return:
+#	returns a tuple of (done_cnt,skipped_cnt)
+#side-effects:
+#	applies or undoes the operations and appends their results to the journal
+def journal_run(id_ops:list,journal_fp,undo:bool=False) -> tuple:
+	#the operations grouped by directory, with directories in the order they were first planned
+	dir_ops:dict={}
+	for op_id,op in id_ops:
+		if(not (op['dir'] in dir_ops)):
+			dir_ops[op['dir']]=[]
+		dir_ops[op['dir']].append((op_id,op))
 	
-	for fname in dir_contents:
-		fpath=os.path.join(directory,fname)
+	done_cnt=0
+	skipped_cnt=0
+	for fdir in dir_ops:
+		print(('Restoring ' if undo else 'Applying ')+str(len(dir_ops[fdir]))+' operations in "'+fdir.encode('utf-8','ignore').decode('utf-8')+'" ...')
 		
-		#if this file is a symbolic or hard link then skip it
-		#as those aren't really duplicates so much as pointers
-		#NOTE: since symlinks can be directories as well as simple files
-		#this check needs to be done first, before the isdir and isfile checks
-		#in order to account for all cases
-		if(os.path.islink(fpath)):
+		#NOTE: every operation in a directory is done relative to one open directory
+		#so that paths aren't resolved again for every file, and a directory which is renamed mid-run isn't followed to the wrong place
+		try:
+			dir_fd=os.open(fdir,os.O_RDONLY|os.O_DIRECTORY)
+		except OSError as e:
+			print('Err: Could not open directory "'+fdir.encode('utf-8','ignore').decode('utf-8')+'": '+str(e)+'; skipping it')
+			for op_id,op in dir_ops[fdir]:
+				journal_fp.write(json.dumps({'skipped':op_id})+"\n")
+			skipped_cnt+=len(dir_ops[fdir])
 			continue
-		#if it is itself a directory, then recurse to the subdirectory
-		elif(os.path.isdir(fpath)):
-			subdir_hash_acc=dup_find(directory=fpath,hash_algo=hash_algo,ignore_git=ignore_git)
-			#once we've got the hash_acc for the subdirectory,
-			#merge it with the parent directory hash_acc
-			for hash_key in subdir_hash_acc:
-				if(hash_key in hash_acc):
-					hash_acc[hash_key].extend(subdir_hash_acc[hash_key])
+		
+		try:
+			for op_id,op in dir_ops[fdir]:
+				try:
+					if(undo):
+						op_ok=journal_undo_op(op,dir_fd)
+					else:
+						op_ok=journal_do_op(op,dir_fd)
+				except OSError as e:
+					print('Err: Could not '+('restore' if undo else op['op'])+' "'+os.path.join(fdir,op['name']).encode('utf-8','ignore').decode('utf-8')+'": '+str(e)+'; skipping it')
+					op_ok=False
+				
+				if(op_ok):
+					journal_fp.write(json.dumps({('undone' if undo else 'done'):op_id})+"\n")
+					done_cnt+=1
 				else:
-					hash_acc[hash_key]=subdir_hash_acc[hash_key]
-		#if this is a normal file, then get the checksum for it
-		elif(os.path.isfile(fpath)):
-			fhash=checksum_file(fpath=fpath,hash_algo=hash_algo)
-			#if no files with this checksum have yet been found
-			if(not (fhash in hash_acc)):
-				#initialize a list now
-				hash_acc[fhash]=[]
+					journal_fp.write(json.dumps({'skipped':op_id})+"\n")
+					skipped_cnt+=1
 			
-			#TODO: sanity check, verify that logical filesize is identical for all copies
-			
-			#append the current file path to the list of files with the found checksum
-			#regardless of whether that list previously existed or was just initialized
-			hash_acc[fhash].append(fpath)
+			#the directory's changes are made durable before they're recorded as durable in the journal
+			os.fsync(dir_fd)
+		finally:
+			os.close(dir_fd)
+		journal_sync(journal_fp)
 	
-	return hash_acc
+	return (done_cnt,skipped_cnt)
+
+#this journals and then applies a list of planned operations
+#args:
+#	ops: a list of operations returned by journal_plan_op
+#	journal_path: the path of the journal to append to; it's created if it doesn't exist
+#return:
+#	returns a tuple of (done_cnt,skipped_cnt)
+#side-effects:
+#	appends to the journal and applies the operations
+def journal_apply(ops:list,journal_path:str=JOURNAL_DEFAULT_PATH) -> tuple:
+	if(len(ops)==0):
+		return (0,0)
+	
+	journal_dir=os.path.dirname(journal_path)
+	if(journal_dir!='' and (not os.path.isdir(journal_dir))):
+		os.makedirs(journal_dir)
+	
+	#op_ids are unique within a journal, since one journal can have operations from several duplicate sets appended to it
+	next_id=0
+	if(os.path.exists(journal_path)):
+		prior_ops,prior_states=journal_load(journal_path)
+		if(len(prior_ops)>0):
+			next_id=max(prior_ops.keys())+1
+	
+	with journal_open(journal_path) as journal_fp:
+		id_ops=[]
+		for op in ops:
+			journal_fp.write(json.dumps({'plan':next_id,**op})+"\n")
+			id_ops.append((next_id,op))
+			next_id+=1
+		journal_sync(journal_fp)
+		
+		return journal_run(id_ops,journal_fp)
+
+#this finishes or undoes the operations in an existing journal
+#args:
+#	journal_path: the path of the journal
+#	undo: False to apply every operation which hasn't been applied yet (e.g. after a crash)
+#		or True to undo every operation which was applied, most recent first
+#return:
+#	returns a tuple of (done_cnt,skipped_cnt)
+#side-effects:
+#	applies or undoes operations and appends their results to the journal
+def journal_resume(journal_path:str,undo:bool=False) -> tuple:
+	ops,op_states=journal_load(journal_path)
+	if(undo):
+		#NOTE: operations with no state are included since they may have been applied just before a crash
+		#undoing an operation which wasn't applied does nothing
+		op_ids=[op_id for op_id in sorted(ops.keys(),reverse=True) if not (op_states.get(op_id) in ['undone','skipped'])]
+	else:
+		op_ids=[op_id for op_id in sorted(ops.keys()) if not (op_id in op_states)]
+	
+	print(('Undoing ' if undo else 'Resuming ')+str(len(op_ids))+' operations from journal "'+journal_path+'" ...')
+	with journal_open(journal_path) as journal_fp:
+		return journal_run([(op_id,ops[op_id]) for op_id in op_ids],journal_fp,undo=undo)
 
 #this function takes a list of identical files
 #and for all copies except the canonical one (give by dup_files[canonical_idx])
@@ -135,16 +1911,22 @@ def dup_find(directory:str,hash_algo:str,ignore_git:bool=False) -> dict:
 #	dup_files: the list of files with identical checksum (i.e. duplicate files)
 #	canonical_idx: the index in the dup_files list of the canonical copy
 #	auth_symlinks: whether or not to show a confirmation prompt before creating each symlink; true to show the prompt, false to not show a prompt
+#	verify: whether or not to compare each copy byte-for-byte with the canonical copy first; copies which differ are left alone
+#	journal_path: the journal to record the operations in before they're applied (see journal_apply)
 #return:
 #	none
 #side-effects:
 #	deletes all copies other than the canonical copy
 #	in place of deleted copies places symbolic links which point to the canonical copy
-def dup_symlink(dup_files:list,canonical_idx:int,auth_symlinks:bool):
+#	appends to the journal
+def dup_symlink(dup_files:list,canonical_idx:int,auth_symlinks:bool,verify:bool=False,journal_path:str=JOURNAL_DEFAULT_PATH):
 	#sanity check, ensure canonical_idx is in the correct range
 	if((canonical_idx<0) or (canonical_idx>=len(dup_files))):
 		raise Exception('Err: Canonical Index out of range; dup_files='+str(dup_files)+'; canonical_idx='+str(canonical_idx))
 	
+	#the operations are planned (and authorized) first and then journaled and applied together
+	ops=[]
+	
 	#for each copy
 	for path_idx in range(0,len(dup_files)):
 		#if this is the canonical copy, don't do anything
@@ -156,24 +1938,15 @@ def dup_symlink(dup_files:list,canonical_idx:int,auth_symlinks:bool):
 		
 		#for all other copies
 		
-		#fix paths because the paths that are found in the dup list are relative to the given directory
-		#and are not absolute nor do they account for subdirectory weirdness
-		can_path_parts=os.path.split(dup_files[canonical_idx])[0].split(os.path.sep)
-		dup_path_parts=os.path.split(fpath)[0].split(os.path.sep)
-		
-		#find the path to the canonical directory relative to the dup path directory
-		#start with the path to the canonical copy of the file
-		dest_path=dup_files[canonical_idx]
+		if(verify and (not verify_identical(fpath,dup_files[canonical_idx]))):
+			print('Err: "'+fpath+'" differs from the canonical copy despite having the same checksum; skipping it')
+			continue
 		
-		#for each directory from the root (shared) directory to the duplicate file path
-		for dir_idx in range(0,len(dup_path_parts)):
-			#skip references to the current directory as they are meaningless in the context of a symlink
-			if(dup_path_parts[dir_idx]=='.'):
-				continue
-			
-			#ensure that we're going up until we hit a shared directory
-			#before drilling back down to the destination
-			dest_path=os.path.join('..',dest_path)
+		#fix paths because the paths that are found in the dup list are relative to the current directory
+		#(or absolute, depending on how the directories to scan were given)
+		#whereas a symlink's destination is relative to the directory the symlink is in
+		#NOTE: this also handles copies under different given directories, which may involve ".." components
+		dest_path=os.path.relpath(dup_files[canonical_idx],os.path.dirname(fpath) or '.')
 		
 		#get a version of the file path that python can print for user interaction purposes
 		decoded_fpath=fpath.encode('utf-8','ignore').decode('utf-8')
@@ -191,21 +1964,14 @@ def dup_symlink(dup_files:list,canonical_idx:int,auth_symlinks:bool):
 				if(auth_input=='y'):
 					authorized=True
 		
-		print('Replacing "'+decoded_fpath+'" with symlink ...')
-		
-		#delete this copy
-		os.unlink(fpath)
-		
 		#in place of the old copy, put a symlink which has the same name
-		#and points to the canonical copy
-		
-		#NOTE: documentation for os.symlink is weird as the destination of the symlink is "src"
-		#and the location of the symbolic link itself is referred to as "dest"
-		#but this is the correct call, I've tested it
-		os.symlink(dest_path,fpath)
+		#and points to the canonical copy (see journal_do_op)
+		ops.append(journal_plan_op('symlink',fpath,dup_files[canonical_idx],target=dest_path))
 		
 		#NOTE: on future runs of this script symbolic links are ignored
 		#so this won't be detected as a duplicate in the future
+	
+	journal_apply(ops,journal_path)
 
 #this function takes a list of identical files
 #and for all copies except the canonical one (give by dup_files[canonical_idx])
@@ -214,15 +1980,21 @@ def dup_symlink(dup_files:list,canonical_idx:int,auth_symlinks:bool):
 #	dup_files: the list of files with identical checksum (i.e. duplicate files)
 #	canonical_idx: the index in the dup_files list of the canonical copy
 #	auth_rm: whether or not to show a confirmation prompt before each deletion; true to show the prompt, false to not show a prompt
+#	verify: whether or not to compare each copy byte-for-byte with the canonical copy first; copies which differ are left alone
+#	journal_path: the journal to record the operations in before they're applied (see journal_apply)
 #return:
 #	none
 #side-effects:
 #	deletes all copies other than the canonical copy
-def dup_rm(dup_files:list,canonical_idx:int,auth_rm:bool):
+#	appends to the journal
+def dup_rm(dup_files:list,canonical_idx:int,auth_rm:bool,verify:bool=False,journal_path:str=JOURNAL_DEFAULT_PATH):
 	#sanity check, ensure canonical_idx is in the correct range
 	if((canonical_idx<0) or (canonical_idx>=len(dup_files))):
 		raise Exception('Err: Canonical Index out of range; dup_files='+str(dup_files)+'; canonical_idx='+str(canonical_idx))
 	
+	#the operations are planned (and authorized) first and then journaled and applied together
+	ops=[]
+	
 	#for each copy
 	for path_idx in range(0,len(dup_files)):
 		#if this is the canonical copy, don't do anything
@@ -234,6 +2006,10 @@ def dup_rm(dup_files:list,canonical_idx:int,auth_rm:bool):
 		
 		#for all other copies
 		
+		if(verify and (not verify_identical(fpath,dup_files[canonical_idx]))):
+			print('Err: "'+fpath+'" differs from the canonical copy despite having the same checksum; skipping it')
+			continue
+		
 		#if per-link authorization was requested...
 		if(auth_rm):
 			#ensure this is something we should delete before doing the actual operation
@@ -245,15 +2021,153 @@ def dup_rm(dup_files:list,canonical_idx:int,auth_rm:bool):
 				if(auth_input=='y'):
 					authorized=True
 		
-		print('Deleting "'+fpath+'" ...')
 		#delete this copy
-		os.unlink(fpath)
+		#NOTE: the canonical copy is recorded in the journal so that this can be undone
+		ops.append(journal_plan_op('remove',fpath,dup_files[canonical_idx]))
+	
+	journal_apply(ops,journal_path)
+
+#the ioctl request number for FICLONE from linux/fs.h
+#which makes a file share all of its data extents with another file (copy-on-write) on filesystems that support it (btrfs, xfs)
+FICLONE=0x40049409
+
+#this replaces a file atomically by building its replacement under a temporary name in the same directory
+#and then renaming the replacement over the original
+#args:
+#	fpath: the path of the file to replace
+#	make_tmp: a function which is given the temporary path and creates the replacement file there
+#return:
+#	none
+#side-effects:
+#	replaces fpath with whatever make_tmp created
+#	if anything fails the temporary file is removed and fpath is left as it was
+def replace_atomic(fpath:str,make_tmp):
+	fdir,fname=os.path.split(fpath)
+	tmp_path=os.path.join(fdir,'.'+fname+'.dup-fixer-tmp')
+	try:
+		make_tmp(tmp_path)
+		os.replace(tmp_path,fpath)
+	except BaseException as e:
+		if(os.path.lexists(tmp_path)):
+			os.unlink(tmp_path)
+		raise
+
+#this makes a reflink (copy-on-write clone) of one file at a new path
+#args:
+#	src_path: the path of the file to clone
+#	dest_path: the path to create the clone at; this must not already exist
+#	meta_path: the path of the file whose ownership, permissions and timestamps the clone should have
+#return:
+#	none
+#side-effects:
+#	creates dest_path sharing its data with src_path
+#	raises PermissionError if the ownership can't be copied (e.g. when not running as root), rather than leaving the clone owned by someone else
+def reflink_file(src_path:str,dest_path:str,meta_path:str):
+	with open(src_path,'rb') as src_fp:
+		dest_fd=os.open(dest_path,os.O_WRONLY|os.O_CREAT|os.O_EXCL,0o600)
+		try:
+			fcntl.ioctl(dest_fd,FICLONE,src_fp.fileno())
+		finally:
+			os.close(dest_fd)
+	
+	#NOTE: ownership is set before the mode since changing the owner can clear setuid and setgid bits
+	meta_stat=os.stat(meta_path)
+	os.chown(dest_path,meta_stat.st_uid,meta_stat.st_gid)
+	shutil.copystat(meta_path,dest_path)
+
+#this function takes a list of identical files
+#and for all copies except the canonical one (give by dup_files[canonical_idx])
+#replaces the copy with a hard link or a reflink to the canonical copy
+#unlike symlinks, the replaced copies are still regular files so applications and backups see no difference
+#args:
+#	dup_files: the list of files with identical checksum (i.e. duplicate files)
+#	canonical_idx: the index in the dup_files list of the canonical copy
+#	link_type: "hardlink" to make every copy the same inode as the canonical copy (the copies must be on the same filesystem)
+#		or "reflink" to make every copy a separate file which shares its data with the canonical copy (btrfs, xfs)
+#	auth_links: whether or not to show a confirmation prompt before replacing each copy; true to show the prompt, false to not show a prompt
+#	verify: whether or not to compare each copy byte-for-byte with the canonical copy first; copies which differ are left alone
+#return:
+#	none
+#side-effects:
+#	replaces all copies other than the canonical copy with links to the canonical copy
+#	copies which can't be linked (e.g. on a different filesystem) are left alone
+#	for hardlink, copies with a different owner, group or mode than the canonical copy are also left alone
+#	since they would all become the canonical copy's inode (and its owner and mode)
+def dup_link(dup_files:list,canonical_idx:int,link_type:str,auth_links:bool,verify:bool=False):
+	#sanity check, ensure canonical_idx is in the correct range
+	if((canonical_idx<0) or (canonical_idx>=len(dup_files))):
+		raise Exception('Err: Canonical Index out of range; dup_files='+str(dup_files)+'; canonical_idx='+str(canonical_idx))
+	
+	if(not (link_type in ['hardlink','reflink'])):
+		raise Exception('Err: Unsupported link type '+str(link_type))
+	
+	canonical_path=dup_files[canonical_idx]
+	canonical_stat=os.stat(canonical_path)
+	
+	#for each copy
+	for path_idx in range(0,len(dup_files)):
+		#if this is the canonical copy, don't do anything
+		#that copy must remain in place
+		if(path_idx==canonical_idx):
+			continue
+		
+		fpath=dup_files[path_idx]
+		
+		#for all other copies
+		
+		#get a version of the file path that python can print for user interaction purposes
+		decoded_fpath=fpath.encode('utf-8','ignore').decode('utf-8')
+		
+		#NOTE: neither hard links nor reflinks can span filesystems
+		fstat=os.stat(fpath)
+		if(fstat.st_dev!=canonical_stat.st_dev):
+			print('Err: "'+decoded_fpath+'" is not on the same filesystem as the canonical copy; skipping it')
+			continue
+		
+		#NOTE: a hard link shares the inode and therefore also the owner and mode
+		#so merging copies which belong to different users would take files away from their owners
+		if((link_type=='hardlink') and ((fstat.st_uid!=canonical_stat.st_uid) or (fstat.st_gid!=canonical_stat.st_gid) or (fstat.st_mode!=canonical_stat.st_mode))):
+			print('Err: "'+decoded_fpath+'" has a different owner, group or mode than the canonical copy; skipping it')
+			continue
+		
+		if(verify and (not verify_identical(fpath,canonical_path))):
+			print('Err: "'+decoded_fpath+'" differs from the canonical copy despite having the same checksum; skipping it')
+			continue
+		
+		#if per-link authorization was requested...
+		if(auth_links):
+			#ensure this is something we should replace before doing the actual operation
+			authorized=False
+			while(not authorized):
+				print('Please enter y to authorize the replacement (by '+link_type+') of '+decoded_fpath)
+				print('Use ctrl+c if you don\'t want to allow this '+link_type+' and would instead like to terminate the script')
+				auth_input=input()
+				if(auth_input=='y'):
+					authorized=True
+		
+		print('Replacing "'+decoded_fpath+'" with '+link_type+' ...')
+		
+		try:
+			if(link_type=='hardlink'):
+				replace_atomic(fpath,lambda tmp_path: os.link(canonical_path,tmp_path))
+			else:
+				replace_atomic(fpath,lambda tmp_path: reflink_file(canonical_path,tmp_path,fpath))
+		except OSError as e:
+			#this typically means the filesystem doesn't support the link type
+			print('Err: Could not replace "'+decoded_fpath+'" with '+link_type+': '+str(e)+'; skipping it')
+			continue
+		
+		#NOTE: on future runs of this script files which are hard links to a file that was already found are ignored
+		#but reflinked copies are separate files and will still be detected as duplicates
 
 #this function iterates through the given list of hashes and prompts the user to resolve any duplicates
 #args:
 #	hash_list: the list of hashes returned by dup_find
 #	auth_symlinks: whether or not to show a confirmation prompt before creating each symlink; true to show the prompt, false to not show a prompt
 #	auth_rm: whether or not to show a confirmation prompt before doing a delete/rm operation; true to show the prompt, false to not show a prompt
+#	verify: whether or not to compare copies byte-for-byte with the canonical copy before replacing or deleting them
+#	auth_links: whether or not to show a confirmation prompt before replacing each copy with a hard link or reflink; true to show the prompt, false to not show a prompt
+#	journal_path: the journal to record symlink and remove operations in before they're applied
 #return:
 #	None
 #side-effects:
@@ -261,15 +2175,16 @@ def dup_rm(dup_files:list,canonical_idx:int,auth_rm:bool):
 #		prompts the user for the resolution action
 #		resolves the duplication as the user specified
 #			typically this means leaving one copy and making the other copies be symlinks to it
-def dup_fix(hash_list:list,auth_symlinks:bool=False,auth_rm:bool=False):
+def dup_fix(hash_list:list,auth_symlinks:bool=False,auth_rm:bool=False,verify:bool=False,auth_links:bool=False,journal_path:str=JOURNAL_DEFAULT_PATH):
 	#get a total count of the number of duplicate files to give us some idea of how long this will take
+	#NOTE: files without any duplicates aren't included in hash_list
 	unique_files=0
 	total_files=0
 	for fhash in hash_list:
 		unique_files+=1
 		total_files+=len(hash_list[fhash])
 	
-	print('There were '+str(unique_files)+' unique files found and '+str(total_files)+' total files')
+	print('There were '+str(unique_files)+' unique files with duplicates found and '+str(total_files)+' total copies of them')
 	print('Meaning that '+str(total_files-unique_files)+' duplicates exist')
 	
 	#for each checksum/hash
@@ -293,17 +2208,19 @@ def dup_fix(hash_list:list,auth_symlinks:bool=False,auth_rm:bool=False):
 			print("\t"+'l: (l)ink:    Keep canonical copy and symlink the other copies to it (recommended)')
 			print("\t"+'s: (s)kip:    Keep all copies (no changes)')
 			print("\t"+'r: (r)emove:  Keep canonical copy and delete (rm) all other copies')
+			print("\t"+'h: (h)ardlink: Keep canonical copy and replace the other copies with hard links to it (same filesystem only)')
+			print("\t"+'c: (c)lone:   Keep canonical copy and replace the other copies with copy-on-write reflinks of it (btrfs, xfs)')
 #			print("\t"+'m: (m)anual:  Choose action for each file copy (apart from the canonical copy which must always be kept)')
 			
 			action=input()
-			if(action in ['l','s','r','link','skip','remove']):
+			if(action in ['l','s','r','h','c','link','skip','remove','hardlink','clone']):
 				selected_action=action
 			else:
 				print('Err: Unrecognized action '+action+'; please choose from the above action list')
 				continue
 		
 		#for actions which require it, prompt the user for the canonical path to this file
-		if(selected_action in ['l','r','link','remove']):
+		if(selected_action in ['l','r','h','c','link','remove','hardlink','clone']):
 			canonical_idx=-1
 			canonical_path=None
 			while(canonical_path is None):
@@ -334,13 +2251,19 @@ def dup_fix(hash_list:list,auth_symlinks:bool=False,auth_rm:bool=False):
 				#for all copies other than the canonical copy
 				#delete the file and create a symlink to the canonical copy
 				#with the same name as what the old copy had
-				dup_symlink(dup_files=dup_files,canonical_idx=canonical_idx,auth_symlinks=auth_symlinks)
+				dup_symlink(dup_files=dup_files,canonical_idx=canonical_idx,auth_symlinks=auth_symlinks,verify=verify,journal_path=journal_path)
 			elif(selected_action in ['r','remove']):
 				print('Removing (deleting) all non-canonical copies; only the canonical copy will remain')
 				
 				#for all copies other than the canonical copy
 				#delete those copies
-				dup_rm(dup_files=dup_files,canonical_idx=canonical_idx,auth_rm=auth_rm)
+				dup_rm(dup_files=dup_files,canonical_idx=canonical_idx,auth_rm=auth_rm,verify=verify,journal_path=journal_path)
+			elif(selected_action in ['h','hardlink']):
+				print('Replacing all non-canonical copies with hard links...')
+				dup_link(dup_files=dup_files,canonical_idx=canonical_idx,link_type='hardlink',auth_links=auth_links,verify=verify)
+			elif(selected_action in ['c','clone']):
+				print('Replacing all non-canonical copies with reflinks...')
+				dup_link(dup_files=dup_files,canonical_idx=canonical_idx,link_type='reflink',auth_links=auth_links,verify=verify)
 		
 		elif(selected_action in ['s','skip']):
 			print('Skipping this file set (keeping all copies)...')
@@ -350,21 +2273,154 @@ def dup_fix(hash_list:list,auth_symlinks:bool=False,auth_rm:bool=False):
 		
 		
 
+#the resolution actions which can be applied to every duplicate set without prompting
+BATCH_ACTIONS=['link','remove','hardlink','clone','skip']
+
+#the rules which can be used to choose the canonical copy without prompting
+#	oldest: the copy with the oldest modification time
+#	newest: the copy with the newest modification time
+#	shortest: the copy with the shortest path
+CANONICAL_RULES=['oldest','newest','shortest']
+
+#this chooses the canonical copy out of a list of identical files according to a policy
+#rules are applied in this order, with each later rule only used to break ties in the earlier ones:
+#	copies under an earlier prefer_prefixes entry are preferred over copies under a later entry or under none
+#	copies whose absolute path matches prefer_regex are preferred over copies which don't
+#	the canonical_rule (see CANONICAL_RULES)
+#	the path itself, so that the choice is always deterministic
+#args:
+#	dup_files: the list of files with identical checksum (i.e. duplicate files)
+#	canonical_rule: one of CANONICAL_RULES
+#	prefer_prefixes: a list of absolute directory paths in priority order
+#	prefer_regex: a compiled regular expression which preferred absolute paths match, or None
+#return:
+#	returns the index in dup_files of the chosen canonical copy
+#side-effects:
+#	none
+def choose_canonical(dup_files:list,canonical_rule:str='oldest',prefer_prefixes:list=[],prefer_regex:re.Pattern=None) -> int:
+	def policy_key(path_idx:int) -> tuple:
+		fpath=dup_files[path_idx]
+		abs_fpath=os.path.abspath(fpath)
+		
+		prefix_rank=len(prefer_prefixes)
+		for prefix_idx in range(0,len(prefer_prefixes)):
+			if(abs_fpath.startswith(prefer_prefixes[prefix_idx].rstrip(os.path.sep)+os.path.sep)):
+				prefix_rank=prefix_idx
+				break
+		
+		regex_miss=0
+		if((not (prefer_regex is None)) and (prefer_regex.search(abs_fpath) is None)):
+			regex_miss=1
+		
+		if(canonical_rule=='oldest'):
+			rule_key=os.stat(fpath).st_mtime_ns
+		elif(canonical_rule=='newest'):
+			rule_key=0-os.stat(fpath).st_mtime_ns
+		elif(canonical_rule=='shortest'):
+			rule_key=len(fpath)
+		else:
+			raise Exception('Err: Unsupported canonical rule '+str(canonical_rule))
+		
+		return (prefix_rank,regex_miss,rule_key,fpath)
+	
+	return min(range(0,len(dup_files)),key=policy_key)
+
+#this function resolves every duplicate set in the given list of hashes with the same action and without prompting
+#the operations for all sets are planned first and then carried out one directory at a time
+#args:
+#	hash_list: the list of hashes returned by dup_find
+#	action: the action to apply to every duplicate set; one of BATCH_ACTIONS
+#	canonical_rule: the rule used to choose the canonical copy; one of CANONICAL_RULES
+#	prefer_prefixes: a list of absolute directory paths in priority order under which canonical copies are preferred
+#	prefer_regex: a compiled regular expression which preferred canonical paths match, or None
+#	verify: whether or not to compare copies byte-for-byte with the canonical copy before replacing or deleting them
+#	dry_run: if true, only print what would be done
+#	journal_path: the journal to record symlink and remove operations in before they're applied
+#return:
+#	None
+#side-effects:
+#	resolves every duplicate set with the given action (unless dry_run is set)
+#	for the link and remove actions, appends to the journal
+def dup_fix_batch(hash_list:dict,action:str,canonical_rule:str='oldest',prefer_prefixes:list=[],prefer_regex:re.Pattern=None,verify:bool=False,dry_run:bool=False,journal_path:str=JOURNAL_DEFAULT_PATH):
+	if(not (action in BATCH_ACTIONS)):
+		raise Exception('Err: Unsupported batch action '+str(action))
+	
+	#the planned operations, grouped by the directory of the copy being replaced or deleted
+	#	{
+	#		"/path/to/dir":[
+	#			("/path/to/dir/copy","/path/to/canonical")
+	#		]
+	#	}
+	dir_plan:dict={}
+	
+	dup_sets=0
+	for fhash in hash_list:
+		dup_files=hash_list[fhash]
+		if(len(dup_files)<2):
+			continue
+		dup_sets+=1
+		
+		canonical_idx=choose_canonical(dup_files,canonical_rule=canonical_rule,prefer_prefixes=prefer_prefixes,prefer_regex=prefer_regex)
+		for path_idx in range(0,len(dup_files)):
+			if(path_idx==canonical_idx):
+				continue
+			fdir=os.path.dirname(dup_files[path_idx])
+			if(not (fdir in dir_plan)):
+				dir_plan[fdir]=[]
+			dir_plan[fdir].append((dup_files[path_idx],dup_files[canonical_idx]))
+	
+	print('Applying action '+action+' to '+str(dup_sets)+' duplicate sets in '+str(len(dir_plan))+' directories...')
+	if(action=='skip'):
+		return
+	
+	#symlinks and removals for every set are journaled together and then applied one directory at a time
+	journal_ops=[]
+	
+	for fdir in sorted(dir_plan.keys()):
+		for fpath,canonical_path in dir_plan[fdir]:
+			if(dry_run):
+				print('Would '+action+' "'+fpath.encode('utf-8','ignore').decode('utf-8')+'" (canonical copy "'+canonical_path.encode('utf-8','ignore').decode('utf-8')+'")')
+				continue
+			
+			if(action in ['link','remove']):
+				if(verify and (not verify_identical(fpath,canonical_path))):
+					print('Err: "'+fpath.encode('utf-8','ignore').decode('utf-8')+'" differs from the canonical copy despite having the same checksum; skipping it')
+					continue
+				if(action=='link'):
+					journal_ops.append(journal_plan_op('symlink',fpath,canonical_path,target=os.path.relpath(canonical_path,fdir or '.')))
+				else:
+					journal_ops.append(journal_plan_op('remove',fpath,canonical_path))
+				continue
+			
+			#each copy is handled as a set of its own alongside its canonical copy
+			#so that operations can be ordered by directory rather than by duplicate set
+			dup_files=[canonical_path,fpath]
+			if(action=='hardlink'):
+				dup_link(dup_files=dup_files,canonical_idx=0,link_type='hardlink',auth_links=False,verify=verify)
+			elif(action=='clone'):
+				dup_link(dup_files=dup_files,canonical_idx=0,link_type='reflink',auth_links=False,verify=verify)
+	
+	if(len(journal_ops)>0):
+		print('Journaling '+str(len(journal_ops))+' operations to "'+journal_path+'" ...')
+		done_cnt,skipped_cnt=journal_apply(journal_ops,journal_path)
+		print('Applied '+str(done_cnt)+' operations; skipped '+str(skipped_cnt))
+
 if(__name__=='__main__'):
 	parser=argparse.ArgumentParser(description='This is a duplicate fixer script.  It finds and fixed duplicates under the given directory.  ')
 	parser.add_argument(
 		'directory',
 		type=str,
-		help='The directory to check for duplicates (subdirectories of this are checked as well); if you aren\'t sure what to provide, try "." (current directory)',
+		nargs='*',
+		help='The directory to check for duplicates (subdirectories of this are checked as well); if you aren\'t sure what to provide, try "." (current directory); several directories (e.g. on different disks) may be given to find duplicates between them',
 		default=None
 	)
 	parser.add_argument(
 		'--hash-algo',
 		dest='hash_algo',
 		type=str,
-		help='The checksum algorithm to use for the purpose of detecting duplication',
+		help='The checksum algorithm to use for the purpose of detecting duplication; blake2b-128 (or xxh3-128 or blake3 if installed) is much faster than the default on fast storage',
 		default='sha1',
-		choices=['sha1','md5','sha256']
+		choices=list(HASH_ALGOS.keys())
 	)
 	#add --auth-symlink option so the per-file prompts can be enabled
 	parser.add_argument(
@@ -384,6 +2440,15 @@ if(__name__=='__main__'):
 		default=False,
 		help='Pass the --auth-rm switch in order to require all deletions to be confirmed before they are done; by default removal is done without a confirmation prompt once the option is selected'
 	)
+	#add --auth-links option so the per-file prompts can be enabled
+	parser.add_argument(
+		'--auth-links',
+		dest='auth_links',
+		action='store_const',
+		const=True,
+		default=False,
+		help='Pass the --auth-links switch in order to require all hard link and reflink replacements to be confirmed before they are done; by default replacement is done without a confirmation prompt once the option is selected'
+	)
 	#add --ignore-git option so that git directories can be skipped
 	#because they have a bunch of default files that get flagged and also partially-linked git repositories seem like a huge issue
 	parser.add_argument(
@@ -395,13 +2460,308 @@ if(__name__=='__main__'):
 		help='Pass the --ignore-git switch in order to ignore git repositories and .git directory contents when checking for duplicates'
 	)
 	
+	#add --cache option so checksums can be re-used between runs
+	parser.add_argument(
+		'--cache',
+		dest='cache',
+		type=str,
+		nargs='?',
+		const=os.path.join(os.path.expanduser('~'),'.cache','dup-fixer','checksums.sqlite'),
+		default=None,
+		help='Pass the --cache switch in order to keep an on-disk cache of file checksums so that unchanged files are not re-read on later runs; optionally give the path of the cache file (default ~/.cache/dup-fixer/checksums.sqlite)'
+	)
+	parser.add_argument(
+		'--cache-prune-days',
+		dest='cache_prune_days',
+		type=int,
+		default=30,
+		help='The number of days after which cache entries for files which haven\'t been seen are removed; default 30'
+	)
+	
+	#add --action and related options so that duplicates can be resolved without prompting (e.g. from cron)
+	parser.add_argument(
+		'--action',
+		dest='action',
+		type=str,
+		default=None,
+		choices=BATCH_ACTIONS,
+		help='Resolve every duplicate set with this action instead of prompting; the canonical copy is chosen by --canonical, --prefer-prefix and --prefer-regex'
+	)
+	parser.add_argument(
+		'--canonical',
+		dest='canonical_rule',
+		type=str,
+		default='oldest',
+		choices=CANONICAL_RULES,
+		help='With --action, how to choose the canonical copy when --prefer-prefix and --prefer-regex don\'t decide it; default oldest (by modification time)'
+	)
+	parser.add_argument(
+		'--prefer-prefix',
+		dest='prefer_prefixes',
+		type=str,
+		action='append',
+		default=[],
+		help='With --action, prefer canonical copies under this directory; may be given multiple times, in priority order'
+	)
+	parser.add_argument(
+		'--prefer-regex',
+		dest='prefer_regex',
+		type=str,
+		default=None,
+		help='With --action, prefer canonical copies whose absolute path matches this regular expression (searched anywhere in the path, so anchor it with ^ to match from the root)'
+	)
+	parser.add_argument(
+		'--dry-run',
+		dest='dry_run',
+		action='store_const',
+		const=True,
+		default=False,
+		help='With --action, only print what would be done'
+	)
+	#add --journal and related options so that an interrupted run can be finished or undone
+	parser.add_argument(
+		'--journal',
+		dest='journal',
+		type=str,
+		default=None,
+		help='The journal file that symlink and remove operations are recorded in before they are applied; default a new file under '+JOURNAL_DIR+' for every run'
+	)
+	parser.add_argument(
+		'--resume',
+		dest='resume',
+		action='store_const',
+		const=True,
+		default=False,
+		help='Pass the --resume switch (with --journal and no directory) in order to apply the operations in the journal which were not yet applied, e.g. after a crash'
+	)
+	parser.add_argument(
+		'--rollback',
+		dest='rollback',
+		action='store_const',
+		const=True,
+		default=False,
+		help='Pass the --rollback switch (with --journal and no directory) in order to undo the operations in the journal, restoring each copy from its canonical copy with its original mode, owner and times'
+	)
+	#add --report option so results can be streamed to other tools instead of being resolved interactively
+	parser.add_argument(
+		'--report',
+		dest='report',
+		type=str,
+		nargs='?',
+		const='-',
+		default=None,
+		help='Pass the --report switch in order to write a report of duplicate sets as they are found (to the given file, or to stdout by default) instead of resolving them'
+	)
+	parser.add_argument(
+		'--report-format',
+		dest='report_format',
+		type=str,
+		default='jsonl',
+		choices=REPORT_FORMATS,
+		help='The format of the --report output; jsonl has one json object per duplicate set (with paths which are not valid utf-8 also given as base64 of their bytes in a paths_b64 field), csv has one row per file; default jsonl'
+	)
+	#add --watch option so that new duplicates can be reported continuously
+	parser.add_argument(
+		'--watch',
+		dest='watch',
+		action='store_const',
+		const=True,
+		default=False,
+		help='Pass the --watch switch in order to keep running after the initial scan and report new duplicate sets (in the --report format, to stdout unless --report is given) as files are created or changed; linux only'
+	)
+	#add --near-dup and related options so that files which are mostly but not entirely the same can be found
+	parser.add_argument(
+		'--near-dup',
+		dest='near_dup',
+		action='store_const',
+		const=True,
+		default=False,
+		help='Pass the --near-dup switch in order to report pairs of files which share much of their content (in the --report format, to stdout unless --report is given) and how much chunk-level deduplication would save, instead of finding exact duplicates; NOTE: chunking is done in pure python and only manages a few MB/s per job (measured at 2-6 MB/s depending on the CPU, i.e. days per TB with one job), so use --jobs with one job per core for large trees'
+	)
+	parser.add_argument(
+		'--near-ratio',
+		dest='near_ratio',
+		type=float,
+		default=0.5,
+		help='The minimum fraction of the larger file that must be shared for a pair to be reported in --near-dup mode; default 0.5'
+	)
+	parser.add_argument(
+		'--chunk-size',
+		dest='chunk_size',
+		type=int,
+		default=CHUNK_AVG_BYTES,
+		help='The average chunk size in bytes for --near-dup mode; must be a power of two; files smaller than this are skipped; default '+str(CHUNK_AVG_BYTES)
+	)
+	parser.add_argument(
+		'--chunk-max-files',
+		dest='chunk_max_files',
+		type=int,
+		default=CHUNK_MAX_FILES,
+		help='Chunks shared by more than this many files (such as runs of zeroes) are not used to pair files in --near-dup mode; default '+str(CHUNK_MAX_FILES)
+	)
+	#add --jobs option so that multiple files can be read and checksummed at once
+	parser.add_argument(
+		'--jobs',
+		dest='jobs',
+		type=int,
+		default=1,
+		help='The number of files to read and checksum in parallel from each non-rotational device; spinning disks are always read one file at a time, and different devices are read in parallel; with --near-dup, the number of files to chunk at once in separate processes; default 1'
+	)
+	
+	#add --read-mode and --buf-size options so file reading can be tuned to the storage it's on
+	parser.add_argument(
+		'--read-mode',
+		dest='read_mode',
+		type=str,
+		default='auto',
+		choices=READ_MODES,
+		help='How files are read for checksums; auto uses hashlib.file_digest where available, readinto reads into a reused buffer of --buf-size bytes, and mmap memory-maps large files; default auto'
+	)
+	parser.add_argument(
+		'--buf-size',
+		dest='buf_size',
+		type=int,
+		default=HASH_BUF_BYTES,
+		help='The number of bytes read per checksum update in the readinto read mode (and in the mmap read mode for files under '+str(MMAP_MIN_BYTES//(1024*1024))+'MB, which are read the same way; larger files are hashed from the mapping in one update); default '+str(HASH_BUF_BYTES)
+	)
+	
+	#add --no-progress and --stats options so that scans can be monitored and tuned
+	parser.add_argument(
+		'--no-progress',
+		dest='progress',
+		action='store_const',
+		const=False,
+		default=True,
+		help='Pass the --no-progress switch in order to not show scan progress (files/s, MB/s, bytes remaining and ETA) on stderr'
+	)
+	parser.add_argument(
+		'--stats',
+		dest='stats',
+		action='store_const',
+		const=True,
+		default=False,
+		help='Pass the --stats switch in order to show how much time was spent in stat calls, reading and hashing once the scan is done; with the auto read mode this reads files with readinto so that reading and hashing can be timed separately'
+	)
+	
+	#add --verify option so that a hash collision can't cause data loss
+	parser.add_argument(
+		'--verify',
+		dest='verify',
+		action='store_const',
+		const=True,
+		default=False,
+		help='Pass the --verify switch in order to compare each copy byte-for-byte with the canonical copy before it is replaced or deleted; recommended with the faster non-cryptographic hash algorithms'
+	)
+	
 	args=parser.parse_args()
+	
+	if(args.resume or args.rollback):
+		if(args.journal is None):
+			parser.error('--resume and --rollback require --journal')
+		if(len(args.directory)>0):
+			parser.error('--resume and --rollback don\'t take a directory')
+	elif(len(args.directory)==0):
+		parser.error('the following arguments are required: directory')
+	if(args.jobs<1):
+		parser.error('--jobs must be at least 1')
+	if(args.buf_size<1):
+		parser.error('--buf-size must be at least 1')
+	if(args.chunk_size<16 or (args.chunk_size&(args.chunk_size-1))!=0):
+		parser.error('--chunk-size must be a power of two of at least 16')
+	#NOTE: these options would otherwise be silently ignored, which for --dry-run could mean thinking nothing will be changed
+	if(args.dry_run and (args.action is None)):
+		parser.error('--dry-run requires --action')
+	if((not (args.action is None)) and ((not (args.report is None)) or args.watch or args.near_dup)):
+		parser.error('--action can\'t be used with --report, --watch or --near-dup, which only report duplicates')
+	
+	#NOTE: hashlib.file_digest reads and hashes in one call, so it can't be timed by phase
+	read_mode=args.read_mode
+	if(args.stats and read_mode=='auto'):
+		read_mode='readinto'
+	
+	#NOTE: preferred prefixes are made absolute before changing directory so that relative prefixes are relative to where the script was run
+	prefer_prefixes=[os.path.abspath(prefix) for prefix in args.prefer_prefixes]
+	prefer_regex=None
+	if(not (args.prefer_regex is None)):
+		prefer_regex=re.compile(args.prefer_regex)
+	
+	#NOTE: paths which aren't valid utf-8 (e.g. latin-1 swedish glyphs) are decoded to lone surrogates by python,
+	#so the report is written with surrogateescape to get the original bytes back rather than failing partway through
+	#(jsonl writes them as text and base64 instead, see report_path, but csv writes paths as they are)
+	report_fp=None
+	if(args.report=='-' or ((args.watch or args.near_dup) and (args.report is None))):
+		sys.stdout.reconfigure(errors='surrogateescape')
+		report_fp=sys.stdout
+	elif(not (args.report is None)):
+		report_fp=open(os.path.abspath(args.report),'w',newline='',errors='surrogateescape')
+	
+	#NOTE: the journal path is made absolute before changing directory so that a relative path is relative to where the script was run
+	journal_path=JOURNAL_DEFAULT_PATH
+	if(not (args.journal is None)):
+		journal_path=os.path.abspath(args.journal)
+	
+	#NOTE: the cache is opened before changing directory so that a relative cache path is relative to where the script was run
+	cache=None
+	if(not (args.cache is None)):
+		cache=cache_open(os.path.abspath(args.cache))
 
 	#change to the given directory and execute everything relative to '.' after that
 	#this is necessary for the reliable and correct creation of symlinks
-	os.chdir(args.directory)
+	#NOTE: when several directories are given they are scanned as given instead
+	#and symlinks are made relative to each duplicate's own directory
+	scan_dirs='.'
+	if(len(args.directory)==1):
+		os.chdir(args.directory[0])
+	else:
+		scan_dirs=args.directory
 	
-	hash_list=dup_find('.',args.hash_algo,ignore_git=args.ignore_git)
-#	print(hash_list) #debug
-	dup_fix(hash_list,auth_symlinks=args.auth_symlinks,auth_rm=args.auth_rm)
-
+	#NOTE: when the report is piped into something which stops reading early (e.g. head), writing to stdout fails;
+	#as with other command line tools that just ends the script quietly rather than with a traceback
+	#(stdout is pointed at devnull so that python's own flush of it on exit doesn't fail again)
+	try:
+		#a journal can be finished or undone without scanning anything
+		if(args.resume or args.rollback):
+			done_cnt,skipped_cnt=journal_resume(journal_path,undo=args.rollback)
+			print(('Restored ' if args.rollback else 'Applied ')+str(done_cnt)+' operations; skipped '+str(skipped_cnt))
+		#in watch mode duplicate sets are reported as they appear, until the script is interrupted
+		elif(args.watch):
+			try:
+				dup_watch(scan_dirs,args.hash_algo,report_fp,report_format=args.report_format,ignore_git=args.ignore_git,cache=cache,jobs=args.jobs,read_mode=read_mode,buf_bytes=args.buf_size)
+			except KeyboardInterrupt as e:
+				pass
+		#in near-duplicate mode similar file pairs are reported and nothing is resolved
+		elif(args.near_dup):
+			stats_reset(progress=args.progress)
+			index=near_dup_index(scan_dirs,args.hash_algo,ignore_git=args.ignore_git,avg_bytes=args.chunk_size,buf_bytes=args.buf_size,jobs=args.jobs)
+			stats_summary(args.stats)
+			pair_cnt=near_dup_report(near_dup_pairs(index,args.near_ratio,max_chunk_files=args.chunk_max_files),report_fp,report_format=args.report_format)
+			total_bytes,unique_bytes=near_dup_savings(index)
+			index.close()
+			if(report_fp!=sys.stdout):
+				report_fp.close()
+			print('Found '+str(pair_cnt)+' near-duplicate pairs; chunk-level deduplication would reduce '+str(total_bytes)+' bytes to '+str(unique_bytes)+' bytes, saving '+str(total_bytes-unique_bytes)+' bytes',file=sys.stderr)
+		#in report mode duplicate sets are written as they're found and nothing is resolved
+		elif(not (report_fp is None)):
+			stats_reset(progress=args.progress)
+			groups=dup_groups(scan_dirs,args.hash_algo,ignore_git=args.ignore_git,cache=cache,jobs=args.jobs,read_mode=read_mode,buf_bytes=args.buf_size)
+			dup_sets,dup_files,reclaimable_bytes=dup_report(groups,report_fp,report_format=args.report_format)
+			stats_summary(args.stats)
+			if(report_fp!=sys.stdout):
+				report_fp.close()
+			if(not (cache is None)):
+				cache_prune(cache,args.cache_prune_days)
+			print('Found '+str(dup_sets)+' duplicate sets covering '+str(dup_files)+' files; '+str(reclaimable_bytes)+' bytes are reclaimable',file=sys.stderr)
+		else:
+			stats_reset(progress=args.progress)
+			hash_list=dup_find(scan_dirs,args.hash_algo,ignore_git=args.ignore_git,cache=cache,jobs=args.jobs,read_mode=read_mode,buf_bytes=args.buf_size)
+			stats_summary(args.stats)
+			if(not (cache is None)):
+				cache_prune(cache,args.cache_prune_days)
+#			print(hash_list) #debug
+			if(not (args.action is None)):
+				dup_fix_batch(hash_list,args.action,canonical_rule=args.canonical_rule,prefer_prefixes=prefer_prefixes,prefer_regex=prefer_regex,verify=args.verify,dry_run=args.dry_run,journal_path=journal_path)
+			else:
+				dup_fix(hash_list,auth_symlinks=args.auth_symlinks,auth_rm=args.auth_rm,verify=args.verify,auth_links=args.auth_links,journal_path=journal_path)
+	except BrokenPipeError as e:
+		os.dup2(os.open(os.devnull,os.O_WRONLY),sys.stdout.fileno())
+		sys.exit(1)
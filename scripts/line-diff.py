@@ -3,6 +3,24 @@
 #this takes as input two lines
 #these lines checked for differences and the output is the detected difference
 
+import array
+import bisect
+import collections
+import functools
+import hashlib
+import heapq
+import mmap
+import multiprocessing
+import os
+import re
+import struct
+
+#numpy is optional; without it quick_diff uses pure python
+try:
+    import numpy
+except ImportError:
+    numpy=None
+
 #whether or not to use color when making visual differences
 #the runtime block at the end of this file gets color capabilities from TERMCAP environment variable
 #use_color=True
@@ -14,6 +32,10 @@ sub_color='\033[33m'
 
 end_color='\033[0m'
 
+#the minimum table size ((len(start)+1)*(len(end)+1)) for which quick_diff uses numpy (when it's installed)
+#below this the per-row numpy overhead outweighs the loop it replaces, e.g. for most single words
+NUMPY_MIN_CELLS=400
+
 #return a string of the given value
 #forward-padded with pad characters until it is the required length
 def strpad(val,length,pad):
@@ -22,47 +44,81 @@ def strpad(val,length,pad):
         s=pad+s
     return s
 
-#a quick difference calculation; this is based on the levenshtein distance
-#but is a faster implementation and stores more information
-def quick_diff(start_line,end_line,debug=True):
-    #edit distances between each substring pair
-    dist=[]
-    for i in range(0,len(start_line)+1):
-        dist.append([])
-        for i in range(0,len(end_line)+1):
-            dist[-1].append(0)
+#compute the quick_diff table with numpy, a row at a time
+#each row is computed from the previous one with whole-row operations instead of a loop over characters
+#returns the table as a 2d numpy array, which can be indexed the same way as the list-of-lists table
+def numpy_dist(start_line,end_line):
+    #map each distinct character (or line) to an integer so that a whole row can be compared at once
+    codes={}
+    start_codes=numpy.array([codes.setdefault(ch,len(codes)) for ch in start_line],dtype=numpy.int64)
+    end_codes=numpy.array([codes.setdefault(ch,len(codes)) for ch in end_line],dtype=numpy.int64)
     
-    #dist is now a len(start_line) by len(end_line) 2d array
-    
-    #source string -> empty string by delete
-    #on each character in source
-    for i in range(0,len(start_line)+1):
-        dist[i][0]=i
+    cols=numpy.arange(0,len(end_line)+1,dtype=numpy.int32)
+    dist=numpy.empty((len(start_line)+1,len(end_line)+1),dtype=numpy.int32)
     
     #empty string -> dest string by insert
-    #on each character in dest
-    for j in range(0,len(end_line)+1):
-        dist[0][j]=j
-    
-    #for each character in target string
-    for j in range(1,len(end_line)+1):
-        #for each character in source string
-        for i in range(1,len(start_line)+1):
-#            if(debug):
-#                print('j='+str(j)+', i='+str(i)+', dist[i][j]='+str(dist[i][j]))
-            
-            #there was a character match
-            #so there is no edit distance here
-            if(start_line[i-1]==end_line[j-1]):
-                #keep edit distance from last entry
-                dist[i][j]=dist[i-1][j-1]
-            else:
-                dist[i][j]=min(
-                    dist[i-1][j-1]+1,   #sub
-                    dist[i-1][j]+1,     #del
-                    dist[i][j-1]+1      #ins
-                    )
+    dist[0]=cols
+    for i in range(1,len(start_line)+1):
+        prev_row=dist[i-1]
+        row=dist[i]
+        
+        #source string -> empty string by delete
+        row[0]=i
+        
+        #sub (free on a character match) or del
+        row[1:]=numpy.minimum(prev_row[:-1]+(end_codes!=start_codes[i-1]),prev_row[1:]+1)
+        
+        #ins depends on the entry to the left in the same row, so it can't be done element-wise;
+        #but row[j]=min(row[k]+(j-k)) over k<=j, which is a running minimum of row[k]-k
+        row[:]=numpy.minimum.accumulate(row-cols)+cols
     
+    return dist
+
+#a quick difference calculation; this is based on the levenshtein distance
+#but is a faster implementation and stores more information
+def quick_diff(start_line,end_line,debug=True):
+    #the numpy kernel is only worth its setup cost on larger tables
+    if((not (numpy is None)) and ((len(start_line)+1)*(len(end_line)+1))>=NUMPY_MIN_CELLS):
+        dist=numpy_dist(start_line,end_line)
+    else:
+        #edit distances between each substring pair
+        dist=[]
+        for i in range(0,len(start_line)+1):
+            dist.append([])
+            for i in range(0,len(end_line)+1):
+                dist[-1].append(0)
+        
+        #dist is now a len(start_line) by len(end_line) 2d array
+        
+        #source string -> empty string by delete
+        #on each character in source
+        for i in range(0,len(start_line)+1):
+            dist[i][0]=i
+        
+        #empty string -> dest string by insert
+        #on each character in dest
+        for j in range(0,len(end_line)+1):
+            dist[0][j]=j
+        
+        #for each character in target string
+        for j in range(1,len(end_line)+1):
+            #for each character in source string
+            for i in range(1,len(start_line)+1):
+#                if(debug):
+#                    print('j='+str(j)+', i='+str(i)+', dist[i][j]='+str(dist[i][j]))
+                
+                #there was a character match
+                #so there is no edit distance here
+                if(start_line[i-1]==end_line[j-1]):
+                    #keep edit distance from last entry
+                    dist[i][j]=dist[i-1][j-1]
+                else:
+                    dist[i][j]=min(
+                        dist[i-1][j-1]+1,   #sub
+                        dist[i-1][j]+1,     #del
+                        dist[i][j-1]+1      #ins
+                        )
+        
     if(debug):
         print('dist:')
         
@@ -92,10 +148,275 @@ def quick_diff(start_line,end_line,debug=True):
     
     #I have therefore extended the array to consider the last character
     #this seems to work although I haven't formally verified it
-    return (dist[len(start_line)][len(end_line)],dist)
+    return (int(dist[len(start_line)][len(end_line)]),dist)
+
+#get the edit distance between two strings, but only if it's at most max_dist
+#this is the same distance as quick_diff, but only the diagonal band of the table within max_dist of the main diagonal is computed
+#(any path which leaves the band costs more than max_dist) and it stops as soon as a whole row is over max_dist
+#this is O(max_dist*len) instead of O(len*len), for checking many candidates (e.g. for spellcheck) when only close ones matter
+#returns the edit distance, or None if it's more than max_dist
+def bounded_dist(start_line,end_line,max_dist):
+    if(abs(len(start_line)-len(end_line))>max_dist):
+        return None
+    
+    #anything over max_dist is stored as max_dist+1, including cells outside of the band
+    over=max_dist+1
+    prev_row=[min(j,over) for j in range(0,len(end_line)+1)]
+    row=[over]*(len(end_line)+1)
+    for i in range(1,len(start_line)+1):
+        lo=max(1,i-max_dist)
+        hi=min(len(end_line),i+max_dist)
+        
+        #the cell just left of the band is over max_dist (or the cost of deleting everything so far)
+        #NOTE: cells to the right of the band were never written, since the band only moves right
+        row[lo-1]=min(i,over) if lo==1 else over
+        
+        row_min=row[lo-1]
+        for j in range(lo,hi+1):
+            if(start_line[i-1]==end_line[j-1]):
+                cell=prev_row[j-1]
+            else:
+                cell=min(prev_row[j-1],prev_row[j],row[j-1])+1
+                if(cell>over):
+                    cell=over
+            row[j]=cell
+            if(cell<row_min):
+                row_min=cell
+        
+        #every path to the end goes through this row, so if all of it is over max_dist so is the result
+        if(row_min>max_dist):
+            return None
+        prev_row,row=row,prev_row
+    
+    return prev_row[len(end_line)] if prev_row[len(end_line)]<=max_dist else None
+
+#above this many table cells ((len(start)+1)*(len(end)+1)) diff_ops uses the linear-space engine (myers_ops)
+#instead of the full quick_diff table, which would take too much memory and time
+#NOTE: this is about 4 million cells, i.e. two 2000-line files
+DIFF_MAX_CELLS=4*1000*1000
+
+#find the middle snake of the shortest edit script between start_seq[a0:a1] and end_seq[b0:b1]
+#this is the divide step of myers' linear-space O(ND) diff algorithm;
+#a forward and a backward search are run from opposite corners until their paths overlap
+#returns (edit distance,x_start,y_start,x_end,y_end) where the snake (a run of matches) goes from (x_start,y_start) to (x_end,y_end)
+#and coordinates are relative to a0 and b0
+def middle_snake(start_seq,a0,a1,end_seq,b0,b1):
+    n=a1-a0
+    m=b1-b0
+    delta=n-m
+    odd=((delta%2)!=0)
+    max_d=(n+m+1)//2
+    
+    #furthest reaching x on each diagonal k=x-y, for the forward search
+    #and furthest reaching distance from the end on each reversed diagonal, for the backward search
+    #NOTE: these are offset by max_d+1 so that negative diagonals can be list indices
+    offset=max_d+1
+    v_fwd=[0]*(2*offset+1)
+    v_bwd=[0]*(2*offset+1)
+    
+    for d in range(0,max_d+1):
+        #forward search one edit further
+        for k in range(-d,d+1,2):
+            if(k==-d or (k!=d and v_fwd[offset+k-1]<v_fwd[offset+k+1])):
+                #move down (insert)
+                x=v_fwd[offset+k+1]
+            else:
+                #move right (delete)
+                x=v_fwd[offset+k-1]+1
+            y=x-k
+            x_start=x
+            y_start=y
+            #follow the diagonal as long as elements match
+            while(x<n and y<m and start_seq[a0+x]==end_seq[b0+y]):
+                x+=1
+                y+=1
+            v_fwd[offset+k]=x
+            
+            #the backward search has done d-1 edits; check whether this path overlaps its path on the same diagonal
+            c=delta-k
+            if(odd and (-(d-1))<=c and c<=(d-1) and (x+v_bwd[offset+c])>=n):
+                return (2*d-1,x_start,y_start,x,y)
+        
+        #backward search one edit further, on the reversed sequences
+        for c in range(-d,d+1,2):
+            if(c==-d or (c!=d and v_bwd[offset+c-1]<v_bwd[offset+c+1])):
+                u=v_bwd[offset+c+1]
+            else:
+                u=v_bwd[offset+c-1]+1
+            v=u-c
+            u_start=u
+            v_start=v
+            while(u<n and v<m and start_seq[a1-u-1]==end_seq[b1-v-1]):
+                u+=1
+                v+=1
+            v_bwd[offset+c]=u
+            
+            #the forward search has done d edits; check whether this path overlaps its path on the same diagonal
+            k=delta-c
+            if((not odd) and (-d)<=k and k<=d and (u+v_fwd[offset+k])>=n):
+                #convert back to forward coordinates; the snake runs from (n-u,m-v) to (n-u_start,m-v_start)
+                return (2*d,n-u,m-v,n-u_start,m-v_start)
+    
+    #unreachable; the searches always meet by max_d
+    raise Exception('Error: middle snake not found')
+
+#add a run of count operations of one kind to a run-length op_queue (see myers_runs)
+#the run is merged into the last one when it carries straight on from it
+def add_run(op_queue,kind,i,j,count):
+    if(count<=0):
+        return
+    if(len(op_queue)>0):
+        last_kind,last_i,last_j,last_count=op_queue[-1]
+        #a del only moves through start_seq and an ins only through end_seq
+        last_i_end=last_i+(last_count if last_kind!='ins' else 0)
+        last_j_end=last_j+(last_count if last_kind!='del' else 0)
+        if(last_kind==kind and last_i_end==i and last_j_end==j):
+            op_queue[-1]=(kind,last_i,last_j,last_count+count)
+            return
+    op_queue.append((kind,i,j,count))
+
+#get the operations to transform start_seq into end_seq without a full table (myers' linear-space O(ND) diff)
+#this uses O(N+M) memory and is fast when the sequences are similar, so it works on large files
+#the operations are run-length; each is (kind,i,j,count) for count elements of kind 'nop', 'del' or 'ins'
+#starting at start_seq[i] and end_seq[j] (a del doesn't move through end_seq and an ins doesn't move through start_seq)
+#so that long runs of matching elements (e.g. the unchanged lines of a file) take no more memory than a short one
+#NOTE: this finds a shortest script of insertions and deletions; see myers_ops and pair_runs for substitutions
+def myers_runs(start_seq,end_seq):
+    op_queue=[]
+    
+    #pending work; either a region to diff or a run of matching elements to output
+    #NOTE: this is a stack rather than recursion so that deep splits don't hit the recursion limit
+    #the second region is pushed first so that regions are output in order
+    work=[('diff',0,len(start_seq),0,len(end_seq))]
+    while(len(work)>0):
+        task=work.pop()
+        if(task[0]=='nop'):
+            add_run(op_queue,'nop',task[1],task[2],task[3])
+            continue
+        
+        a0,a1,b0,b1=task[1:]
+        
+        #strip common prefix and suffix, which also handles all single-edit regions
+        prefix_end=a0
+        while(prefix_end<a1 and (b0+prefix_end-a0)<b1 and start_seq[prefix_end]==end_seq[b0+prefix_end-a0]):
+            prefix_end+=1
+        add_run(op_queue,'nop',a0,b0,prefix_end-a0)
+        b0+=prefix_end-a0
+        a0=prefix_end
+        
+        suffix_len=0
+        while(suffix_len<(a1-a0) and suffix_len<(b1-b0) and start_seq[a1-suffix_len-1]==end_seq[b1-suffix_len-1]):
+            suffix_len+=1
+        if(suffix_len>0):
+            work.append(('nop',a1-suffix_len,b1-suffix_len,suffix_len))
+        a1-=suffix_len
+        b1-=suffix_len
+        
+        #out of elements on one side
+        if(a0==a1):
+            add_run(op_queue,'ins',a0,b0,b1-b0)
+            continue
+        if(b0==b1):
+            add_run(op_queue,'del',a0,b0,a1-a0)
+            continue
+        
+        d,x_start,y_start,x_end,y_end=middle_snake(start_seq,a0,a1,end_seq,b0,b1)
+        work.append(('diff',a0+x_end,a1,b0+y_end,b1))
+        work.append(('nop',a0+x_start,b0+y_start,x_end-x_start))
+        work.append(('diff',a0,a0+x_start,b0,b0+y_start))
+    
+    return op_queue
+
+#get the operations to transform start_seq into end_seq with myers_runs, in the same form as diff_ops
+#runs of deletions and insertions are paired up into substitutions (see pair_subs)
+#so the operation count can be higher than the true levenshtein distance that quick_diff gives
+def myers_ops(start_seq,end_seq):
+    op_queue=[]
+    for kind,i,j,count in myers_runs(start_seq,end_seq):
+        for k in range(0,count):
+            if(kind=='ins'):
+                op_queue.append([kind,end_seq[j+k]])
+            else:
+                op_queue.append([kind,start_seq[i+k]])
+    
+    return pair_subs(op_queue)
+
+#pair up deletions and insertions which are next to each other into substitutions
+#so that op_queue from myers_ops has the same form as one from diff_ops
+#within each run of changes, the first deletion is paired with the first insertion and so on
+def pair_subs(op_queue):
+    paired_queue=[]
+    
+    dels=[]
+    inss=[]
+    for op in op_queue+[['nop',None]]:
+        if(op[0]=='del'):
+            dels.append(op[1])
+            continue
+        elif(op[0]=='ins'):
+            inss.append(op[1])
+            continue
+        
+        #end of a run of changes
+        for i in range(0,min(len(dels),len(inss))):
+            paired_queue.append(['sub',dels[i],inss[i]])
+        for i in range(len(inss),len(dels)):
+            paired_queue.append(['del',dels[i]])
+        for i in range(len(dels),len(inss)):
+            paired_queue.append(['ins',inss[i]])
+        dels=[]
+        inss=[]
+        
+        if(not (op[1] is None)):
+            paired_queue.append(op)
+    
+    return paired_queue
+
+#pair_subs for a run-length op_queue (see myers_runs)
+#between two runs of nops (or substitutions) the deleted elements are all next to each other, as are the inserted ones;
+#as many of them as possible are paired into a run of substitutions and the rest are left as a del or ins run
+def pair_runs(op_queue):
+    paired_queue=[]
+    
+    #the start of the current run of changes and the number of elements deleted and inserted in it
+    change_i=0
+    change_j=0
+    del_cnt=0
+    ins_cnt=0
+    for op in op_queue+[('nop',None,None,0)]:
+        kind,i,j,count=op
+        if(kind=='del' or kind=='ins'):
+            if(del_cnt==0 and ins_cnt==0):
+                change_i=i
+                change_j=j
+            if(kind=='del'):
+                del_cnt+=count
+            else:
+                ins_cnt+=count
+            continue
+        
+        #end of a run of changes
+        sub_cnt=min(del_cnt,ins_cnt)
+        add_run(paired_queue,'sub',change_i,change_j,sub_cnt)
+        add_run(paired_queue,'del',change_i+sub_cnt,change_j+sub_cnt,del_cnt-sub_cnt)
+        add_run(paired_queue,'ins',change_i+sub_cnt,change_j+sub_cnt,ins_cnt-sub_cnt)
+        del_cnt=0
+        ins_cnt=0
+        
+        add_run(paired_queue,kind,i,j,count)
+    
+    return paired_queue
 
 #get the operations to transform start_line into end_line
-def diff_ops(start_line,end_line,debug=True):
+#inputs larger than max_cells use the linear-space engine (myers_ops) rather than the full table
+def diff_ops(start_line,end_line,debug=True,max_cells=DIFF_MAX_CELLS):
+    if(((len(start_line)+1)*(len(end_line)+1))>max_cells):
+        op_queue=myers_ops(start_line,end_line)
+        op_cnt=len([op for op in op_queue if op[0]!='nop'])
+        if(debug):
+            print(str(op_queue)+'; '+str(op_cnt)+' operations (excluding nops)')
+        return (op_queue,op_cnt)
+    
     diff_cnt,dist=quick_diff(start_line,end_line,debug=False)
     
     #all the operations necessary to transform start_line into end_line
@@ -114,19 +435,19 @@ def diff_ops(start_line,end_line,debug=True):
         #out of start string characters
         if(row<=0):
             #insert
-            op_queue.append(['ins',str(end_line[col-1])])
+            op_queue.append(['ins',end_line[col-1]])
             col-=1
             continue
         #out of end string characters
         elif(col<=0):
             #delete
-            op_queue.append(['del',str(start_line[row-1])])
+            op_queue.append(['del',start_line[row-1]])
             row-=1
             continue
         
         #equal characters require no operation
         if(start_line[row-1]==end_line[col-1]):
-            op_queue.append(['nop',str(start_line[row-1])])
+            op_queue.append(['nop',start_line[row-1]])
             #move diagonally up and back in the table
             row-=1
             col-=1
@@ -139,16 +460,16 @@ def diff_ops(start_line,end_line,debug=True):
             
             #do a deletion
             if(min_cost==del_cost):
-                op_queue.append(['del',str(start_line[row-1])])
+                op_queue.append(['del',start_line[row-1]])
                 row-=1
             #do a substitution
             elif(min_cost==sub_cost):
-                op_queue.append(['sub',str(start_line[row-1]),str(end_line[col-1])])
+                op_queue.append(['sub',start_line[row-1],end_line[col-1]])
                 row-=1
                 col-=1
             #do an insertion
             elif(min_cost==ins_cost):
-                op_queue.append(['ins',str(end_line[col-1])])
+                op_queue.append(['ins',end_line[col-1]])
                 col-=1
 
     
@@ -169,6 +490,19 @@ def diff_ops(start_line,end_line,debug=True):
     
     return (op_queue,op_cnt)
 
+#the number of string pairs whose diff results are kept by cached_diff_ops
+DIFF_CACHE_SIZE=4096
+
+#diff_ops for strings (words or lines), with the most recent results kept in a bounded lru cache
+#this is shared by the places which may diff the same pair more than once,
+#e.g. spellcheck for a word which is checked again, and intra-line diffs of repeated changes in file_diff
+#returns (op_queue,op_cnt) as diff_ops does, except that op_queue is a tuple of tuples
+#NOTE: the results are shared between callers, which is why they're immutable
+@functools.lru_cache(maxsize=DIFF_CACHE_SIZE)
+def cached_diff_ops(start_line,end_line):
+    op_queue,op_cnt=diff_ops(start_line,end_line,debug=False)
+    return (tuple([tuple(op) for op in op_queue]),op_cnt)
+
 #gets a visual difference between strings based on the given operation queue
 #op_queue is calculated from diff_ops
 def visual_diff(op_queue,by_line=False,use_color=False):
@@ -248,7 +582,8 @@ def visual_diff(op_queue,by_line=False,use_color=False):
     
     return (start_trans,diff_str,end_trans)
 
-def visual_line_diff(start_trans,diff_trans,end_trans,digits,idx,show_nops,show_ln_diff,output_cntxt,use_color=False):
+#last_line is the index of the line that was output before this one, or -1 if there wasn't one
+def visual_line_diff(start_trans,diff_trans,end_trans,digits,idx,show_nops,show_ln_diff,last_line,use_color=False):
     #get global color strings
     global del_color
     global ins_color
@@ -279,7 +614,7 @@ def visual_line_diff(start_trans,diff_trans,end_trans,digits,idx,show_nops,show_
         #show intra-line differences if asked
         #note this is ONLY done on substituted lines
         if(show_ln_diff):
-            ln_start_trans,ln_diff_str,ln_end_trans=visual_diff(diff_ops(start_trans,end_trans,debug=False)[0],by_line=False,use_color=use_color)
+            ln_start_trans,ln_diff_str,ln_end_trans=visual_diff(cached_diff_ops(start_trans,end_trans)[0],by_line=False,use_color=use_color)
             #TODO: display tabs with 4 or 8 space widths, and substitute in the ln_diff_str to make alignment work
             #swap tabs for a placeholder so everything lines up right
             ln_start_trans=ln_start_trans.replace("\t",' ')
@@ -306,52 +641,299 @@ def visual_line_diff(start_trans,diff_trans,end_trans,digits,idx,show_nops,show_
         return 'Error: Unknown transformation '+diff_trans
     
     #if lines were skipped, then output an indicator of that
-    last_line=0
-    if(len(output_cntxt)>0):
-        last_line=max(output_cntxt)
+    if(last_line>=0):
         if((last_line+1)<(idx) and (out_str!='')):
             out_str='==================================================================='+"\n"+out_str
     
     return out_str
 
+#get the lines which occur exactly once in lines (a sequence of integers, e.g. hashes from line_index), with numpy
+#returns (lines,indices) as numpy arrays sorted by line
+def numpy_unique_lines(lines):
+    line_arr=numpy.array(lines,dtype=numpy.int64)
+    order=numpy.argsort(line_arr)
+    line_arr=line_arr[order]
+    
+    #after sorting, a line is unique if it's different from the lines on either side
+    is_unique=numpy.ones(len(line_arr),dtype=bool)
+    is_unique[1:]&=(line_arr[1:]!=line_arr[:-1])
+    is_unique[:-1]&=(line_arr[:-1]!=line_arr[1:])
+    return (line_arr[is_unique],order[is_unique].astype(numpy.int64))
 
-def file_diff(start_file,end_file,show_nops=False,show_ln_diff=True,cntxt_lns=3,verbose=True,use_color=False):
-    start_fp=open(start_file,'r')
-    start_fc=start_fp.read()
-    start_fp.close()
+#get the indices of the lines which occur exactly once in start_lines[a0:a1] and exactly once in end_lines[b0:b1]
+#returns (start indices,end indices) as arrays, in increasing order of start index
+#NOTE: for large files this is most of the memory of a diff, so nothing is kept per line which isn't needed;
+#with numpy the lines are counted by sorting rather than in a dict
+def unique_pairs(start_lines,a0,a1,end_lines,b0,b1):
+    if(not (numpy is None)):
+        start_vals,start_pos=numpy_unique_lines(start_lines[a0:a1])
+        end_vals,end_pos=numpy_unique_lines(end_lines[b0:b1])
+        
+        #look up each line which is unique in the start region among those which are unique in the end region
+        match_idxs=numpy.minimum(numpy.searchsorted(end_vals,start_vals),max(len(end_vals)-1,0))
+        matched=(end_vals[match_idxs]==start_vals) if len(end_vals)>0 else numpy.zeros(len(start_vals),dtype=bool)
+        pair_starts=start_pos[matched]+a0
+        pair_ends=end_pos[match_idxs[matched]]+b0
+        order=numpy.argsort(pair_starts)
+        return (array.array('q',pair_starts[order].tobytes()),array.array('q',pair_ends[order].tobytes()))
+    
+    #line -> -2 if it occurs once in the start region and hasn't been seen in the end region,
+    #its index in the end region if it occurs once in each, or -1 if it occurs more than once in either
+    #NOTE: one dict with small (shared) integers is used rather than a dict per region, as it's the bulk of the memory
+    line_pos={}
+    for i in range(a0,a1):
+        line_pos[start_lines[i]]=-1 if start_lines[i] in line_pos else -2
+    for j in range(b0,b1):
+        pos=line_pos.get(end_lines[j],-1)
+        if(pos!=-1):
+            line_pos[end_lines[j]]=j if pos==-2 else -1
+    
+    pair_starts=array.array('q')
+    pair_ends=array.array('q')
+    for i in range(a0,a1):
+        j=line_pos.get(start_lines[i],-1)
+        if(j>=0):
+            pair_starts.append(i)
+            pair_ends.append(j)
+    return (pair_starts,pair_ends)
+
+#find anchor lines between start_lines[a0:a1] and end_lines[b0:b1] (as in patience diff)
+#anchors are lines which occur exactly once in each region, and of those,
+#the longest run which is in the same order in both regions (found by patience sorting)
+#returns (start indices,end indices) of the anchors as arrays, in increasing order
+def unique_anchors(start_lines,a0,a1,end_lines,b0,b1):
+    pair_starts,pair_ends=unique_pairs(start_lines,a0,a1,end_lines,b0,b1)
+    
+    #longest increasing subsequence of end indices, by patience sorting
+    #pile_tops holds the end index on top of each pile, and back_refs links each pair to the top of the previous pile
+    pile_tops=array.array('q')
+    pile_pairs=array.array('q')
+    back_refs=array.array('q')
+    for pair_idx in range(0,len(pair_ends)):
+        pile=bisect.bisect_left(pile_tops,pair_ends[pair_idx])
+        if(pile==len(pile_tops)):
+            pile_tops.append(pair_ends[pair_idx])
+            pile_pairs.append(pair_idx)
+        else:
+            pile_tops[pile]=pair_ends[pair_idx]
+            pile_pairs[pile]=pair_idx
+        back_refs.append(pile_pairs[pile-1] if pile>0 else -1)
+    
+    anchor_starts=array.array('q')
+    anchor_ends=array.array('q')
+    pair_idx=pile_pairs[-1] if len(pile_pairs)>0 else -1
+    while(pair_idx>=0):
+        anchor_starts.append(pair_starts[pair_idx])
+        anchor_ends.append(pair_ends[pair_idx])
+        pair_idx=back_refs[pair_idx]
+    anchor_starts.reverse()
+    anchor_ends.reverse()
+    return (anchor_starts,anchor_ends)
+
+#regions of files with fewer table cells than this ((lines in start+1)*(lines in end+1)) are diffed by anchored_ops with diff_ops directly
+#anchoring is only a speedup; it can give a longer diff than diff_ops when a unique line is matched up at the cost of other lines
+#so it's only used for regions which would take diff_ops too long
+ANCHOR_MIN_CELLS=250*1000
+
+#get the operations to transform start_lines into end_lines, for whole files
+#the common prefix and suffix are stripped and unique lines are matched up as anchors (see unique_anchors)
+#so that diff_ops only runs on the (usually small) regions between anchors, rather than on whole files
+#returns (op_queue,op_cnt) where op_queue is run-length as from myers_runs (with 'sub' runs as from pair_runs)
+#and op_cnt is the number of changed lines
+#NOTE: lines are compared with ==, so for lines from line_index two different lines with the same hash are considered equal
+def anchored_ops(start_lines,end_lines):
+    op_queue=[]
+    
+    #pending work; either a region to diff or a run of matching lines to output
+    #the later region is pushed first so that regions are output in order
+    work=[('diff',0,len(start_lines),0,len(end_lines))]
+    while(len(work)>0):
+        task=work.pop()
+        if(task[0]=='nop'):
+            add_run(op_queue,'nop',task[1],task[2],task[3])
+            continue
+        
+        a0,a1,b0,b1=task[1:]
+        
+        #strip common prefix and suffix
+        prefix_len=0
+        while(prefix_len<(a1-a0) and prefix_len<(b1-b0) and start_lines[a0+prefix_len]==end_lines[b0+prefix_len]):
+            prefix_len+=1
+        add_run(op_queue,'nop',a0,b0,prefix_len)
+        a0+=prefix_len
+        b0+=prefix_len
+        suffix_len=0
+        while(suffix_len<(a1-a0) and suffix_len<(b1-b0) and start_lines[a1-suffix_len-1]==end_lines[b1-suffix_len-1]):
+            suffix_len+=1
+        if(suffix_len>0):
+            work.append(('nop',a1-suffix_len,b1-suffix_len,suffix_len))
+        a1-=suffix_len
+        b1-=suffix_len
+        
+        #out of lines on one side
+        if(a0==a1):
+            add_run(op_queue,'ins',a0,b0,b1-b0)
+            continue
+        if(b0==b1):
+            add_run(op_queue,'del',a0,b0,a1-a0)
+            continue
+        
+        #small regions get an exact diff
+        if(((a1-a0+1)*(b1-b0+1))<ANCHOR_MIN_CELLS):
+            i=a0
+            j=b0
+            for op in diff_ops(start_lines[a0:a1],end_lines[b0:b1],debug=False)[0]:
+                add_run(op_queue,op[0],i,j,1)
+                i+=(1 if op[0]!='ins' else 0)
+                j+=(1 if op[0]!='del' else 0)
+            continue
+        
+        anchor_starts,anchor_ends=unique_anchors(start_lines,a0,a1,end_lines,b0,b1)
+        if(len(anchor_starts)==0):
+            for kind,i,j,count in myers_runs(start_lines[a0:a1],end_lines[b0:b1]):
+                add_run(op_queue,kind,a0+i,b0+j,count)
+            continue
+        
+        #the regions between anchors are diffed (and anchored again) on their own
+        #the gap before anchor k runs from the end of anchor k-1 (or the start of the region) to anchor k (or the end of the region)
+        #NOTE: consecutive anchors have nothing between them, so those are output together as one run of nops
+        nop_end=a1
+        for anchor_idx in range(len(anchor_starts),-1,-1):
+            gap_a0=(anchor_starts[anchor_idx-1]+1) if anchor_idx>0 else a0
+            gap_b0=(anchor_ends[anchor_idx-1]+1) if anchor_idx>0 else b0
+            gap_a1=anchor_starts[anchor_idx] if anchor_idx<len(anchor_starts) else a1
+            gap_b1=anchor_ends[anchor_idx] if anchor_idx<len(anchor_starts) else b1
+            if(gap_a0==gap_a1 and gap_b0==gap_b1):
+                continue
+            if(gap_a1<nop_end):
+                work.append(('nop',gap_a1,gap_b1,nop_end-gap_a1))
+            work.append(('diff',gap_a0,gap_a1,gap_b0,gap_b1))
+            nop_end=gap_a0
+        if(a0<nop_end):
+            work.append(('nop',a0,b0,nop_end-a0))
+    
+    #deletions and insertions from myers_runs (or which meet across regions) are paired into substitutions
+    op_queue=pair_runs(op_queue)
     
-    end_fp=open(end_file,'r')
-    end_fc=end_fp.read()
-    end_fp.close()
+    op_cnt=0
+    for op in op_queue:
+        if(op[0]!='nop'):
+            op_cnt+=op[3]
+    
+    return (op_queue,op_cnt)
+
+#index the lines of a file without reading it into memory
+#the file is memory-mapped and only the offset at which each line starts and a hash of each line are kept
+#so that lines can be compared as integers and only decoded when they're output (see index_line)
+#returns (fmap,offsets,hashes) where line idx is fmap[offsets[idx]:offsets[idx+1]-1]
+#NOTE: like str.split("\n"), a file with n newlines has n+1 lines
+def line_index(fpath):
+    with open(fpath,'rb') as fp:
+        #NOTE: an empty file can't be memory-mapped
+        if(os.fstat(fp.fileno()).st_size>0):
+            fmap=mmap.mmap(fp.fileno(),0,access=mmap.ACCESS_READ)
+        else:
+            fmap=b''
     
-    #TODO: diff in "chunks" to be more resource-efficient
+    offsets=array.array('q',[0])
+    hashes=array.array('q')
+    pos=0
+    while(True):
+        nl_idx=fmap.find(b"\n",pos)
+        line=fmap[pos:(nl_idx if nl_idx>=0 else len(fmap))]
+        #NOTE: windows line endings are treated the same as unix ones, as they were when files were read as text
+        if(line.endswith(b"\r")):
+            line=line[:-1]
+        hashes.append(hash(line))
+        if(nl_idx<0):
+            break
+        pos=nl_idx+1
+        offsets.append(pos)
     
-    op_queue,op_cnt=diff_ops(start_fc.split("\n"),end_fc.split("\n"),debug=False)
-    start_trans,diff_trans,end_trans=visual_diff(op_queue,by_line=True,use_color=use_color)
+    #the end of the last line, as if it were followed by a newline
+    offsets.append(len(fmap)+1)
+    
+    return (fmap,offsets,hashes)
+
+#get the bytes of a line from a line_index (without its line ending)
+def index_line_bytes(line_idx,idx):
+    fmap,offsets,hashes=line_idx
+    line=fmap[offsets[idx]:offsets[idx+1]-1]
+    if(line.endswith(b"\r")):
+        line=line[:-1]
+    return line
+
+#get the text of a line from a line_index
+def index_line(line_idx,idx):
+    return index_line_bytes(line_idx,idx).decode('utf-8','replace')
+
+#get the type of change for each line from a run-length op_queue (see anchored_ops), without the line text
+#this yields (diff_trans,start_idx,end_idx) in the form visual_diff uses for lines
+#where diff_trans is '' for a nop, '-' for a del, '+' for an ins, and '+/-' for a sub
+#and start_idx and end_idx are the line numbers in each file (the one which doesn't apply is not meaningful)
+def line_changes(op_queue):
+    diff_transs={'nop':'','sub':'+/-','del':'-','ins':'+'}
+    for kind,i,j,count in op_queue:
+        for k in range(0,count):
+            yield (diff_transs[kind],i+(k if kind!='ins' else 0),j+(k if kind!='del' else 0))
+
+def file_diff(start_file,end_file,show_nops=False,show_ln_diff=True,cntxt_lns=3,verbose=True,use_color=False):
+    #lines are compared by hash, and only read back from the files when they're output
+    start_idx=line_index(start_file)
+    end_idx=line_index(end_file)
+    
+    #only the regions between matching (anchor) lines are actually diffed
+    op_queue,op_cnt=anchored_ops(start_idx[2],end_idx[2])
+    line_cnt=sum([op[3] for op in op_queue])
     
     import math
     #the number of digits is the ceiling of the log base 10 of the file length
-    digits=int(math.ceil(math.log(len(diff_trans))/math.log(10)))
+    digits=int(math.ceil(math.log(line_cnt)/math.log(10)))
     
-    output_cntxt=[]
+    #the lines which have already been output
+    output_cntxt=set()
+    last_line=-1
+    
+    #get the output for line i, reading its text from the files
+    def line_out(i,diff_trans,start_ln,end_ln,show_line_nops):
+        if(diff_trans=='' and (not show_line_nops)):
+            return ''
+        start_trans=index_line(start_idx,start_ln) if diff_trans!='+' else ''
+        end_trans=index_line(end_idx,end_ln) if diff_trans!='-' else ''
+        return visual_line_diff(start_trans,diff_trans,end_trans,digits,i,show_line_nops,show_ln_diff,last_line,use_color=use_color)
     
-    for i in range(0,len(diff_trans)):
-        if(not show_nops and diff_trans[i]!=''):
-            for j in range(i-cntxt_lns,i):
-                if(j>=0 and (not j in output_cntxt)):
-                    print(visual_line_diff(start_trans[j],diff_trans[j],end_trans[j],digits,j,True,show_ln_diff,output_cntxt,use_color=use_color))
-                    output_cntxt.append(j)
+    #the lines before the current one which may be needed as context for a change
+    #and the number of lines after the last change which are still to be output as context
+    prior_lines=collections.deque(maxlen=max(cntxt_lns,0))
+    after_cntxt=0
+    
+    for i,(diff_trans,start_ln,end_ln) in enumerate(line_changes(op_queue)):
+        #two different lines with the same (64-bit) hash are matched up, which is vanishingly unlikely but would hide a change
+        #so lines are only treated as unchanged if their bytes are actually the same
+        if(diff_trans=='' and index_line_bytes(start_idx,start_ln)!=index_line_bytes(end_idx,end_ln)):
+            diff_trans='+/-'
+            op_cnt+=1
+        
+        if(not show_nops and diff_trans!=''):
+            for j,prior_trans,prior_start_ln,prior_end_ln in prior_lines:
+                if(not j in output_cntxt):
+                    print(line_out(j,prior_trans,prior_start_ln,prior_end_ln,True))
+                    output_cntxt.add(j)
+                    last_line=j
         
-        out_str=visual_line_diff(start_trans[i],diff_trans[i],end_trans[i],digits,i,show_nops,show_ln_diff,output_cntxt,use_color=use_color)
+        #lines just after a change are output as context even if they're unchanged
+        out_str=line_out(i,diff_trans,start_ln,end_ln,show_nops or (after_cntxt>0))
         if(out_str!='' and (not i in output_cntxt)):
             print(out_str)
-            output_cntxt.append(i)
+            output_cntxt.add(i)
+            last_line=i
         
-        if(not show_nops and diff_trans[i]!=''):
-            for j in range(i+1,i+1+cntxt_lns):
-                if(j<len(diff_trans) and (not j in output_cntxt)):
-                    print(visual_line_diff(start_trans[j],diff_trans[j],end_trans[j],digits,j,True,show_ln_diff,output_cntxt,use_color=use_color))
-                    output_cntxt.append(j)
+        if(not show_nops and diff_trans!=''):
+            after_cntxt=cntxt_lns
+        elif(after_cntxt>0):
+            after_cntxt-=1
+        
+        prior_lines.append((i,diff_trans,start_ln,end_ln))
     
     if(verbose):
         #this is just a summary for human uses
@@ -359,7 +941,7 @@ def file_diff(start_file,end_file,show_nops=False,show_ln_diff=True,cntxt_lns=3,
         # | head -n-2
         #to remove this output
         print('')
-        print('Info: '+str(op_cnt)+' lines changed (of '+str(len(diff_trans))+' considered lines)')
+        print('Info: '+str(op_cnt)+' lines changed (of '+str(line_cnt)+' considered lines)')
     
 
 def diff_desc(op_queue):
@@ -401,18 +983,23 @@ def diff_patch(start_str,diff_desc_str):
     
     return ret_str
 
-import os
-def get_dictionary(dict_paths=[os.getenv('HOME')+'/words.txt',os.getenv('HOME')+'/documents/dictionaries-wordlists/words.txt','/usr/dict/words','/usr/share/dict/words'],hard_fail=True):
-    
-    path=''
+DICT_PATHS=[os.getenv('HOME')+'/words.txt',os.getenv('HOME')+'/documents/dictionaries-wordlists/words.txt','/usr/dict/words','/usr/share/dict/words']
+
+#get the path of the first dictionary which exists (or None if there isn't one and hard_fail is False)
+def find_dictionary(dict_paths=DICT_PATHS,hard_fail=True):
     for dict_path in dict_paths:
         if(os.path.exists(dict_path)):
-            path=dict_path
-            break
-    else:
-        print('Error: Could not find a dictionary in the default locations')
-        if(hard_fail):
-            exit(1)
+            return dict_path
+    
+    print('Error: Could not find a dictionary in the default locations')
+    if(hard_fail):
+        exit(1)
+    return None
+
+def get_dictionary(dict_paths=DICT_PATHS,hard_fail=True):
+    
+    path=find_dictionary(dict_paths,hard_fail=hard_fail)
+    if(path is None):
         return []
     
     fp=open(path,'r')
@@ -424,69 +1011,440 @@ def get_dictionary(dict_paths=[os.getenv('HOME')+'/words.txt',os.getenv('HOME')+
 def similarity_perc(op_cnt,start_line,end_line):
     return (round((1.0-((op_cnt*1.0)/max(len(start_line),len(end_line))))*100.0,2)) if max(len(start_line),len(end_line))>0 else 100
 
+#get every string that can be made by deleting up to depth characters from word (not including word itself)
+def word_deletes(word,depth):
+    deletes=set()
+    frontier=[word]
+    for d in range(0,depth):
+        next_frontier=[]
+        for variant in frontier:
+            for i in range(0,len(variant)):
+                deleted=variant[0:i]+variant[i+1:]
+                if(not (deleted in deletes)):
+                    deletes.add(deleted)
+                    next_frontier.append(deleted)
+        frontier=next_frontier
+    return deletes
+
+#build an index of the dictionary for spellchecking (a symspell-style symmetric delete index)
+#every word is indexed under itself and under every string made by deleting up to depth characters from it;
+#two words within edit distance depth of each other always share at least one of these
+#so close words can be found by looking up the deletes of the given word, rather than by comparing against every word
+#NOTE: depth is at least 1 since a transposition of two characters is only found through a shared delete
+#returns a dict with the following keys
+#    words: the dictionary, in its original order
+#    word_set: the set of dictionary words, for exact matches
+#    depth: the number of deletes which were indexed
+#    deletes: delete string -> index in words (or a list of indices in words, when more than one word has this delete)
+def dict_index(dictionary,edit_dist=1):
+    depth=max(edit_dist,1)
+    deletes={}
+    for word_idx in range(0,len(dictionary)):
+        word=dictionary[word_idx]
+        for variant in [word]+list(word_deletes(word,depth)):
+            entry=deletes.get(variant)
+            if(entry is None):
+                deletes[variant]=word_idx
+            elif(isinstance(entry,int)):
+                if(entry!=word_idx):
+                    deletes[variant]=[entry,word_idx]
+            elif(entry[-1]!=word_idx):
+                entry.append(word_idx)
+    
+    return {
+        'words':dictionary,
+        'word_set':set(dictionary),
+        'depth':depth,
+        'deletes':deletes,
+    }
+
+#the directory in which compiled dictionary indexes (see dict_compile) are kept
+DICT_CACHE_DIR=os.path.join(os.path.expanduser('~'),'.cache','line-diff')
+
+#the header of a compiled dictionary index
+#(magic, version, depth, word count, entry count, source size, source mtime_ns)
+#NOTE: the arrays after the header are in native byte order; the index is a local cache, not a portable format
+DICT_HEADER=struct.Struct('=4sIIQQQq4x')
+DICT_MAGIC=b'LDIX'
+DICT_VERSION=1
+
+#a stable 64-bit hash of a dictionary word (or delete) for a compiled dictionary index
+#NOTE: python's hash() of a str is randomized per process so it can't be stored on disk
+def dict_hash(variant):
+    return int.from_bytes(hashlib.blake2b(variant.encode('utf-8','surrogatepass'),digest_size=8).digest(),'little')
+
+#get the path of the compiled index for a given dictionary file and depth
+def dict_cache_path(dict_path,depth,cache_dir=DICT_CACHE_DIR):
+    path_hash=hashlib.blake2b(os.path.realpath(dict_path).encode('utf-8','surrogateescape'),digest_size=8).hexdigest()
+    return os.path.join(cache_dir,os.path.basename(dict_path)+'-'+path_hash+'-d'+str(depth)+'.idx')
+
+#the number of entries dict_sort_entries sorts at a time when numpy isn't installed
+#NOTE: each entry being sorted is a python tuple (about 100 bytes), so this bounds the memory of the sort to a few tens of MB
+DICT_SORT_CHUNK=256*1024
+
+#sort the entries of a compiled dictionary index by hash and then by word index (see dict_compile)
+#hashes and idxs are parallel arrays, with idxs in increasing order as dict_compile adds them
+#returns (hashes,idxs) as new sorted arrays
+#with numpy this is an argsort; otherwise chunks of entries are sorted separately and then merged
+#so that there are never more than DICT_SORT_CHUNK entries as python objects at a time
+def dict_sort_entries(hashes,idxs):
+    if(not (numpy is None)):
+        order=numpy.argsort(numpy.frombuffer(hashes,dtype=numpy.uint64),kind='stable')
+        return (array.array('Q',numpy.frombuffer(hashes,dtype=numpy.uint64)[order].tobytes()),array.array('I',numpy.frombuffer(idxs,dtype=numpy.uint32)[order].tobytes()))
+    
+    runs=[]
+    for start in range(0,len(hashes),DICT_SORT_CHUNK):
+        chunk=sorted(zip(hashes[start:start+DICT_SORT_CHUNK],idxs[start:start+DICT_SORT_CHUNK]))
+        runs.append((array.array('Q',[entry[0] for entry in chunk]),array.array('I',[entry[1] for entry in chunk])))
+        del chunk
+    
+    #NOTE: the stable argsort above keeps entries for the same hash in index order; here the tuples compare by index
+    sorted_hashes=array.array('Q')
+    sorted_idxs=array.array('I')
+    for entry_hash,entry_idx in heapq.merge(*[zip(run_hashes,run_idxs) for run_hashes,run_idxs in runs]):
+        sorted_hashes.append(entry_hash)
+        sorted_idxs.append(entry_idx)
+    return (sorted_hashes,sorted_idxs)
+
+#write a compiled form of a dict_index to a file
+#the file is the header, then the word offsets, the sorted hashes of every word and delete, the word index for each hash, and the words
+#this is the same information as dict_index, but in a form which can be memory-mapped and used without any parsing (see dict_load)
+#the file is written to a temporary name and then renamed so a partially written index is never loaded
+def dict_compile(dict_path,cache_path,edit_dist=1):
+    st=os.stat(dict_path)
+    depth=max(edit_dist,1)
+    words=get_dictionary([dict_path])
+    
+    #every word and delete is added straight to a pair of arrays, as a list of tuples would be several times the size
+    hashes=array.array('Q')
+    idxs=array.array('I')
+    for word_idx in range(0,len(words)):
+        word=words[word_idx]
+        hashes.append(dict_hash(word))
+        idxs.append(word_idx)
+        for variant in word_deletes(word,depth):
+            hashes.append(dict_hash(variant))
+            idxs.append(word_idx)
+    #NOTE: entries for the same hash are in word index order, so candidates come out in dictionary order
+    hashes,idxs=dict_sort_entries(hashes,idxs)
+    
+    word_blob=bytearray()
+    offsets=array.array('Q')
+    for word in words:
+        offsets.append(len(word_blob))
+        word_blob+=word.encode('utf-8','surrogatepass')+b"\n"
+    offsets.append(len(word_blob))
+    
+    os.makedirs(os.path.dirname(cache_path),exist_ok=True)
+    tmp_path=cache_path+'.'+str(os.getpid())+'.tmp'
+    with open(tmp_path,'wb') as fp:
+        fp.write(DICT_HEADER.pack(DICT_MAGIC,DICT_VERSION,depth,len(words),len(hashes),st.st_size,st.st_mtime_ns))
+        fp.write(offsets.tobytes())
+        fp.write(hashes.tobytes())
+        fp.write(idxs.tobytes())
+        fp.write(word_blob)
+        #NOTE: the data is synced before the rename so that a crash can't leave a partial file under the real name
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_path,cache_path)
+
+#memory-map a compiled dictionary index (from dict_compile)
+#returns a dict with the following keys (or None if the file isn't a valid index for the given dictionary file and depth)
+#    fmap: the memory-mapped file
+#    depth: the number of deletes which were indexed
+#    offsets: the offset of each word in fmap, relative to words_pos (plus the end of the last word)
+#    hashes: the sorted dict_hash of every word and delete
+#    idxs: the word index for each entry in hashes
+#    words_pos: the offset in fmap at which the words start
+def dict_load(dict_path,cache_path,edit_dist=1):
+    try:
+        st=os.stat(dict_path)
+        fp=open(cache_path,'rb')
+    except OSError:
+        return None
+    
+    with fp:
+        idx_size=os.fstat(fp.fileno()).st_size
+        if(idx_size<DICT_HEADER.size):
+            return None
+        fmap=mmap.mmap(fp.fileno(),0,access=mmap.ACCESS_READ)
+    
+    magic,version,depth,word_cnt,entry_cnt,src_size,src_mtime_ns=DICT_HEADER.unpack_from(fmap,0)
+    #the index is rebuilt whenever the dictionary file changes
+    if((magic!=DICT_MAGIC) or (version!=DICT_VERSION) or (depth<max(edit_dist,1)) or (src_size!=st.st_size) or (src_mtime_ns!=st.st_mtime_ns)):
+        fmap.close()
+        return None
+    
+    #a truncated (or otherwise damaged) index is rebuilt rather than read past its end
+    idx_itemsize=array.array('I').itemsize
+    if((DICT_HEADER.size+((word_cnt+1)*8)+(entry_cnt*(8+idx_itemsize)))>idx_size):
+        fmap.close()
+        return None
+    
+    view=memoryview(fmap)
+    pos=DICT_HEADER.size
+    offsets=view[pos:pos+((word_cnt+1)*8)].cast('Q')
+    pos+=((word_cnt+1)*8)
+    hashes=view[pos:pos+(entry_cnt*8)].cast('Q')
+    pos+=(entry_cnt*8)
+    idxs=view[pos:pos+(entry_cnt*idx_itemsize)].cast('I')
+    pos+=(entry_cnt*idx_itemsize)
+    
+    #NOTE: the words are the end of the file, so their length is only known from the offsets
+    if((pos+offsets[word_cnt])>idx_size):
+        offsets.release()
+        hashes.release()
+        idxs.release()
+        view.release()
+        fmap.close()
+        return None
+    
+    return {
+        'fmap':fmap,
+        'depth':depth,
+        'offsets':offsets,
+        'hashes':hashes,
+        'idxs':idxs,
+        'words_pos':pos,
+    }
+
+#get the index of the dictionary for spellchecking, from its compiled form on disk if possible
+#the compiled index is (re)built when it doesn't exist or the dictionary file has changed since it was built,
+#so that after the first run startup doesn't need to read the dictionary at all
+#if the compiled index can't be written (e.g. a read-only home directory) this falls back to dict_index
+def load_dict_index(edit_dist=1,dict_paths=DICT_PATHS,cache_dir=DICT_CACHE_DIR,hard_fail=True):
+    dict_path=find_dictionary(dict_paths,hard_fail=hard_fail)
+    if(dict_path is None):
+        return dict_index([],edit_dist)
+    
+    cache_path=dict_cache_path(dict_path,max(edit_dist,1),cache_dir=cache_dir)
+    dict_idx=dict_load(dict_path,cache_path,edit_dist)
+    if(dict_idx is None):
+        try:
+            dict_compile(dict_path,cache_path,edit_dist)
+        except OSError as e:
+            print('Warn: Could not write dictionary index '+cache_path+' ('+str(e)+'); indexing in memory')
+            return dict_index(get_dictionary([dict_path]),edit_dist)
+        dict_idx=dict_load(dict_path,cache_path,edit_dist)
+    return dict_idx
+
+#get a word from a dict_index, in memory or compiled
+def dict_idx_word(dict_idx,word_idx):
+    if('words' in dict_idx):
+        return dict_idx['words'][word_idx]
+    
+    offsets=dict_idx['offsets']
+    words_pos=dict_idx['words_pos']
+    return dict_idx['fmap'][words_pos+offsets[word_idx]:words_pos+offsets[word_idx+1]-1].decode('utf-8','surrogatepass')
+
+#get every word in a dict_index, in dictionary order
+def dict_words(dict_idx):
+    if('words' in dict_idx):
+        return dict_idx['words']
+    return [dict_idx_word(dict_idx,word_idx) for word_idx in range(0,len(dict_idx['offsets'])-1)]
+
+#get the indices of the words in a dict_index which are indexed under the given string (the word itself or one of its deletes)
+def dict_lookup(dict_idx,variant):
+    if('deletes' in dict_idx):
+        entry=dict_idx['deletes'].get(variant)
+        if(entry is None):
+            return []
+        elif(isinstance(entry,int)):
+            return [entry]
+        return entry
+    
+    hashes=dict_idx['hashes']
+    variant_hash=dict_hash(variant)
+    lo=bisect.bisect_left(hashes,variant_hash)
+    hi=lo
+    while((hi<len(hashes)) and (hashes[hi]==variant_hash)):
+        hi+=1
+    return dict_idx['idxs'][lo:hi].tolist()
+
+#check whether a word is in a dict_index
+def dict_contains(dict_idx,word):
+    if('word_set' in dict_idx):
+        return (word in dict_idx['word_set'])
+    
+    #NOTE: a hash collision with a delete of some other word is possible, so the word itself is compared
+    for word_idx in dict_lookup(dict_idx,word):
+        if(dict_idx_word(dict_idx,word_idx)==word):
+            return True
+    return False
+
+#get the dictionary words which may be within edit_dist of word (or a transposition of it) from a dict_index (in memory or compiled)
+#returns the candidate words in dictionary order; these still need to be checked with diff_ops
+def dict_candidates(word,dict_idx,edit_dist=1):
+    cand_idxs=set()
+    for variant in [word]+list(word_deletes(word,max(edit_dist,1))):
+        cand_idxs.update(dict_lookup(dict_idx,variant))
+    return [dict_idx_word(dict_idx,word_idx) for word_idx in sorted(cand_idxs)]
+
+#check a given word against the dictionary without any output
+#dictionary can be a list of words or an index from dict_index or load_dict_index (which is much faster to check many words against)
+#returns (match,transpose_matches,close_matches) where close_matches is a list of (dict_word,ops,op_cnt,transposition_match)
+#for every word within edit_dist or which is a transposition, in dictionary order
+def spell_suggest(word,dictionary,edit_dist=1):
+    dict_idx=dictionary
+    if(isinstance(dict_idx,list) or dict_idx['depth']<max(edit_dist,1)):
+        dict_idx=dict_index(dictionary if isinstance(dictionary,list) else dict_words(dictionary),edit_dist)
+    
+    if(dict_contains(dict_idx,word)):
+        return (True,[],[])
+    
+    transpositions=set()
+    for i in range(1,len(word)):
+        transpositions.add(word[0:i-1]+word[i]+word[i-1]+word[i+1:])
+    
+    transpose_matches=[]
+    close_matches=[]
+    for dict_word in dict_candidates(word,dict_idx,edit_dist):
+        #words which cannot be close (just based on length difference)
+        #are skipped for efficiency
+        if(abs(len(dict_word)-len(word))>edit_dist):
+            continue
+        
+        #if this is a transposition of the given word then it is by definition close
+        transposition_match=(dict_word in transpositions)
+        if(transposition_match):
+            transpose_matches.append(dict_word)
+        elif(bounded_dist(word,dict_word,edit_dist) is None):
+            continue
+        
+        #the full diff (for its ops) is only done for words which are close
+        ops,op_cnt=cached_diff_ops(word,dict_word)
+        close_matches.append((dict_word,ops,op_cnt,transposition_match))
+    
+    return (False,transpose_matches,close_matches)
+
+#order the suggestions from spell_suggest
+#returns the transposition matches followed by the other close words, most similar first
+def spell_rank(word,transpose_matches,close_matches):
+    close_words=[]
+    op_cnts={}
+    for dict_word,ops,op_cnt,transposition_match in close_matches:
+        if(not transposition_match):
+            close_words.append(dict_word)
+            op_cnts[dict_word]=op_cnt
+    
+    #sort by similarity
+    #NOTE: this uses the edit distances found by spell_suggest rather than diffing every word again
+    close_words.reverse()
+    close_words.sort(key=lambda dict_word: (1.0-((op_cnts[dict_word]*1.0)/max(len(word),len(dict_word)))))
+    close_words.reverse()
+    
+    #include transposition matches
+    #and matches within the requested edit distance
+    return transpose_matches+close_words
+
 #check a given word against the dictionary
+#dictionary can be a list of words or an index from dict_index or load_dict_index (which is much faster to check many words against)
 def spellcheck(word,dictionary,edit_dist=1,debug=True,use_color=False):
-    match=False
+    match,transpose_matches,close_matches=spell_suggest(word,dictionary,edit_dist=edit_dist)
     close_words=[]
-    for dict_word in dictionary:
-        if(word==dict_word):
-#            print('Found word \''+word+'\' in dictionary')
-            print('CORRECT spelling for \''+word+'\'')
-            match=True
-            break
-    if(not match):
-        transpositions=[]
-        for i in range(1,len(word)):
-            transpositions.append(word[0:i-1]+word[i]+word[i-1]+word[i+1:])
-#        if(debug):
-#            print('transpositions: '+str(transpositions))
-        
-        transpose_matches=[]
-        
+    if(match):
+#        print('Found word \''+word+'\' in dictionary')
+        print('CORRECT spelling for \''+word+'\'')
+    else:
         print('')
         print('Did not find exact match in dictionary for word \''+word+'\'; checking close matches...')
-        for dict_word in dictionary:
-            #words which cannot be close (just based on length difference)
-            #are skipped for efficiency
-            if(abs(len(dict_word)-len(word))>edit_dist):
+        for dict_word,ops,op_cnt,transposition_match in close_matches:
+            if(not debug):
                 continue
             
-            #if this is a transposition of the given word then it is by definition close
-            transposition_match=False
-            for transposition in transpositions:
-                if(dict_word==transposition):
-                    transposition_match=True
-                    transpose_matches.append(dict_word)
-            
-            ops,op_cnt=diff_ops(word,dict_word,debug=False)
-            if((op_cnt<=edit_dist) or transposition_match):
-                if(not transposition_match):
-                    close_words.append(dict_word)
-                
-                if(not debug):
-                    continue
-                
-                print('Did you mean \''+dict_word+'\'? (word was \''+word+'\'; edit distance '+str(op_cnt)+'; similarity '+
-                    str(similarity_perc(op_cnt,word,dict_word))
-                    +' percent)')
-                start_trans,diff_str,end_trans=visual_diff(ops,use_color=use_color)
-                print(start_trans)
-                print(diff_str)
-                print(end_trans)
-                print('')
-        
-        #sort by similarity
-        close_words.reverse()
-        close_words.sort(key=lambda dict_word: (1.0-((diff_ops(word,dict_word,debug=False)[1]*1.0)/max(len(word),len(dict_word)))))
-        close_words.reverse()
-        
-        #include transposition matches
-        #and matches within the requested edit distance
-        close_words=transpose_matches+close_words
+            print('Did you mean \''+dict_word+'\'? (word was \''+word+'\'; edit distance '+str(op_cnt)+'; similarity '+
+                str(similarity_perc(op_cnt,word,dict_word))
+                +' percent)')
+            start_trans,diff_str,end_trans=visual_diff(ops,use_color=use_color)
+            print(start_trans)
+            print(diff_str)
+            print(end_trans)
+            print('')
+        
+        close_words=spell_rank(word,transpose_matches,close_matches)
         
         print('INCORRECT spelling for \''+word+'\'')
     return (match,close_words)
 
+#a word for batch spellchecking; letters, optionally joined by apostrophes (e.g. "don't")
+SPELL_TOKEN_RE=re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)*")
+
+#the number of unique words below which batch spellchecking doesn't start a process pool
+SPELL_POOL_MIN_WORDS=2000
+
+#the dictionary index used by spell_shard in each worker process
+spell_worker_idx=None
+
+#get the words to spellcheck from a file (or stdin), with the line number of each occurrence
+#returns an ordered dict of word -> list of line numbers (starting at 1), in the order words first appear
+def spell_tokens(fp):
+    words=collections.OrderedDict()
+    line_no=0
+    for line in fp:
+        line_no+=1
+        for word in SPELL_TOKEN_RE.findall(line):
+            line_nos=words.setdefault(word,[])
+            if((len(line_nos)==0) or (line_nos[-1]!=line_no)):
+                line_nos.append(line_no)
+    return words
+
+#set up a batch spellcheck worker process
+#NOTE: when processes are forked the index is inherited; otherwise it's loaded again (which is cheap once it's compiled)
+def spell_worker_init(edit_dist):
+    global spell_worker_idx
+    if(spell_worker_idx is None):
+        spell_worker_idx=load_dict_index(edit_dist)
+
+#spellcheck a shard of words in a worker process
+#a word is also correct if its lowercase form is in the dictionary (e.g. at the start of a sentence)
+#returns a list of (word,close_words) for each misspelled word in the shard
+def spell_shard(shard,edit_dist=1):
+    misspelled=[]
+    for word in shard:
+        if(dict_contains(spell_worker_idx,word) or dict_contains(spell_worker_idx,word.lower())):
+            continue
+        match,transpose_matches,close_matches=spell_suggest(word.lower(),spell_worker_idx,edit_dist=edit_dist)
+        misspelled.append((word,spell_rank(word.lower(),transpose_matches,close_matches)))
+    return misspelled
+
+#spellcheck every word in a file (or stdin)
+#each distinct word is only checked once and the distinct words are split into shards which are checked in parallel
+#returns (misspelled,word_cnt) where misspelled is a list of (word,line_nos,close_words) for each misspelled word,
+#in the order words first appear, and word_cnt is the number of distinct words which were checked
+def spell_batch(fp,edit_dist=1,jobs=None):
+    global spell_worker_idx
+    words=spell_tokens(fp)
+    word_list=list(words.keys())
+    
+    #the index is loaded (and compiled if needed) before any workers start, so that they don't all compile it
+    spell_worker_idx=load_dict_index(edit_dist)
+    
+    if(jobs is None):
+        jobs=os.cpu_count() or 1
+    if((jobs<2) or (len(word_list)<SPELL_POOL_MIN_WORDS)):
+        misspelled=spell_shard(word_list,edit_dist)
+    else:
+        #several shards per process so that a shard of slow words doesn't hold up the rest
+        shard_len=(len(word_list)//(jobs*4))+1
+        shards=[word_list[i:i+shard_len] for i in range(0,len(word_list),shard_len)]
+        with multiprocessing.Pool(jobs,initializer=spell_worker_init,initargs=(edit_dist,)) as pool:
+            misspelled=[]
+            for shard_misspelled in pool.starmap(spell_shard,[(shard,edit_dist) for shard in shards]):
+                misspelled+=shard_misspelled
+    
+    return ([(word,words[word],close_words) for word,close_words in misspelled],len(word_list))
+
+#print the results of spell_batch, one line per misspelled word
+#returns the number of misspelled words
+def spell_report(misspelled,word_cnt,src_name,use_color=False):
+    for word,line_nos,close_words in misspelled:
+        word_str=(del_color+word+end_color) if use_color else word
+        print(src_name+':'+','.join([str(line_no) for line_no in line_nos])+': '+word_str+
+            ' -> '+(', '.join(close_words) if len(close_words)>0 else '(no suggestions)'))
+    
+    print(str(len(misspelled))+' misspelled of '+str(word_cnt)+' distinct words in '+src_name)
+    return len(misspelled)
+
 if(__name__=='__main__'):
     import sys
     
@@ -504,8 +1462,9 @@ if(__name__=='__main__'):
         quiet_mode=True
         sys.argv=[sys.argv[0]]+sys.argv[2:]
     
-    if(len(sys.argv)<4):
-        print('Usage: '+sys.argv[0]+' [--color] [--quiet] ( [--line <start line> <end line> [spellcheck edit distance]] | [--file <start file> <end file> [--nolndiff]] | [--mkpatch <start line> <end line>] | [--appatch <start line> <patch string>] )')
+    #NOTE: --spell is the only option which takes a single argument
+    if((len(sys.argv)<4) and not ((len(sys.argv)==3) and (sys.argv[1]=='--spell'))):
+        print('Usage: '+sys.argv[0]+' [--color] [--quiet] ( [--line <start line> <end line> [spellcheck edit distance]] | [--file <start file> <end file> [--nolndiff]] | [--spell <file or - for stdin> [spellcheck edit distance]] | [--mkpatch <start line> <end line>] | [--appatch <start line> <patch string>] )')
         exit(1)
     
     #show the differences between 2 files (line by line)
@@ -550,13 +1509,30 @@ if(__name__=='__main__'):
         print('got option '+option)
         print('')
         if(option.lower().startswith('y')):
-            dictionary=get_dictionary()
+            #the dictionary index is loaded once and then checked against for both words
+            dictionary=load_dict_index(edit_dist)
             for word in [start_line,end_line]:
                 if(word.find(' ')==-1):
                     match,close_words=spellcheck(word,dictionary,edit_dist=edit_dist,use_color=use_color)
                     print('close_words='+str(close_words))
                 else:
                     print('Skipping \"'+word+'\" because it\'s not a word (it contains spaces)')
+    #spellcheck every word in a file (or stdin) without prompting, and report the misspelled ones
+    #exits with a non-zero status if anything was misspelled, so this can be used from scripts and hooks
+    elif(sys.argv[1]=='--spell'):
+        edit_dist=1
+        if(len(sys.argv)>3):
+            edit_dist=int(sys.argv[3])
+        
+        if(sys.argv[2]=='-'):
+            misspelled,word_cnt=spell_batch(sys.stdin,edit_dist=edit_dist)
+            src_name='<stdin>'
+        else:
+            with open(sys.argv[2],'r') as fp:
+                misspelled,word_cnt=spell_batch(fp,edit_dist=edit_dist)
+            src_name=sys.argv[2]
+        
+        exit(1 if spell_report(misspelled,word_cnt,src_name,use_color=use_color)>0 else 0)
     #make a character-by-character "patch" that transforms the given start line into the given end line
     elif(sys.argv[1]=='--mkpatch'):
         start_line=sys.argv[2]
@@ -570,6 +1546,6 @@ if(__name__=='__main__'):
         patch_str=sys.argv[3]
         print(diff_patch(start_line,patch_str))
     else:
-        print('Unsupported diff type '+sys.argv[1]+'; please use --file, --line, --mkpatch, or --appatch')
+        print('Unsupported diff type '+sys.argv[1]+'; please use --file, --line, --spell, --mkpatch, or --appatch')
     
 